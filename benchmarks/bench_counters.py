@@ -0,0 +1,173 @@
+"""
+bench_counters.py
+-----------------
+Measures like throughput on one hot post with a single PostCounters
+row per post against counters spread over shards
+(lambda_functions/counter_shards.py), against the local docker MySQL
+(docker-compose.yml / init.sql).
+
+Seeds one bench_* author with one post and --likers bench_* users,
+then for each mode runs --workers threads, each with its own
+connection, liking the post as distinct users with the same
+transaction like_post.py runs:
+
+    single       every like updates shard 0
+    sharded      likes go to counter_shards.pick(postid), with the
+                 rate threshold lowered so the post is hot at once
+
+and reports likes/second and p50/p99 transaction latency. Likes and
+counters are cleared between modes and the seeded users deleted at
+the end (posts, likes and counters cascade).
+
+Usage:
+    ./refresh.sh                          # or: docker-compose up -d
+    python benchmarks/bench_counters.py [--workers 1 8 32] [--likers 4000]
+
+Connection settings come from DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and
+DB_NAME (defaults match docker-compose.yml).
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions import counter_shards, datatier
+
+
+DB_HOST = os.environ.get("DB_HOST", "127.0.0.1")
+DB_PORT = int(os.environ.get("DB_PORT", "3306"))
+DB_USER = os.environ.get("DB_USER", "test_user")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "test_pass")
+DB_NAME = os.environ.get("DB_NAME", "TwitterClone")
+
+AUTHOR = "bench_author@bench"
+
+# Same statements as like_post.py runs with COUNTER_WRITE_BEHIND off
+LIKE_SQL = "INSERT INTO Likes (liker, originalpost) VALUES (%s, %s);"
+COUNTER_SQL = """
+    INSERT INTO PostCounters (postid, shard, like_count) VALUES (%s, %s, 1)
+    ON DUPLICATE KEY UPDATE like_count = like_count + 1;
+"""
+VERSION_SQL = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+
+def connect():
+    # like_post.py's connection sends its batch in one round trip
+    return datatier.get_dbConn(DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, multi_statements=True)
+
+
+def seed(likers):
+    dbConn = connect()
+    try:
+        users = [(AUTHOR, "bench_author", "bench", "https://example.com/author.png")]
+        users += [("bench_%d@bench" % i, "bench_liker_%d" % i, "bench",
+                   "https://example.com/liker_%d.png" % i) for i in range(likers)]
+
+        dbCursor = dbConn.cursor()
+        dbCursor.executemany("INSERT INTO UserInfo (userid, username, bio, picture) VALUES (%s, %s, %s, %s)", users)
+        dbCursor.execute("INSERT INTO PostInfo (userid, textcontent) VALUES (%s, 'benchmark post')", [AUTHOR])
+        postid = dbCursor.lastrowid
+        dbConn.commit()
+        dbCursor.close()
+        return postid
+    finally:
+        dbConn.close()
+
+
+def reset(postid):
+    dbConn = connect()
+    try:
+        datatier.execute_batch(dbConn, [
+            ("DELETE FROM Likes WHERE originalpost = %s;", [postid]),
+            ("DELETE FROM PostCounters WHERE postid = %s;", [postid]),
+        ])
+    finally:
+        dbConn.close()
+
+
+def cleanup():
+    dbConn = connect()
+    try:
+        datatier.perform_action(dbConn, "DELETE FROM UserInfo WHERE userid LIKE 'bench\\_%%';")
+    finally:
+        dbConn.close()
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run(postid, likers, workers, pick_shard):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(index):
+        dbConn = connect()
+        mine = []
+        try:
+            for i in range(index, likers, workers):
+                userid = "bench_%d@bench" % i
+                start = time.perf_counter()
+                datatier.execute_batch(dbConn, [
+                    (LIKE_SQL, [userid, postid]),
+                    (COUNTER_SQL, [postid, pick_shard(postid)]),
+                    (VERSION_SQL, [userid]),
+                ])
+                mine.append(time.perf_counter() - start)
+        finally:
+            dbConn.close()
+            with lock:
+                latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    dbConn = connect()
+    try:
+        row = datatier.retrieve_one_row(dbConn, """
+            SELECT SUM(like_count), COUNT(*) FROM PostCounters WHERE postid = %s
+        """, [postid])
+    finally:
+        dbConn.close()
+
+    latencies.sort()
+    return (len(latencies) / elapsed, percentile(latencies, 0.50), percentile(latencies, 0.99),
+            int(row[0] or 0), row[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--likers", type=int, default=4000, help="likes per run (one per user)")
+    parser.add_argument("--shards", type=int, default=counter_shards.COUNTER_MAX_SHARDS)
+    args = parser.parse_args()
+
+    # hot from the first like, so the sharded runs use every shard
+    picker = counter_shards.ShardPicker(threshold=0, max_shards=args.shards)
+    modes = (("single", lambda postid: 0), ("sharded", picker.pick))
+
+    cleanup()
+    postid = seed(args.likers)
+    try:
+        print("%d likes on one post, %d shards" % (args.likers, args.shards))
+        for workers in args.workers:
+            print("  %d workers" % workers)
+            for label, pick_shard in modes:
+                reset(postid)
+                rate, p50, p99, total, rows = run(postid, args.likers, workers, pick_shard)
+                print("    %-8s %8.0f likes/s  p50 %7.2f ms  p99 %7.2f ms  (count %d over %d rows)"
+                      % (label, rate, p50 * 1000, p99 * 1000, total, rows))
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+bench_drivers.py
+----------------
+Compares row decode throughput (rows/sec) of the datatier driver backends
+on the home-timeline query shape, against the local docker MySQL
+(docker-compose.yml / init.sql).
+
+Seeds BENCH_POSTS posts from a set of bench_* users followed by one
+reader, runs the timeline query through datatier.retrieve_all_rows and
+datatier.iter_rows with each installed driver, then deletes the seeded
+users (posts, follows and likes cascade).
+
+Usage:
+    ./refresh.sh                          # or: docker-compose up -d
+    pip install mysqlclient               # optional, to compare the C driver
+    python benchmarks/bench_drivers.py [--posts 5000] [--repeat 5]
+
+Connection settings come from DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and
+DB_NAME (defaults match docker-compose.yml).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions import datatier
+
+
+DB_HOST = os.environ.get("DB_HOST", "127.0.0.1")
+DB_PORT = int(os.environ.get("DB_PORT", "3306"))
+DB_USER = os.environ.get("DB_USER", "test_user")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "test_pass")
+DB_NAME = os.environ.get("DB_NAME", "TwitterClone")
+
+READER = "bench_reader@bench"
+AUTHORS = 50
+
+# Same shape as the home-timeline query in get_recent_tweets.py
+TIMELINE_SQL = """
+    SELECT DISTINCT
+        p.postid,
+        p.userid,
+        p.dateposted,
+        p.textcontent,
+        u.picture,
+        p.reply_to_postid,
+        CASE WHEN l.liker IS NOT NULL THEN 1 ELSE 0 END AS is_liked,
+        CASE WHEN r.retweetuserid IS NOT NULL THEN 1 ELSE 0 END AS is_retweeted,
+        u.username
+    FROM PostInfo p
+    JOIN UserInfo u ON p.userid = u.userid
+    LEFT JOIN Followers f ON p.userid = f.followee
+    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
+    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
+    LEFT JOIN Blocked b ON p.userid = b.blockee AND b.blocker = %s
+    WHERE (f.follower = %s OR p.userid = %s) AND p.reply_to_postid IS NULL AND b.blockee IS NULL
+    ORDER BY p.dateposted DESC
+"""
+
+
+def connect():
+    return datatier.get_dbConn(DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME)
+
+
+def seed(posts):
+    dbConn = connect()
+    try:
+        users = [(READER, "bench_reader", "bench", "https://example.com/reader.png")]
+        users += [("bench_%d@bench" % i, "bench_author_%d" % i, "bench",
+                   "https://example.com/author_%d.png" % i) for i in range(AUTHORS)]
+        follows = [(READER, "bench_%d@bench" % i) for i in range(AUTHORS)]
+        rows = [("bench_%d@bench" % (i % AUTHORS), "benchmark post number %d " % i + "x" * 120)
+                for i in range(posts)]
+
+        dbCursor = dbConn.cursor()
+        dbCursor.executemany("INSERT INTO UserInfo (userid, username, bio, picture) VALUES (%s, %s, %s, %s)", users)
+        dbCursor.executemany("INSERT INTO Followers (follower, followee) VALUES (%s, %s)", follows)
+        dbCursor.executemany("INSERT INTO PostInfo (userid, dateposted, textcontent) VALUES (%s, CURRENT_TIMESTAMP, %s)", rows)
+        dbCursor.execute("""
+            INSERT INTO Likes (liker, originalpost)
+            SELECT %s, postid FROM PostInfo WHERE userid LIKE 'bench\\_%%' AND MOD(postid, 3) = 0
+        """, [READER])
+        dbConn.commit()
+        dbCursor.close()
+    finally:
+        dbConn.close()
+
+
+def cleanup():
+    dbConn = connect()
+    try:
+        datatier.perform_action(dbConn, "DELETE FROM UserInfo WHERE userid LIKE 'bench\\_%%';")
+    finally:
+        dbConn.close()
+
+
+def measure(label, fetch, repeat):
+    best = None
+    nrows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nrows = fetch()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("  %-28s %8d rows  %8.1f ms  %12.0f rows/sec" % (label, nrows, best * 1000, nrows / best))
+
+
+def bench_driver(name, repeat):
+    datatier.set_driver(name)
+    dbConn = connect()
+    params = [READER] * 5
+
+    def fetch_all():
+        return len(datatier.retrieve_all_rows(dbConn, TIMELINE_SQL, params))
+
+    def fetch_streamed():
+        return sum(len(rows) for rows in datatier.iter_rows(dbConn, TIMELINE_SQL, params))
+
+    print(name)
+    try:
+        measure("retrieve_all_rows", fetch_all, repeat)
+        measure("iter_rows", fetch_streamed, repeat)
+    finally:
+        dbConn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    drivers = ["pymysql"]
+    if datatier.MySQLdb is not None:
+        drivers.insert(0, "mysqlclient")
+    else:
+        print("mysqlclient not installed, benchmarking pymysql only\n")
+
+    datatier.set_driver("pymysql")
+    cleanup()
+    seed(args.posts)
+    try:
+        for name in drivers:
+            bench_driver(name, args.repeat)
+    finally:
+        datatier.set_driver("pymysql")
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
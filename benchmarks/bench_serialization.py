@@ -0,0 +1,74 @@
+"""
+bench_serialization.py
+----------------------
+Compares the default (one dict per post) and compact (column arrays
+plus an authors dictionary) response formats of get_recent_tweets:
+serialization time and payload bytes for a timeline page built from
+synthetic rows. No database needed.
+
+Usage:
+    python benchmarks/bench_serialization.py [--posts 100 1000 10000] [--authors 50] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions.get_recent_tweets import serialize_rows, posts_fields
+
+
+def make_rows(posts, authors):
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(posts):
+        author = i % authors
+        rows.append((
+            20001 + i,
+            "bench_author_%d@example.com" % author,
+            start + timedelta(seconds=i),
+            "benchmark post number %d " % i + "x" * 60,
+            "https://twitterclone-pictures.s3.us-east-2.amazonaws.com/profile/%d.png" % author,
+            None,
+            i % 3 == 0,
+            i % 7 == 0,
+            "bench_author_%d" % author,
+        ))
+    return rows
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body.encode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--posts", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--authors", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print("%8s  %-8s %10s %12s" % ("posts", "format", "ms", "bytes"))
+    for posts in args.posts:
+        rows = make_rows(posts, args.authors)
+
+        rows_ms, rows_bytes = measure(lambda: json.dumps(serialize_rows(rows)), args.repeat)
+        compact_ms, compact_bytes = measure(lambda: json.dumps(posts_fields(rows, compact=True)), args.repeat)
+
+        print("%8d  %-8s %10.2f %12d" % (posts, "rows", rows_ms * 1000, rows_bytes))
+        print("%8d  %-8s %10.2f %12d   (%.0f%% of the time, %.0f%% of the bytes)" % (
+            posts, "compact", compact_ms * 1000, compact_bytes,
+            100 * compact_ms / rows_ms, 100 * compact_bytes / rows_bytes))
+
+
+if __name__ == "__main__":
+    main()
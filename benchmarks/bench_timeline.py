@@ -0,0 +1,176 @@
+"""
+bench_timeline.py
+-----------------
+Compares the cost of one home-timeline page built by the pull-based
+k-way merge engine (lambda_functions/timeline_merge.py) against the
+single SQL query over PostInfo + Followers, for readers following
+10 to 5,000 authors, against the local docker MySQL
+(docker-compose.yml / init.sql).
+
+For each followee count, seeds that many bench_* authors with
+--posts root posts each and one reader following all of them, then
+times the first page and a page deep in the timeline with:
+
+    sql          the pull query, ORDER BY ... LIMIT (no caches)
+    merge cold   timeline_merge with an empty author cache
+    merge warm   timeline_merge with the author cache filled
+
+and deletes the seeded users (posts and follows cascade).
+
+Usage:
+    ./refresh.sh                          # or: docker-compose up -d
+    python benchmarks/bench_timeline.py [--followees 10 100 1000 5000] [--posts 20]
+
+Connection settings come from DB_HOST, DB_PORT, DB_USER, DB_PASSWORD and
+DB_NAME (defaults match docker-compose.yml).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lambda_functions import datatier, timeline_merge
+from lambda_functions.get_recent_tweets import KEYSET_CLAUSE, ORDER_CLAUSE
+
+
+DB_HOST = os.environ.get("DB_HOST", "127.0.0.1")
+DB_PORT = int(os.environ.get("DB_PORT", "3306"))
+DB_USER = os.environ.get("DB_USER", "test_user")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "test_pass")
+DB_NAME = os.environ.get("DB_NAME", "TwitterClone")
+
+READER = "bench_reader@bench"
+PAGE_SIZE = 20
+
+# Same query as get_recent_tweets.py runs for TIMELINE_ENGINE=merge
+# when the caches cannot answer
+PULL_SQL = """
+    SELECT
+        p.postid,
+        p.userid,
+        p.dateposted,
+        p.textcontent,
+        u.picture,
+        p.reply_to_postid,
+        CASE WHEN l.liker IS NOT NULL THEN 1 ELSE 0 END AS is_liked,
+        CASE WHEN r.retweetuserid IS NOT NULL THEN 1 ELSE 0 END AS is_retweeted,
+        u.username
+    FROM PostInfo p
+    JOIN UserInfo u ON p.userid = u.userid
+    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
+    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
+    LEFT JOIN Blocked b ON p.userid = b.blockee AND b.blocker = %s
+    WHERE (p.userid = %s OR p.userid IN (SELECT followee FROM Followers WHERE follower = %s))
+      AND p.reply_to_postid IS NULL AND b.blockee IS NULL"""
+
+
+def connect():
+    return datatier.get_dbConn(DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME)
+
+
+def seed(followees, posts):
+    dbConn = connect()
+    try:
+        users = [(READER, "bench_reader", "bench", "https://example.com/reader.png")]
+        users += [("bench_%d@bench" % i, "bench_author_%d" % i, "bench",
+                   "https://example.com/author_%d.png" % i) for i in range(followees)]
+        follows = [(READER, "bench_%d@bench" % i) for i in range(followees)]
+
+        dbCursor = dbConn.cursor()
+        dbCursor.executemany("INSERT INTO UserInfo (userid, username, bio, picture) VALUES (%s, %s, %s, %s)", users)
+        dbCursor.executemany("INSERT INTO Followers (follower, followee) VALUES (%s, %s)", follows)
+
+        # spread posts over time so authors interleave in the merge
+        rows = [("bench_%d@bench" % (i % followees), i, "benchmark post number %d" % i)
+                for i in range(followees * posts)]
+        for start in range(0, len(rows), 5000):
+            dbCursor.executemany("""
+                INSERT INTO PostInfo (userid, dateposted, textcontent)
+                VALUES (%s, TIMESTAMP('2024-01-01') + INTERVAL %s SECOND, %s)
+            """, rows[start:start + 5000])
+        dbConn.commit()
+        dbCursor.close()
+    finally:
+        dbConn.close()
+
+
+def cleanup():
+    dbConn = connect()
+    try:
+        datatier.perform_action(dbConn, "DELETE FROM UserInfo WHERE userid LIKE 'bench\\_%%';")
+    finally:
+        dbConn.close()
+
+
+def sql_page(dbConn, after):
+    sql = PULL_SQL
+    params = [READER] * 5
+    if after is not None:
+        sql += KEYSET_CLAUSE.format(k="p")
+        params += [after[0], after[0], after[1]]
+    sql += ORDER_CLAUSE.format(k="p") + " LIMIT %s"
+    return datatier.retrieve_all_rows(dbConn, sql, params + [PAGE_SIZE + 1])
+
+
+def measure(label, fetch, repeat):
+    best = None
+    nrows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nrows = fetch()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("    %-14s %6s rows  %8.2f ms" % (label, nrows, best * 1000))
+
+
+def bench(followees, posts, repeat):
+    cleanup()
+    seed(followees, posts)
+    dbConn = connect()
+    try:
+        # a cursor half-way down the timeline, for a "deep" page
+        middle = datatier.retrieve_one_row(dbConn, """
+            SELECT dateposted, postid FROM PostInfo
+            WHERE userid LIKE 'bench\\_%%' ORDER BY dateposted DESC, postid DESC
+            LIMIT 1 OFFSET %s
+        """, [followees * posts // 2])
+        deep = (middle[0].strftime('%Y-%m-%d %H:%M:%S'), middle[1])
+
+        print("%d followees, %d posts" % (followees, followees * posts))
+        for label, after in (("first page", None), ("deep page", deep)):
+            print("  " + label)
+
+            def merged():
+                rows = timeline_merge.timeline_page(dbConn, READER, PAGE_SIZE + 1, after, cache=cache)
+                return "n/a" if rows is None else len(rows)
+
+            def merged_cold():
+                cache.clear()
+                return merged()
+
+            cache = timeline_merge.AuthorPostCache(ttl=3600)
+            measure("sql", lambda: len(sql_page(dbConn, after)), repeat)
+            measure("merge cold", merged_cold, repeat)
+            measure("merge warm", merged, repeat)
+    finally:
+        dbConn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--followees", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--posts", type=int, default=20, help="root posts per author")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        for followees in args.followees:
+            bench(followees, args.posts, args.repeat)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
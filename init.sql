@@ -6,6 +6,9 @@ FLUSH PRIVILEGES;
 USE TwitterClone;
 
 -- Drop tables in reverse dependency order to avoid FK issues
+DROP TABLE IF EXISTS CounterDeltas;
+DROP TABLE IF EXISTS PostCounters;
+DROP TABLE IF EXISTS HomeTimeline;
 DROP TABLE IF EXISTS Likes;
 DROP TABLE IF EXISTS Retweets;
 DROP TABLE IF EXISTS Blocked;
@@ -18,7 +21,16 @@ CREATE TABLE UserInfo (
     userid VARCHAR(320) PRIMARY KEY, -- userid is now going to be an EMAIL
     username VARCHAR(50) NOT NULL UNIQUE, -- squished thing mike and I discussed
     bio TEXT,
-    picture TEXT
+    picture TEXT,
+    -- root posts by this user (what the profile lists); kept by
+    -- post_tweet and delete_post
+    post_count INT NOT NULL DEFAULT 0,
+    -- bumped by every write that changes this user's home timeline, so
+    -- get_recent_tweets knows when its cached pages are stale
+    timeline_version BIGINT NOT NULL DEFAULT 0,
+    -- bumped by block_user / unblock_user for both users, so cached
+    -- block sets (block_set.py) know when they are stale
+    block_version BIGINT NOT NULL DEFAULT 0
 );
 
 CREATE TABLE PostInfo (
@@ -29,7 +41,11 @@ CREATE TABLE PostInfo (
     image_file_key TEXT NULL,
     reply_to_postid INT NULL, -- FIXME: add tests in backend
     FOREIGN KEY (userid) REFERENCES UserInfo(userid) ON DELETE CASCADE,
-    FOREIGN KEY (reply_to_postid) REFERENCES PostInfo(postid) ON DELETE CASCADE
+    FOREIGN KEY (reply_to_postid) REFERENCES PostInfo(postid) ON DELETE CASCADE,
+    -- keyset pagination (newest first) of root posts / replies to a post
+    INDEX idx_postinfo_reply_recent (reply_to_postid, dateposted, postid),
+    -- keyset pagination of one user's root posts (profile, per-author caches)
+    INDEX idx_postinfo_author_recent (userid, reply_to_postid, dateposted, postid)
 );
 
 ALTER TABLE PostInfo AUTO_INCREMENT = 20001;  -- starting value
@@ -64,4 +80,82 @@ CREATE TABLE Likes (
     PRIMARY KEY (liker, originalpost),
     FOREIGN KEY (liker) REFERENCES UserInfo(userid) ON DELETE CASCADE,
     FOREIGN KEY (originalpost) REFERENCES PostInfo(postid) ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Materialized home timeline (fan-out on write): one row per root post
+-- per user whose home timeline shows it (the author and their followers).
+-- Filled by post_tweet, backfilled by follow_user, purged by
+-- unfollow_user / block_user / delete_post. Clustered on
+-- (owner, dateposted, postid) so a timeline page is one range scan.
+CREATE TABLE HomeTimeline (
+    owner VARCHAR(320),
+    dateposted TIMESTAMP,
+    postid INT,
+    authorid VARCHAR(320),
+    PRIMARY KEY (owner, dateposted, postid),
+    INDEX idx_hometimeline_author (owner, authorid),
+    INDEX idx_hometimeline_postid (postid),
+    FOREIGN KEY (owner) REFERENCES UserInfo(userid) ON DELETE CASCADE,
+    FOREIGN KEY (authorid) REFERENCES UserInfo(userid) ON DELETE CASCADE,
+    FOREIGN KEY (postid) REFERENCES PostInfo(postid) ON DELETE CASCADE
+);
+
+-- Engagement counts per post, kept by like_post / delete_like /
+-- retweet / unretweet / post_tweet (replies) / delete_post in the same
+-- transaction as the change they count, so get_counts and
+-- get_recent_tweets read them by primary key instead of aggregating
+-- Likes, Retweets and PostInfo. A post without a row has no engagement.
+-- A hot post's likes and retweets are spread over several shard rows
+-- (counter_shards.py) so they do not queue on one row lock; a post's
+-- counts are the sum of its shards, and a single shard may be negative.
+-- Reply counts always use shard 0.
+CREATE TABLE PostCounters (
+    postid INT,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    like_count INT NOT NULL DEFAULT 0,
+    retweet_count INT NOT NULL DEFAULT 0,
+    comment_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (postid, shard),
+    FOREIGN KEY (postid) REFERENCES PostInfo(postid) ON DELETE CASCADE
+);
+
+-- Counter deltas queued by the write handlers when COUNTER_WRITE_BEHIND
+-- is on, one row per like / unlike / retweet / unretweet, in the same
+-- transaction as the change. counter_buffer.flush() sums them into
+-- PostCounters (shard 0) and deletes them; until then a post's counts
+-- read from PostCounters lag by its queued deltas.
+CREATE TABLE CounterDeltas (
+    id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    postid INT NOT NULL,
+    like_delta INT NOT NULL DEFAULT 0,
+    retweet_delta INT NOT NULL DEFAULT 0,
+    FOREIGN KEY (postid) REFERENCES PostInfo(postid) ON DELETE CASCADE
+);
+
+-- To recompute UserInfo.post_count (e.g. on a database created before it
+-- existed):
+--
+-- UPDATE UserInfo u SET post_count = (
+--     SELECT COUNT(*) FROM PostInfo p
+--     WHERE p.userid = u.userid AND p.reply_to_postid IS NULL);
+
+-- To fill HomeTimeline on a database created before it existed:
+--
+-- INSERT IGNORE INTO HomeTimeline (owner, dateposted, postid, authorid)
+--     SELECT p.userid, p.dateposted, p.postid, p.userid
+--     FROM PostInfo p WHERE p.reply_to_postid IS NULL
+--     UNION ALL
+--     SELECT f.follower, p.dateposted, p.postid, p.userid
+--     FROM PostInfo p JOIN Followers f ON f.followee = p.userid
+--     WHERE p.reply_to_postid IS NULL;
+
+-- To fill (or recompute) PostCounters from the source tables:
+--
+-- DELETE FROM CounterDeltas;
+-- DELETE FROM PostCounters WHERE shard > 0;
+-- REPLACE INTO PostCounters (postid, shard, like_count, retweet_count, comment_count)
+--     SELECT p.postid, 0,
+--            (SELECT COUNT(*) FROM Likes l WHERE l.originalpost = p.postid),
+--            (SELECT COUNT(*) FROM Retweets r WHERE r.originalpost = p.postid),
+--            (SELECT COUNT(*) FROM PostInfo c WHERE c.reply_to_postid = p.postid)
+--     FROM PostInfo p;
@@ -0,0 +1,143 @@
+#
+# block_set.py
+#
+# Per-user block sets, for filtering reads in memory instead of
+# joining Blocked into every query:
+#
+#   blocked = block_set.blocked_users(dbConn, userid)
+#   rows = [row for row in rows if row[1] not in blocked]
+#
+# A user's block set holds everyone they blocked and everyone who
+# blocked them: neither side sees the other's posts. Sets are cached
+# per container and tagged with UserInfo.block_version, which
+# block_user and unblock_user bump for both users in the same
+# transaction as the change, so a cached set is only used while it
+# is current -- whichever container did the write.
+#
+import os
+import time
+from collections import OrderedDict
+
+try:
+  import datatier
+except:
+  from . import datatier
+
+
+#
+# Cache settings: how many users' sets are kept before evicting the
+# least recently used, and for how long (seconds).
+#
+BLOCK_SET_CACHE_SIZE = int(os.environ.get("BLOCK_SET_CACHE_SIZE", "10000"))
+BLOCK_SET_CACHE_TTL = float(os.environ.get("BLOCK_SET_CACHE_TTL", "300"))
+
+
+###################################################################
+#
+# BlockSetCache:
+#
+# frozensets of blocked userids keyed by userid, each stored with the
+# block_version it was read at.
+#
+class BlockSetCache:
+  def __init__(self, size=None, ttl=None):
+    self.size = BLOCK_SET_CACHE_SIZE if size is None else size
+    self.ttl = BLOCK_SET_CACHE_TTL if ttl is None else ttl
+    self._entries = OrderedDict()   # userid -> (loaded_at, version, blocked)
+
+  def get(self, dbConn, userid, version):
+    """
+    Returns userid's block set, loading it from the database if it is
+    not cached at version or has expired
+
+    Parameters
+    __________
+    dbConn : open connection to MySQL server,
+    userid : whose block set,
+    version : the user's current block_version
+
+    Returns
+    _______
+    frozenset of userids
+    """
+    now = time.monotonic()
+    entry = self._entries.get(userid)
+    if entry is not None and entry[1] == version and now - entry[0] <= self.ttl:
+      self._entries.move_to_end(userid)
+      return entry[2]
+
+    blocked = load_block_set(dbConn, userid)
+    self._entries[userid] = (now, version, blocked)
+    self._entries.move_to_end(userid)
+    while len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+
+    return blocked
+
+  def clear(self):
+    self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+#
+# the container-wide cache used by blocked_users
+#
+_cache = BlockSetCache()
+
+
+def get_cache():
+  return _cache
+
+
+###################################################################
+#
+# load_block_set:
+#
+# Reads userid's block set in both directions: the Blocked primary
+# key (blocker, blockee) serves the first half, the blockee foreign
+# key index the second.
+#
+def load_block_set(dbConn, userid):
+  sql = """
+    SELECT blockee FROM Blocked WHERE blocker = %s
+    UNION
+    SELECT blocker FROM Blocked WHERE blockee = %s
+  """
+  rows = datatier.retrieve_all_rows(dbConn, sql, [userid, userid])
+  return frozenset(row[0] for row in rows)
+
+
+###################################################################
+#
+# blocked_users:
+#
+# userid's block set, from the cache while it is current.
+#
+def blocked_users(dbConn, userid, version=None, cache=None):
+  """
+  Returns the userids userid blocked or was blocked by
+
+  Parameters
+  __________
+  dbConn : open connection to MySQL server,
+  userid : whose block set,
+  version : the user's block_version if the caller already read
+            it; if None it is read here,
+  cache : BlockSetCache to use (default: the container's)
+
+  Returns
+  _______
+  frozenset of userids (empty for an unknown user)
+  """
+  if cache is None:
+    cache = _cache
+
+  if version is None:
+    row = datatier.retrieve_one_row(dbConn, "SELECT block_version FROM UserInfo WHERE userid = %s", [userid])
+    if not row:
+      return frozenset()
+    version = row[0]
+
+  return cache.get(dbConn, userid, version)
@@ -4,10 +4,11 @@ from configparser import ConfigParser
 import os
 try:
     import datatier
+    import datatier_async
 except:
     from . import datatier
+    from . import datatier_async
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -17,6 +18,7 @@ CORS_HEADERS = {
 }
  
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     block_user.py
@@ -28,6 +30,8 @@ def lambda_handler(event, context):
     On Success:
         - Adds a block relationship to the Blocked table
         - Removes any follower relationships between the users
+        - Removes each user's posts from the other's HomeTimeline
+          and bumps both users' timeline_version and block_version
     """
     try:
         if "body" not in event:
@@ -64,23 +68,32 @@ def lambda_handler(event, context):
         blockee_username = event_body['blockee_username']
 
         # Establishing DB connection
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_source = datatier_async.get_source(secret_name, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
-            # Check if blocker exists
+            # The prechecks are independent (the block check joins on
+            # the blockee's username), so run them concurrently
             check_blocker_sql = "SELECT userid FROM UserInfo WHERE userid = %s;"
-            blocker_result = datatier.retrieve_all_rows(db_conn, check_blocker_sql, [blocker])
-            
-            if not blocker_result:
+            check_blockee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
+
+            # Check if block already exists
+            check_block_sql = """
+                SELECT 1 FROM Blocked b
+                JOIN UserInfo u ON b.blockee = u.userid
+                WHERE b.blocker = %s AND u.username = %s;
+            """
+
+            blocker_row, blockee_row, existing_block = datatier_async.gather(
+                datatier_async.retrieve_one_row(db_source, check_blocker_sql, [blocker]),
+                datatier_async.retrieve_one_row(db_source, check_blockee_sql, [blockee_username]),
+                datatier_async.retrieve_one_row(db_source, check_block_sql, [blocker, blockee_username])
+            )
+
+            if not blocker_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -89,11 +102,7 @@ def lambda_handler(event, context):
                     })
                 }
                 
-            # Get blockee userid from username
-            check_blockee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
-            blockee_result = datatier.retrieve_all_rows(db_conn, check_blockee_sql, [blockee_username])
-            
-            if not blockee_result:
+            if not blockee_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -102,7 +111,7 @@ def lambda_handler(event, context):
                     })
                 }
             
-            blockee = blockee_result[0][0]  # Extract userid from result
+            blockee = blockee_row[0]  # Extract userid from result
             
             # Check if users are trying to block themselves
             if blocker == blockee:
@@ -114,10 +123,6 @@ def lambda_handler(event, context):
                     })
                 }
                 
-            # Check if block already exists
-            check_block_sql = "SELECT * FROM Blocked WHERE blocker = %s AND blockee = %s;"
-            existing_block = datatier.retrieve_all_rows(db_conn, check_block_sql, [blocker, blockee])
-            
             if existing_block:
                 return {
                     "statusCode": 400,
@@ -132,20 +137,36 @@ def lambda_handler(event, context):
                 INSERT INTO Blocked (blocker, blockee)
                 VALUES (%s, %s);
             """
-            datatier.perform_action(db_conn, block_sql, [blocker, blockee])
 
             # Remove any follower relationships in both directions
-            remove_follows_sql1 = """
+            remove_follows_sql = """
                 DELETE FROM Followers
                 WHERE follower = %s AND followee = %s;
             """
-            datatier.perform_action(db_conn, remove_follows_sql1, [blockee, blocker])
-            
-            remove_follows_sql2 = """
-                DELETE FROM Followers
-                WHERE follower = %s AND followee = %s;
+
+            # Purge each user's posts from the other's home timeline
+            purge_timeline_sql = """
+                DELETE FROM HomeTimeline
+                WHERE owner = %s AND authorid = %s;
             """
-            datatier.perform_action(db_conn, remove_follows_sql2, [blocker, blockee])
+
+            # Cached timeline pages and block sets of both users are
+            # stale now (timeline_cache.py, block_set.py)
+            version_sql = """
+                UPDATE UserInfo
+                SET timeline_version = timeline_version + 1, block_version = block_version + 1
+                WHERE userid IN (%s, %s);
+            """
+
+            # One round trip and one commit for all six statements
+            datatier.execute_batch(db_conn, [
+                (block_sql, [blocker, blockee]),
+                (remove_follows_sql, [blockee, blocker]),
+                (remove_follows_sql, [blocker, blockee]),
+                (purge_timeline_sql, [blocker, blockee]),
+                (purge_timeline_sql, [blockee, blocker]),
+                (version_sql, [blocker, blockee]),
+            ])
 
             return {
                 "statusCode": 200,
@@ -165,6 +186,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
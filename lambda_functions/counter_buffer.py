@@ -0,0 +1,298 @@
+#
+# counter_buffer.py
+#
+# Write-behind aggregation of PostCounters updates. Instead of
+# bumping a post's counter row in every like / retweet transaction
+# (which serializes a viral post's likes on that one row lock), the
+# handlers queue the delta as a row of its own in CounterDeltas, in
+# the same transaction as the like:
+#
+#   statements.insert(1, counter_buffer.delta_statement(postid, "like_count", 1))
+#   datatier.execute_batch(dbConn, statements)
+#   counter_buffer.flush_if_due(dbConn)
+#
+# Appending a row takes no lock another like waits for, and since
+# the delta commits (or rolls back) with the like, nothing is lost
+# when a container is frozen or reaped. The queue is shared by every
+# container: flush() claims a batch of deltas, sums them per postid
+# and applies them as one multi-row INSERT ... ON DUPLICATE KEY UPDATE,
+# deleting them in the same transaction. Write handlers flush once
+# COUNTER_FLUSH_INTERVAL seconds have passed since their container
+# last did, and the scheduled reconcile_counters run flushes every
+# minute, so counters lag by at most about a minute when writes stop.
+#
+# reconcile() recomputes counters from Likes, Retweets and PostInfo
+# and drops the queued deltas the recount already includes, a batch
+# of posts per transaction (see reconcile_counters.py).
+#
+# Off unless COUNTER_WRITE_BEHIND=1; the handlers then update
+# PostCounters in their own transaction as before.
+#
+import os
+import time
+
+try:
+  import datatier
+except:
+  from . import datatier
+
+
+COUNTER_WRITE_BEHIND = os.environ.get("COUNTER_WRITE_BEHIND", "0") == "1"
+COUNTER_FLUSH_INTERVAL = float(os.environ.get("COUNTER_FLUSH_INTERVAL", "1.0"))
+COUNTER_FLUSH_MAX_ROWS = int(os.environ.get("COUNTER_FLUSH_MAX_ROWS", "5000"))
+RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", "200"))
+
+#
+# PostCounters column -> CounterDeltas column
+#
+DELTA_COLUMNS = {"like_count": "like_delta", "retweet_count": "retweet_delta"}
+
+
+###################################################################
+#
+# delta_statement:
+#
+# (sql, parameters) queueing a delta for postid. Goes right after
+# the statement inserting or deleting the Likes / Retweets row:
+# ROW_COUNT() is 0 if that changed nothing (e.g. a concurrent
+# request undid it first), and then nothing is queued.
+#
+def delta_statement(postid, column, delta):
+  sql = f"""
+    INSERT INTO CounterDeltas (postid, {DELTA_COLUMNS[column]})
+    SELECT %s, %s FROM DUAL WHERE ROW_COUNT() > 0
+  """
+  return sql, [postid, delta]
+
+
+###################################################################
+#
+# upsert_statement:
+#
+# One INSERT ... ON DUPLICATE KEY UPDATE for all the deltas, in
+# postid order so concurrent flushes lock rows in the same order.
+# Deltas go to the post's shard 0 (a shard may go negative; readers
+# sum the shards, see counter_shards.py). They go through a derived
+# table so the join on PostInfo can drop posts deleted since.
+#
+def upsert_statement(items):
+  """
+  Returns (sql, parameters) for a list of (postid, [likes, retweets,
+  comments]) deltas
+  """
+  rows = " UNION ALL ".join(
+    ["SELECT %s AS postid, %s AS l, %s AS r, %s AS c"] +
+    ["SELECT %s, %s, %s, %s"] * (len(items) - 1))
+
+  sql = f"""
+    INSERT INTO PostCounters (postid, shard, like_count, retweet_count, comment_count)
+    SELECT d.postid, 0, d.l, d.r, d.c
+    FROM ({rows}) d
+    JOIN PostInfo p ON p.postid = d.postid
+    ORDER BY d.postid
+    ON DUPLICATE KEY UPDATE
+      like_count = PostCounters.like_count + d.l,
+      retweet_count = PostCounters.retweet_count + d.r,
+      comment_count = PostCounters.comment_count + d.c
+  """
+
+  parameters = []
+  for postid, d in items:
+    parameters += [postid] + list(d)
+
+  return sql, parameters
+
+
+###################################################################
+#
+# flush:
+#
+# Applies up to `limit` queued deltas. SKIP LOCKED lets flushes in
+# several containers split the queue instead of waiting on each
+# other; the claimed rows stay locked until the counters are
+# updated and the rows deleted, in one transaction.
+#
+def flush(dbConn, limit=None):
+  """
+  Parameters
+  __________
+  dbConn : open connection to MySQL server,
+  limit : most deltas to apply (default COUNTER_FLUSH_MAX_ROWS)
+
+  Returns
+  _______
+  number of deltas applied
+  """
+  if limit is None:
+    limit = COUNTER_FLUSH_MAX_ROWS
+
+  with datatier.transaction(dbConn):
+    rows = datatier.retrieve_all_rows(dbConn, """
+      SELECT id, postid, like_delta, retweet_delta
+      FROM CounterDeltas
+      ORDER BY id
+      LIMIT %s
+      FOR UPDATE SKIP LOCKED
+    """, [limit])
+
+    if not rows:
+      return 0
+
+    sums = {}
+    for _, postid, likes, retweets in rows:
+      d = sums.setdefault(postid, [0, 0, 0])
+      d[0] += likes
+      d[1] += retweets
+
+    items = sorted((postid, d) for postid, d in sums.items() if any(d))
+    if items:
+      datatier.perform_action(dbConn, *upsert_statement(items))
+
+    ids = [row[0] for row in rows]
+    datatier.perform_action(dbConn, "DELETE FROM CounterDeltas WHERE id IN ({})".format(
+      ", ".join(["%s"] * len(ids))), ids)
+
+  return len(rows)
+
+
+def flush_all(dbConn):
+  """
+  Flushes until the queue is empty (or only holds rows another
+  flush has claimed); returns the number of deltas applied
+  """
+  total = 0
+  while True:
+    applied = flush(dbConn)
+    total += applied
+    if applied < COUNTER_FLUSH_MAX_ROWS:
+      return total
+
+
+###################################################################
+#
+# flush_if_due:
+#
+# Flushes if this container has not flushed for COUNTER_FLUSH_INTERVAL
+# seconds. Called by the write handlers after their own commit; a
+# failed flush is logged, not raised: the like / retweet itself has
+# been written, and its delta stays queued for the next flush.
+#
+_last_flush = None   # monotonic time of this container's last flush
+
+
+def flush_if_due(dbConn):
+  global _last_flush
+
+  now = time.monotonic()
+  if _last_flush is not None and now - _last_flush < COUNTER_FLUSH_INTERVAL:
+    return 0
+
+  _last_flush = now
+  try:
+    return flush(dbConn)
+  except Exception as err:
+    print("counter_buffer.flush_if_due() failed, deltas stay queued:", str(err))
+    return 0
+
+
+###################################################################
+#
+# reconcile:
+#
+# Recomputes counters from Likes, Retweets and PostInfo, for the
+# given posts or for every post newer than `hours` -- where bursts,
+# and so any drift, happen. The posts are done RECONCILE_BATCH_SIZE
+# at a time, in postid order; the window is walked by keyset with
+# plain (non-locking) reads, so only the batch being recomputed is
+# ever locked. Each post's count is written to shard 0, its other
+# shards are dropped and its queued deltas deleted, in one
+# transaction per batch. The REPLACE ... SELECT reads the source
+# tables with shared next-key locks (REPEATABLE READ), so no like or
+# retweet of the batch's posts commits between the recount and the
+# delete: the deltas deleted are exactly those of the likes and
+# retweets counted. Keeping the batches small keeps those locks
+# short, so likes on the posts wait for one batch rather than the
+# whole window. A flush holding some of the deltas deadlocks with
+# this and one of the two is rolled back and retried, so none is
+# applied twice.
+#
+def reconcile(dbConn, postids=None, hours=None):
+  """
+  Parameters
+  __________
+  dbConn : open connection to MySQL server,
+  postids : list of postids to recompute, or
+  hours : recompute every post posted in the last `hours` hours
+
+  Returns
+  _______
+  number of rows affected (shards and deltas dropped, plus REPLACE
+  counting a changed row twice)
+  """
+  if postids is not None:
+    postids = sorted(set(postids))
+    rows = 0
+    for i in range(0, len(postids), RECONCILE_BATCH_SIZE):
+      rows += _reconcile_batch(dbConn, postids[i:i + RECONCILE_BATCH_SIZE])
+    return rows
+
+  window_sql = """
+    SELECT p.postid
+    FROM PostInfo p
+    WHERE p.dateposted >= NOW() - INTERVAL %s HOUR AND p.postid > %s
+    ORDER BY p.postid
+    LIMIT %s
+  """
+
+  rows = 0
+  last = 0
+  while True:
+    batch = [row[0] for row in datatier.retrieve_all_rows(
+      dbConn, window_sql, [hours, last, RECONCILE_BATCH_SIZE])]
+    if not batch:
+      break
+
+    rows += _reconcile_batch(dbConn, batch)
+    if len(batch) < RECONCILE_BATCH_SIZE:
+      break
+    last = batch[-1]
+
+  return rows
+
+
+def _reconcile_batch(dbConn, postids):
+  """
+  Recomputes the counters of postids in one transaction and
+  returns the number of rows affected
+  """
+  where = "p.postid IN ({})".format(", ".join(["%s"] * len(postids)))
+  parameters = list(postids)
+
+  drop_shards_sql = f"""
+    DELETE c FROM PostCounters c
+    JOIN PostInfo p ON p.postid = c.postid
+    WHERE c.shard > 0 AND {where}
+  """
+
+  recompute_sql = f"""
+    REPLACE INTO PostCounters (postid, shard, like_count, retweet_count, comment_count)
+    SELECT p.postid, 0,
+           (SELECT COUNT(*) FROM Likes l WHERE l.originalpost = p.postid),
+           (SELECT COUNT(*) FROM Retweets r WHERE r.originalpost = p.postid),
+           (SELECT COUNT(*) FROM PostInfo c WHERE c.reply_to_postid = p.postid)
+    FROM PostInfo p
+    WHERE {where}
+  """
+
+  drop_deltas_sql = f"""
+    DELETE d FROM CounterDeltas d
+    JOIN PostInfo p ON p.postid = d.postid
+    WHERE {where}
+  """
+
+  counts = datatier.execute_batch(dbConn, [
+    (drop_shards_sql, parameters),
+    (recompute_sql, parameters),
+    (drop_deltas_sql, parameters),
+  ])
+  return sum(counts)
@@ -0,0 +1,101 @@
+#
+# counter_shards.py
+#
+# Spreads a hot post's counter updates over several PostCounters
+# rows. PostCounters is keyed by (postid, shard); readers sum a
+# post's shards, so writers may use any shard:
+#
+#   shard = counter_shards.pick(postid)
+#
+# A post gets one shard (shard 0) until the rate of counter writes
+# for it in this container crosses COUNTER_SHARD_THRESHOLD per
+# second; from there the number of shards doubles each time the
+# rate passes another multiple of the threshold, up to
+# COUNTER_MAX_SHARDS, and shrinks again as the rate decays. The rate
+# is measured per container (Lambda runs one request at a time per
+# container), so the threshold is deliberately low: a container
+# spending much of its time on one post's likes is the sign of a
+# burst that many other containers are serving too.
+#
+# Individual shards may go negative (an unlike can land on a shard
+# other than the like's); only the sum is meaningful.
+#
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+COUNTER_SHARD_THRESHOLD = float(os.environ.get("COUNTER_SHARD_THRESHOLD", "5"))
+COUNTER_MAX_SHARDS = int(os.environ.get("COUNTER_MAX_SHARDS", "16"))
+
+#
+# time constant (seconds) of the write-rate estimate, and how many
+# posts' rates are tracked before the least recently written is
+# forgotten
+#
+RATE_TIME_CONSTANT = 5.0
+MAX_TRACKED_POSTS = 10000
+
+
+###################################################################
+#
+# ShardPicker:
+#
+# Per-post write rates (writes/second, exponentially decayed) and
+# the shard count they call for.
+#
+class ShardPicker:
+  def __init__(self, threshold=None, max_shards=None, tau=RATE_TIME_CONSTANT):
+    self.threshold = COUNTER_SHARD_THRESHOLD if threshold is None else threshold
+    self.max_shards = COUNTER_MAX_SHARDS if max_shards is None else max_shards
+    self.tau = tau
+    self._rates = OrderedDict()   # postid -> (rate, updated_at)
+    self._lock = threading.Lock()
+
+  def record(self, postid):
+    """
+    Counts one write to postid and returns its updated rate
+    """
+    now = time.monotonic()
+    with self._lock:
+      rate, updated_at = self._rates.get(postid, (0.0, now))
+      rate = rate * math.exp(-(now - updated_at) / self.tau) + 1.0 / self.tau
+      self._rates[postid] = (rate, now)
+      self._rates.move_to_end(postid)
+      while len(self._rates) > MAX_TRACKED_POSTS:
+        self._rates.popitem(last=False)
+    return rate
+
+  def shards_for(self, rate):
+    """
+    1 below the threshold, then the next power of two above
+    rate / threshold, capped at max_shards
+    """
+    if self.threshold <= 0:
+      return self.max_shards
+    level = int(rate / self.threshold) + 1
+    return min(self.max_shards, 1 << (level - 1).bit_length())
+
+  def pick(self, postid):
+    """
+    Records a write to postid and returns the shard to write it to
+    """
+    shards = self.shards_for(self.record(postid))
+    return random.randrange(shards) if shards > 1 else 0
+
+
+#
+# the container-wide picker used by pick
+#
+_picker = ShardPicker()
+
+
+def get_picker():
+  return _picker
+
+
+def pick(postid):
+  return _picker.pick(postid)
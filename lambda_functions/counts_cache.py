@@ -0,0 +1,144 @@
+#
+# counts_cache.py
+#
+# Per-container cache of posts' engagement counts, in front of the
+# get_counts PostCounters read:
+#
+#   rows, missing = counts_cache.get_cache().lookup(postids)
+#   fetched = ...read only the missing postids, in one batch...
+#   counts_cache.get_cache().store(missing, fetched, seconds)
+#
+# Entries are per postid, so every viewer's list shares the entries
+# of the popular posts they have all loaded. Posts without counters
+# (most of them) are cached as zeros.
+#
+# A hot post's entry would expire for every request at once; instead
+# each lookup may refresh an entry early, with a probability that
+# rises as expiry nears and with how long the read took (the
+# "XFetch" rule), so one request refetches it ahead of the others.
+#
+# Nothing invalidates entries from outside: the write handlers run
+# in containers of their own (Lambda containers share no memory),
+# and checking a per-post version in the database would cost as
+# much as reading the counts. A count served from here can therefore
+# be up to COUNTS_CACHE_TTL seconds behind a like, retweet or reply.
+#
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+
+
+#
+# Cache settings: how many posts are kept before evicting the least
+# recently used, and for how long (seconds). A size of 0 turns the
+# cache off. COUNTS_CACHE_BETA > 1 refreshes earlier, < 1 later.
+#
+COUNTS_CACHE_SIZE = int(os.environ.get("COUNTS_CACHE_SIZE", "50000"))
+COUNTS_CACHE_TTL = float(os.environ.get("COUNTS_CACHE_TTL", "5"))
+COUNTS_CACHE_BETA = float(os.environ.get("COUNTS_CACHE_BETA", "1.0"))
+
+#
+# reads are usually a few milliseconds, which alone would only
+# spread refreshes over the last few milliseconds of the TTL; the
+# read time used is at least this fraction of the TTL
+#
+MIN_REFRESH_GAP = 0.05
+
+
+###################################################################
+#
+# CountsCache:
+#
+# (postid, likes, retweets, comments) rows keyed by postid, each
+# stored with when it was read and how long the read took.
+#
+class CountsCache:
+  def __init__(self, size=None, ttl=None, beta=None):
+    self.size = COUNTS_CACHE_SIZE if size is None else size
+    self.ttl = COUNTS_CACHE_TTL if ttl is None else ttl
+    self.beta = COUNTS_CACHE_BETA if beta is None else beta
+    self._entries = OrderedDict()   # postid -> (stored_at, gap, row)
+
+  def lookup(self, postids):
+    """
+    Splits postids into the cached rows and the postids to read
+
+    Parameters
+    __________
+    postids : list of postids (without repeats)
+
+    Returns
+    _______
+    (rows, missing) : the cached rows, and the postids not cached,
+                      expired or picked for an early refresh
+    """
+    now = time.monotonic()
+    rows = []
+    missing = []
+
+    for postid in postids:
+      entry = self._entries.get(postid)
+      if entry is None:
+        missing.append(postid)
+        continue
+
+      age = now - entry[0]
+      if age > self.ttl:
+        del self._entries[postid]
+        missing.append(postid)
+      elif age - entry[1] * self.beta * math.log(1.0 - random.random()) >= self.ttl:
+        missing.append(postid)   # refreshed early, kept until then
+      else:
+        self._entries.move_to_end(postid)
+        rows.append(entry[2])
+
+    return rows, missing
+
+  def store(self, postids, rows, seconds):
+    """
+    Caches the rows read for postids; postids without a row are
+    cached as zeros
+
+    Parameters
+    __________
+    postids : the postids that were read,
+    rows : the (postid, likes, retweets, comments) rows found,
+    seconds : how long the read took
+    """
+    if self.size <= 0:
+      return
+
+    now = time.monotonic()
+    gap = max(seconds, self.ttl * MIN_REFRESH_GAP)
+
+    found = {row[0]: row for row in rows}
+    for postid in postids:
+      # rows come back with integer postids; a postid sent as
+      # anything else cannot be told to have no counters
+      if postid not in found and isinstance(postid, int) and not isinstance(postid, bool):
+        found[postid] = (postid, 0, 0, 0)
+
+    for postid, row in found.items():
+      self._entries[postid] = (now, gap, row)
+      self._entries.move_to_end(postid)
+
+    while len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+
+  def clear(self):
+    self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+#
+# the container-wide cache used by get_counts
+#
+_cache = CountsCache()
+
+
+def get_cache():
+  return _cache
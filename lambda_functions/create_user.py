@@ -1,7 +1,6 @@
 from configparser import ConfigParser
 import os
 import json
-import boto3
 from datetime import datetime
 try:
     import datatier
@@ -14,6 +13,7 @@ CORS_HEADERS = {
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     Input:
@@ -55,16 +55,10 @@ def lambda_handler(event, context):
         picture = event_body['picture']
 
         # Establish DB connection
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname)
 
         try:
             # Check if user exists
@@ -118,6 +112,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
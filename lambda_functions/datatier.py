@@ -7,46 +7,979 @@
 #   Prof. Joe Hummel
 #   Northwestern University
 #
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
 import pymysql
+from pymysql.constants import CLIENT
+
+try:
+  import MySQLdb     # mysqlclient, C-accelerated driver (optional)
+except ImportError:
+  MySQLdb = None
+
+
+#
+# Connection pool settings. Lambda keeps module state alive
+# between warm invocations, so pooled connections are reused
+# instead of paying a TCP + MySQL handshake on every request.
+#
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "4"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("DB_POOL_IDLE_TIMEOUT", "300"))
+
+#
+# Default # of rows per batch yielded by iter_rows.
+#
+ITER_CHUNK_SIZE = 500
+
+#
+# Database credentials come from Secrets Manager; the parsed
+# secret is cached per container for SECRET_TTL seconds.
+#
+SECRET_TTL = float(os.environ.get("DB_SECRET_TTL", "300"))
+
+ER_ACCESS_DENIED_ERROR = 1045
+
+#
+# Read replicas: a replica that fails to connect is skipped for
+# REPLICA_RETRY_AFTER seconds. DB_FORCE_PRIMARY=1 sends all
+# reads to the primary regardless of what the secret lists.
+#
+REPLICA_RETRY_AFTER = float(os.environ.get("DB_REPLICA_RETRY_AFTER", "30"))
+FORCE_PRIMARY = os.environ.get("DB_FORCE_PRIMARY", "") == "1"
+
+#
+# Circuit breaker: after BREAKER_THRESHOLD consecutive failed
+# connects to a server, further connects fail fast for a
+# jittered, exponentially growing period (BREAKER_BASE_DELAY
+# doubling up to BREAKER_MAX_DELAY seconds) instead of joining
+# a reconnect storm.
+#
+BREAKER_THRESHOLD = int(os.environ.get("DB_BREAKER_THRESHOLD", "2"))
+BREAKER_BASE_DELAY = float(os.environ.get("DB_BREAKER_BASE_DELAY", "1"))
+BREAKER_MAX_DELAY = float(os.environ.get("DB_BREAKER_MAX_DELAY", "30"))
+
+#
+# InnoDB deadlocks and lock wait timeouts in perform_action /
+# execute_batch are retried up to LOCK_RETRY_ATTEMPTS times in
+# total, with jittered backoff starting at LOCK_RETRY_BASE_DELAY.
+#
+LOCK_RETRY_ATTEMPTS = int(os.environ.get("DB_LOCK_RETRY_ATTEMPTS", "3"))
+LOCK_RETRY_BASE_DELAY = float(os.environ.get("DB_LOCK_RETRY_BASE_DELAY", "0.05"))
+
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+
+#
+# MySQL driver: "mysqlclient" (C, decodes rows much faster),
+# "pymysql" (pure Python), or "auto" to use mysqlclient when it
+# is installed and pymysql otherwise.
+#
+DB_DRIVER = os.environ.get("DB_DRIVER", "auto")
+
+
+###################################################################
+#
+# PyMySQLDriver / MySQLClientDriver:
+#
+# The driver-specific bits datatier needs: how to connect, the
+# unbuffered cursor class, the liveness ping and client-side
+# parameter binding. Everything else (cursor, execute, fetch*,
+# commit, rollback, nextset) is the same DB-API on both.
+#
+class PyMySQLDriver:
+  name = "pymysql"
+  unbuffered_cursor = pymysql.cursors.SSCursor
+
+  def connect(self, endpoint, portnum, username, pwd, dbname, multi_statements=False):
+    return pymysql.connect(host=endpoint,
+                           port=portnum,
+                           user=username,
+                           passwd=pwd,
+                           database=dbname,
+                           client_flag=CLIENT.MULTI_STATEMENTS if multi_statements else 0)
+
+  def ping(self, dbConn):
+    dbConn.ping(reconnect=False)
+
+  def mogrify(self, dbCursor, sql, parameters):
+    return dbCursor.mogrify(sql, parameters)
+
+
+class MySQLClientDriver:
+  name = "mysqlclient"
+
+  def __init__(self):
+    from MySQLdb.constants import CLIENT as MYSQLDB_CLIENT
+    import MySQLdb.cursors
+
+    self.unbuffered_cursor = MySQLdb.cursors.SSCursor
+    self._multi_statements_flag = MYSQLDB_CLIENT.MULTI_STATEMENTS
+
+  def connect(self, endpoint, portnum, username, pwd, dbname, multi_statements=False):
+    client_flag = self._multi_statements_flag if multi_statements else 0
+    dbConn = MySQLdb.connect(host=endpoint,
+                             port=portnum,
+                             user=username,
+                             password=pwd,
+                             database=dbname,
+                             charset="utf8mb4",
+                             client_flag=client_flag)
+    # same attribute pymysql exposes, see _allows_multi_statements
+    dbConn.client_flag = client_flag
+    return dbConn
+
+  def ping(self, dbConn):
+    dbConn.ping()
+
+  def mogrify(self, dbCursor, sql, parameters):
+    if parameters is None:
+      return sql
+    dbConn = dbCursor.connection
+    args = tuple(dbConn.literal(value) for value in parameters)
+    return (sql.encode(dbConn.encoding) % args).decode(dbConn.encoding)
+
+
+OPERATIONAL_ERRORS = (pymysql.err.OperationalError,)
+if MySQLdb is not None:
+  OPERATIONAL_ERRORS += (MySQLdb.OperationalError,)
+
+_driver = None
+
+
+###################################################################
+#
+# set_driver / get_driver:
+#
+# Selects the driver used for new connections ("auto",
+# "mysqlclient" or "pymysql"); get_driver returns the current
+# one, selecting DB_DRIVER on first use.
+#
+def set_driver(name):
+  global _driver
+
+  if name == "auto":
+    name = "mysqlclient" if MySQLdb is not None else "pymysql"
+
+  if name == "mysqlclient":
+    if MySQLdb is None:
+      raise ValueError("datatier: DB_DRIVER=mysqlclient but mysqlclient is not installed")
+    _driver = MySQLClientDriver()
+  elif name == "pymysql":
+    _driver = PyMySQLDriver()
+  else:
+    raise ValueError("datatier: unknown DB_DRIVER %r" % name)
+
+  return _driver
+
+
+def get_driver():
+  if _driver is None:
+    return set_driver(DB_DRIVER)
+  return _driver
+
+
+###################################################################
+#
+# get_dbConn:
+#
+# Opens and returns a connection object for interacting with a
+# MySQL database.
+#
+# Only connections opened with multi_statements=True accept
+# several statements in one query, which execute_batch uses to
+# send a batch in one round trip. Everything else is left
+# without it, so a query built from unescaped input cannot stack
+# a second statement.
+#
+def get_dbConn(endpoint, portnum, username, pwd, dbname, multi_statements=False):
+  """
+  Opens and returns a connection object for interacting 
+  with a MySQL database
+
+  Parameters
+  ----------
+  endpoint : machine name or IP address of server (string),
+  portnum : server port # (integer),
+  username : user name for login (string),
+  pwd : user password for login (string),
+  dbname : database name (string),
+  multi_statements : allow several statements per query, for
+                     execute_batch (boolean)
+
+  Returns
+  -------
+  a connection object
+  """
+  breaker = get_breaker(endpoint, portnum)
+  breaker.before_connect()
+
+  try:
+    dbConn = get_driver().connect(endpoint, portnum, username, pwd, dbname, multi_statements)
+
+    breaker.record_success()
+    return dbConn
+
+  except Exception as err:
+    if _is_auth_failure(err):
+      # the server is up, only the credentials are wrong
+      breaker.record_success()
+    else:
+      breaker.record_failure()
+    print("datatier.get_dbConn() failed:")
+    print(str(err))
+    raise
+
+
+###################################################################
+#
+# CircuitOpenError:
+#
+# Raised instead of connecting while a server's circuit breaker
+# is open. retry_after is the # of seconds until the next
+# connect attempt is allowed.
+#
+class CircuitOpenError(Exception):
+  def __init__(self, endpoint, retry_after):
+    super().__init__("datatier: circuit open for %s, retry in %.1fs"
+                     % (endpoint, retry_after))
+    self.retry_after = retry_after
+
+
+def _jittered_backoff(attempt, base, cap):
+  #
+  # exponential backoff with "equal jitter": half the delay is
+  # fixed, half random, so retries spread out but never bunch
+  # up near zero:
+  #
+  delay = min(cap, base * (2 ** attempt))
+  return delay / 2 + random.uniform(0, delay / 2)
+
+
+###################################################################
+#
+# CircuitBreaker:
+#
+# Per-server connect breaker. Closed: connects go through.
+# After threshold consecutive failures it opens for a jittered
+# backoff period, during which before_connect() raises
+# CircuitOpenError. When the period ends one probe connect is
+# let through (half-open): success closes the breaker, failure
+# re-opens it with twice the delay.
+#
+class CircuitBreaker:
+  def __init__(self, endpoint, threshold=BREAKER_THRESHOLD,
+               base_delay=BREAKER_BASE_DELAY, max_delay=BREAKER_MAX_DELAY):
+    self.endpoint = endpoint
+    self.threshold = threshold
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+
+    self._lock = threading.Lock()
+    self._failures = 0      # consecutive failed connects
+    self._opened = 0        # times opened since last success
+    self._open_until = 0.0
+    self._probing = False
+
+  def is_open(self):
+    with self._lock:
+      return self._open_until > time.monotonic()
+
+  def before_connect(self):
+    with self._lock:
+      now = time.monotonic()
+      if self._open_until > now:
+        raise CircuitOpenError(self.endpoint, self._open_until - now)
+
+      if self._opened > 0:
+        # half-open: only one probe at a time
+        if self._probing:
+          raise CircuitOpenError(self.endpoint, self.base_delay)
+        self._probing = True
+
+  def record_success(self):
+    with self._lock:
+      self._failures = 0
+      self._opened = 0
+      self._open_until = 0.0
+      self._probing = False
+
+  def record_failure(self):
+    with self._lock:
+      self._failures += 1
+      self._probing = False
+      if self._failures >= self.threshold or self._opened > 0:
+        delay = _jittered_backoff(self._opened, self.base_delay, self.max_delay)
+        self._opened += 1
+        self._open_until = time.monotonic() + delay
+        print("datatier: circuit opened for %s for %.1fs" % (self.endpoint, delay))
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint, portnum):
+  """
+  Returns the circuit breaker shared by all connects to this
+  server
+  """
+  key = "%s:%s" % (endpoint, portnum)
+
+  with _breakers_lock:
+    breaker = _breakers.get(key)
+    if breaker is None:
+      breaker = CircuitBreaker(key)
+      _breakers[key] = breaker
+    return breaker
+
+
+###################################################################
+#
+# PoolExhaustedError:
+#
+# Raised by ConnectionPool.checkout() when every connection in
+# the pool is already checked out.
+#
+class PoolExhaustedError(Exception):
+  pass
+
+
+###################################################################
+#
+# ConnectionPool:
+#
+# A bounded set of open connections for one server/user/database.
+# Connections are handed out with checkout() and given back with
+# checkin(); idle connections older than idle_timeout seconds are
+# closed, and every reused connection is pinged first so a dead
+# socket is never handed to a caller.
+#
+class ConnectionPool:
+  """
+  Bounded pool of MySQL connections sharing one set of
+  connection parameters
+
+  Parameters
+  ----------
+  endpoint, portnum, username, pwd, dbname,
+  multi_statements : see get_dbConn,
+  max_size : max # of connections open at once (integer),
+  idle_timeout : seconds an idle connection is kept (float)
+  """
+
+  def __init__(self, endpoint, portnum, username, pwd, dbname,
+               max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+               multi_statements=False):
+    self.endpoint = endpoint
+    self.portnum = portnum
+    self.username = username
+    self.pwd = pwd
+    self.dbname = dbname
+    self.multi_statements = multi_statements
+    self.max_size = max_size
+    self.idle_timeout = idle_timeout
+
+    self._lock = threading.Lock()
+    self._idle = []         # [(dbConn, time returned)], newest last
+    self._checked_out = {}  # id(dbConn) -> dbConn
+
+  def owns(self, dbConn):
+    with self._lock:
+      return id(dbConn) in self._checked_out
+
+  def size(self):
+    """
+    Returns the # of connections currently open (idle + checked out)
+    """
+    with self._lock:
+      return len(self._idle) + len(self._checked_out)
+
+  def checkout(self):
+    """
+    Returns a live connection, reusing an idle one when possible
+
+    Raises
+    ------
+    PoolExhaustedError if max_size connections are checked out
+    """
+    while True:
+      with self._lock:
+        expired = self._evict_expired(time.monotonic())
+        if self._idle:
+          dbConn, _ = self._idle.pop()
+        elif len(self._checked_out) < self.max_size:
+          dbConn = None
+        else:
+          raise PoolExhaustedError(
+            "datatier: all %d pooled connections are in use" % self.max_size)
+
+      for stale in expired:
+        _close_quietly(stale)
+
+      if dbConn is None:
+        break
+
+      if _is_alive(dbConn):
+        with self._lock:
+          self._checked_out[id(dbConn)] = dbConn
+        return dbConn
+
+      _close_quietly(dbConn)
+
+    #
+    # nothing idle, open a new connection; reserve the slot first
+    # so concurrent checkouts cannot overshoot max_size:
+    #
+    placeholder = object()
+    with self._lock:
+      self._checked_out[id(placeholder)] = placeholder
+
+    try:
+      dbConn = get_dbConn(self.endpoint, self.portnum, self.username,
+                          self.pwd, self.dbname, self.multi_statements)
+    finally:
+      with self._lock:
+        del self._checked_out[id(placeholder)]
+
+    with self._lock:
+      self._checked_out[id(dbConn)] = dbConn
+    return dbConn
+
+  def checkin(self, dbConn):
+    """
+    Returns a connection obtained from checkout() to the pool
+    """
+    with self._lock:
+      self._checked_out.pop(id(dbConn), None)
+
+    #
+    # end any open transaction; otherwise a reused connection
+    # would keep reading from the previous invocation's
+    # REPEATABLE READ snapshot:
+    #
+    try:
+      dbConn.rollback()
+    except Exception:
+      _close_quietly(dbConn)
+      return
+
+    with self._lock:
+      if dbConn.open and len(self._idle) < self.max_size:
+        self._idle.append((dbConn, time.monotonic()))
+        return
+
+    _close_quietly(dbConn)
+
+  def close(self):
+    """
+    Closes every idle connection in the pool
+    """
+    with self._lock:
+      idle = [dbConn for dbConn, _ in self._idle]
+      self._idle = []
+
+    for dbConn in idle:
+      _close_quietly(dbConn)
+
+  def _evict_expired(self, now):
+    # caller holds self._lock
+    keep = []
+    expired = []
+    for dbConn, returned in self._idle:
+      if now - returned > self.idle_timeout:
+        expired.append(dbConn)
+      else:
+        keep.append((dbConn, returned))
+    self._idle = keep
+    return expired
+
+
+def _is_alive(dbConn):
+  try:
+    get_driver().ping(dbConn)
+    return True
+  except Exception:
+    return False
+
+
+def _close_quietly(dbConn):
+  try:
+    dbConn.close()
+  except Exception:
+    pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+###################################################################
+#
+# get_pool:
+#
+# Returns the module-level pool for the given connection
+# parameters, creating it on first use. The pool lives as long
+# as the Lambda container does. Connections with and without
+# multi_statements are kept in separate pools.
+#
+def get_pool(endpoint, portnum, username, pwd, dbname, multi_statements=False):
+  """
+  Returns the shared ConnectionPool for these connection
+  parameters
+
+  Parameters
+  ----------
+  see get_dbConn
+
+  Returns
+  -------
+  a ConnectionPool
+  """
+  key = (endpoint, portnum, username, dbname, multi_statements)
+
+  with _pools_lock:
+    pool = _pools.get(key)
+    if pool is None:
+      pool = ConnectionPool(endpoint, portnum, username, pwd, dbname,
+                            multi_statements=multi_statements)
+      _pools[key] = pool
+    else:
+      # password may have been rotated; new connections use it
+      pool.pwd = pwd
+
+  return pool
+
+
+###################################################################
+#
+# checkout_dbConn:
+#
+# Pooled replacement for get_dbConn. Every connection obtained
+# this way must be handed back with return_dbConn when the
+# handler is done with it.
+#
+# An open circuit breaker raising out of here reaches the caller,
+# so the invocation is marked circuit_open (see instrument_handler).
+# Internal fallbacks, such as trying the next replica, use
+# _checkout_pooled, which does not mark it.
+#
+def checkout_dbConn(endpoint, portnum, username, pwd, dbname, multi_statements=False):
+  """
+  Returns a live connection from the shared pool
+
+  Parameters
+  ----------
+  see get_dbConn
+
+  Returns
+  -------
+  a connection object
+  """
+  try:
+    return _checkout_pooled(endpoint, portnum, username, pwd, dbname, multi_statements)
+
+  except CircuitOpenError as err:
+    _note_circuit_open(err.retry_after)
+    raise
+
+
+def _checkout_pooled(endpoint, portnum, username, pwd, dbname, multi_statements=False):
+  start = time.perf_counter()
+
+  try:
+    return get_pool(endpoint, portnum, username, pwd, dbname, multi_statements).checkout()
+
+  except Exception as err:
+    print("datatier.checkout_dbConn() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    _record_acquire(time.perf_counter() - start)
+
+
+###################################################################
+#
+# return_dbConn:
+#
+# Gives a connection from checkout_dbConn back to its pool. A
+# connection that does not belong to any pool is closed.
+#
+def return_dbConn(dbConn):
+  """
+  Returns a connection to the pool it was checked out from
+
+  Parameters
+  ----------
+  dbConn : connection returned by checkout_dbConn
+  """
+  if isinstance(dbConn, RoutedConnection):
+    dbConn.release()
+    return
+
+  with _pools_lock:
+    pools = list(_pools.values())
+
+  for pool in pools:
+    if pool.owns(dbConn):
+      pool.checkin(dbConn)
+      return
+
+  _close_quietly(dbConn)
+
+
+###################################################################
+#
+# close_pools:
+#
+# Closes all idle pooled connections and forgets every pool.
+#
+def close_pools():
+  with _pools_lock:
+    pools = list(_pools.values())
+    _pools.clear()
+
+  for pool in pools:
+    pool.close()
+
+
+_secrets = {}             # secret name -> (parsed secret, time fetched)
+_secrets_lock = threading.Lock()
+_secrets_client = None
+
+
+###################################################################
+#
+# set_secrets_client:
+#
+# Overrides the Secrets Manager client used by get_db_secret,
+# e.g. with a local stub in tests. Passing None restores the
+# default boto3 client. Clears the secret cache.
+#
+def set_secrets_client(client):
+  global _secrets_client
+
+  with _secrets_lock:
+    _secrets_client = client
+    _secrets.clear()
+
+
+def _get_secrets_client():
+  global _secrets_client
+
+  if _secrets_client is None:
+    import boto3
+    _secrets_client = boto3.client('secretsmanager')
+
+  return _secrets_client
+
+
+###################################################################
+#
+# get_db_secret:
+#
+# Returns the parsed JSON secret with the database credentials,
+# only calling Secrets Manager when the cached copy is older
+# than SECRET_TTL or a refresh is forced.
+#
+def get_db_secret(secret_name, force_refresh=False, ttl=None):
+  """
+  Returns the secret as a dictionary (host, port, username,
+  password, ...), cached per container
+
+  Parameters
+  ----------
+  secret_name : Secrets Manager secret id (string),
+  force_refresh : bypass the cache (boolean),
+  ttl : cache lifetime in seconds, defaults to SECRET_TTL
+
+  Returns
+  -------
+  the parsed secret (dictionary)
+  """
+  if ttl is None:
+    ttl = SECRET_TTL
+
+  with _secrets_lock:
+    cached = _secrets.get(secret_name)
+    if cached is not None and not force_refresh:
+      secret, fetched = cached
+      if time.monotonic() - fetched < ttl:
+        return secret
+
+    try:
+      response = _get_secrets_client().get_secret_value(SecretId=secret_name)
+      secret = json.loads(response['SecretString'])
+
+    except Exception as err:
+      print("datatier.get_db_secret() failed:")
+      print(str(err))
+      raise
+
+    _secrets[secret_name] = (secret, time.monotonic())
+    return secret
+
+
+def _is_auth_failure(err):
+  return isinstance(err, OPERATIONAL_ERRORS) \
+    and len(err.args) > 0 and err.args[0] == ER_ACCESS_DENIED_ERROR
+
+
+def _checkout_with_secret(secret_name, checkout):
+  #
+  # calls checkout(secret); if MySQL rejects the password the
+  # secret has probably been rotated, so refresh and retry once:
+  #
+  secret = get_db_secret(secret_name)
+
+  try:
+    return checkout(secret)
+
+  except OPERATIONAL_ERRORS as err:
+    if not _is_auth_failure(err):
+      raise
+
+    print("datatier: access denied, refreshing secret", secret_name)
+    secret = get_db_secret(secret_name, force_refresh=True)
+    return checkout(secret)
+
+
+def _checkout_primary(secret, dbname, multi_statements=False):
+  return checkout_dbConn(secret['host'], secret['port'], secret['username'],
+                         secret['password'], dbname, multi_statements)
+
+
+###################################################################
+#
+# checkout_dbConn_from_secret:
+#
+# Looks up the credentials in the (cached) secret and checks a
+# connection out of the matching pool. If MySQL rejects the
+# password, the secret has probably been rotated: the cache is
+# refreshed and the checkout retried once.
+#
+# With use_replicas=True and read replicas listed in the secret
+# (see replica_endpoints), a RoutedConnection is returned
+# instead: retrieve_* queries go to a replica and
+# perform_action / execute_batch go to the primary.
+#
+def checkout_dbConn_from_secret(secret_name, dbname, use_replicas=False,
+                                multi_statements=False):
+  """
+  Returns a pooled connection using credentials stored in
+  Secrets Manager
+
+  Parameters
+  ----------
+  secret_name : Secrets Manager secret id (string),
+  dbname : database name (string),
+  use_replicas : send reads to read replicas if any (boolean),
+  multi_statements : a primary connection that execute_batch
+                     can send in one round trip (boolean)
+
+  Returns
+  -------
+  a connection object; hand it back with return_dbConn
+  """
+  if use_replicas and not FORCE_PRIMARY:
+    if replica_endpoints(get_db_secret(secret_name)):
+      return RoutedConnection(secret_name, dbname)
+
+  return _checkout_with_secret(secret_name,
+                               lambda secret: _checkout_primary(secret, dbname, multi_statements))
 
 
 ###################################################################
 #
-# get_dbConn:
+# replica_endpoints:
 #
-# Opens and returns a connection object for interacting with a
-# MySQL database.
+# Returns the read replicas listed in the secret under
+# "read_replicas" as a list of (host, port). Entries may be
+# "host", "host:port" or {"host": ..., "port": ...}; the port
+# defaults to the primary's.
 #
-def get_dbConn(endpoint, portnum, username, pwd, dbname):
+def replica_endpoints(secret):
+  endpoints = []
+
+  for entry in secret.get('read_replicas') or []:
+    if isinstance(entry, dict):
+      endpoints.append((entry['host'], int(entry.get('port', secret['port']))))
+    else:
+      host, _, port = str(entry).partition(':')
+      endpoints.append((host, int(port) if port else int(secret['port'])))
+
+  return endpoints
+
+
+_replica_down_until = {}  # (host, port) -> time it may be tried again
+_replica_next = 0
+_replica_lock = threading.Lock()
+
+
+def mark_replica_down(host, portnum, seconds=None):
   """
-  Opens and returns a connection object for interacting 
-  with a MySQL database
+  Takes a replica out of rotation for seconds (default
+  REPLICA_RETRY_AFTER)
+  """
+  if seconds is None:
+    seconds = REPLICA_RETRY_AFTER
+
+  with _replica_lock:
+    _replica_down_until[(host, portnum)] = time.monotonic() + seconds
+
+
+def replica_is_healthy(host, portnum):
+  with _replica_lock:
+    return _replica_down_until.get((host, portnum), 0) <= time.monotonic()
+
+
+###################################################################
+#
+# checkout_replica_dbConn:
+#
+# Checks out a connection to the next healthy replica in
+# round-robin order. A replica that cannot be reached is marked
+# down and the next one is tried. Returns None when no replica
+# is usable, in which case callers fall back to the primary.
+#
+def checkout_replica_dbConn(endpoints, username, pwd, dbname):
+  """
+  Returns a pooled connection to a healthy read replica, or None
 
   Parameters
   ----------
-  endpoint : machine name or IP address of server (string),
-  portnum : server port # (integer),
-  username : user name for login (string),
-  pwd : user password for login (string),
-  dbname : database name (string)
+  endpoints : list of (host, port) pairs,
+  username, pwd, dbname : see get_dbConn
 
   Returns
   -------
-  a connection object
+  a connection object, or None if every replica is down
   """
-  try:
-    dbConn = pymysql.connect(host=endpoint,
-                             port=portnum,
-                             user=username,
-                             passwd=pwd,
-                             database=dbname)
+  global _replica_next
 
-    return dbConn
+  with _replica_lock:
+    start = _replica_next
+    _replica_next += 1
 
-  except Exception as err:
-    print("datatier.get_dbConn() failed:")
-    print(str(err))
-    raise
+  for i in range(len(endpoints)):
+    host, portnum = endpoints[(start + i) % len(endpoints)]
+    if not replica_is_healthy(host, portnum):
+      continue
+
+    try:
+      return _checkout_pooled(host, portnum, username, pwd, dbname)
+
+    except OPERATIONAL_ERRORS as err:
+      if _is_auth_failure(err):
+        raise
+      mark_replica_down(host, portnum)
+
+    except Exception:
+      mark_replica_down(host, portnum)
+
+  return None
+
+
+###################################################################
+#
+# RoutedConnection:
+#
+# Stands in for a connection when reads may go to a replica.
+# Both underlying connections are checked out lazily, so a
+# read-only invocation never touches the primary. Once anything
+# is written (or force_primary is set) all further reads use the
+# primary, so a handler always reads its own writes.
+#
+class RoutedConnection:
+  """
+  Primary + read replica pair for one invocation; pass it to the
+  datatier functions like any other connection and give it back
+  with return_dbConn
+
+  Parameters
+  ----------
+  secret_name : Secrets Manager secret id (string),
+  dbname : database name (string),
+  force_primary : send reads to the primary too (boolean)
+  """
+
+  def __init__(self, secret_name, dbname, force_primary=False):
+    self.secret_name = secret_name
+    self.dbname = dbname
+    self.force_primary = force_primary
+    self._primary = None
+    self._replica = None
+
+  def primary(self):
+    if self._primary is None:
+      self._primary = _checkout_with_secret(
+        self.secret_name, lambda secret: _checkout_primary(secret, self.dbname))
+    return self._primary
+
+  def reader(self):
+    if self.force_primary or FORCE_PRIMARY:
+      return self.primary()
+
+    if self._replica is None:
+      self._replica = _checkout_with_secret(
+        self.secret_name,
+        lambda secret: checkout_replica_dbConn(replica_endpoints(secret),
+                                               secret['username'],
+                                               secret['password'],
+                                               self.dbname))
+      if self._replica is None:
+        # every replica is down, read from the primary
+        self.force_primary = True
+        return self.primary()
+
+    return self._replica
+
+  def cursor(self, *args):
+    return self.primary().cursor(*args)
+
+  def commit(self):
+    if self._primary is not None:
+      self._primary.commit()
+
+  def rollback(self):
+    if self._primary is not None:
+      self._primary.rollback()
+
+  def release(self):
+    """
+    Returns both underlying connections to their pools
+    """
+    for dbConn in (self._primary, self._replica):
+      if dbConn is not None:
+        return_dbConn(dbConn)
+    self._primary = None
+    self._replica = None
+
+
+def _reader(dbConn):
+  # connection to run a SELECT on
+  if isinstance(dbConn, RoutedConnection):
+    if _in_transaction(dbConn):
+      return _writer(dbConn)
+    return dbConn.reader()
+  return dbConn
+
+
+def _writer(dbConn):
+  # connection to run an action query on
+  if isinstance(dbConn, RoutedConnection):
+    dbConn.force_primary = True
+    return dbConn.primary()
+  return dbConn
 
 
 ##################################################################
@@ -76,7 +1009,9 @@ def retrieve_one_row(dbConn, sql, parameters=[]):
   First row as a tuple, or () if SELECT retrieves no data
   """
 
-  dbCursor = dbConn.cursor()
+  dbCursor = _reader(dbConn).cursor()
+  start = time.perf_counter()
+  nrows = 0
 
   try:
     dbCursor.execute(sql, parameters)
@@ -84,6 +1019,7 @@ def retrieve_one_row(dbConn, sql, parameters=[]):
     if row is None:  # executed successfully, but no data was retrieved
       return ()
     else:
+      nrows = 1
       return row
 
   except Exception as err:
@@ -93,6 +1029,7 @@ def retrieve_one_row(dbConn, sql, parameters=[]):
 
   finally:
     dbCursor.close()
+    _record_query(sql, time.perf_counter() - start, nrows)
 
 
 ##################################################################
@@ -123,7 +1060,9 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
   data
   """
 
-  dbCursor = dbConn.cursor()
+  dbCursor = _reader(dbConn).cursor()
+  start = time.perf_counter()
+  nrows = 0
 
   try:
     dbCursor.execute(sql, parameters)
@@ -131,6 +1070,7 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
     if rows is None:  # executed successfully, but no data was retrieved
       return []
     else:
+      nrows = len(rows)
       return rows
 
   except Exception as err:
@@ -140,6 +1080,66 @@ def retrieve_all_rows(dbConn, sql, parameters=[]):
 
   finally:
     dbCursor.close()
+    _record_query(sql, time.perf_counter() - start, nrows)
+
+
+##################################################################
+#
+# iter_rows:
+#
+# Given a database connection and an SQL Select query,
+# executes this query with an unbuffered server-side cursor
+# and yields the rows in lists of at most chunk_size tuples,
+# so large result sets never sit in memory all at once. The
+# query can be parameterized using %s, in which case pass the
+# values as a list [value1, value2, ...]
+#
+# NOTE: the connection cannot run other queries until the
+# generator is exhausted or closed.
+#
+def iter_rows(dbConn, sql, parameters=[], chunk_size=ITER_CHUNK_SIZE):
+  """
+  Executes an sql SELECT query against the database connection
+  and yields the rows in batches
+
+  Parameters
+  __________
+  dbConn : the database connection,
+  sql : the SQL SELECT query (can be parameterized with %s),
+  parameters: optional list of values if parameterized,
+  chunk_size: max # of rows per batch
+
+  Returns
+  _______
+  Generator of lists of tuples; yields nothing if SELECT
+  retrieves no data
+  """
+
+  dbCursor = _reader(dbConn).cursor(get_driver().unbuffered_cursor)
+  elapsed = 0.0  # time spent in the database, not in the caller
+  nrows = 0
+
+  try:
+    start = time.perf_counter()
+    dbCursor.execute(sql, parameters)
+    while True:
+      rows = dbCursor.fetchmany(chunk_size)
+      elapsed += time.perf_counter() - start
+      if not rows:
+        return
+      nrows += len(rows)
+      yield rows
+      start = time.perf_counter()
+
+  except Exception as err:
+    print("datatier.iter_rows() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    # also drains any unread rows if the caller stopped early:
+    dbCursor.close()
+    _record_query(sql, elapsed, nrows)
 
 
 ###############################################################
@@ -171,21 +1171,483 @@ def perform_action(dbConn, sql, parameters=[]):
   the query made no modifications)
   """
 
-  dbCursor = dbConn.cursor()
+  writer = _writer(dbConn)
+  dbCursor = writer.cursor()
+  in_transaction = _in_transaction(dbConn)
+  start = time.perf_counter()
+  nrows = 0
 
   try:
     # try to execute, and if successful commit the changes
-    # and return the # of rows modified by the query:
-    dbCursor.execute(sql, parameters)
-    dbConn.commit()
-    return dbCursor.rowcount
+    # and return the # of rows modified by the query; inside
+    # transaction() the commit happens when the block exits:
+    attempt = 0
+    while True:
+      try:
+        dbCursor.execute(sql, parameters)
+        if not in_transaction:
+          writer.commit()
+        break
+
+      except OPERATIONAL_ERRORS as err:
+        attempt += 1
+        if not _should_retry_lock_error(err, attempt, in_transaction):
+          raise
+        writer.rollback()
+        _sleep_before_lock_retry("perform_action", err, attempt)
+
+    nrows = dbCursor.rowcount
+    return nrows
 
   except Exception as err:
     # failed, rollback any possible changes and log error:
-    dbConn.rollback()
+    if not in_transaction:
+      writer.rollback()
     print("datatier.perform_action() failed:")
     print(str(err))
     raise
 
   finally:
     dbCursor.close()
+    _record_query(sql, time.perf_counter() - start, nrows)
+
+
+###############################################################
+#
+# execute_batch:
+#
+# Given a database connection and a list of (sql, parameters)
+# action queries, executes them all and commits once. When
+# the connection was opened with multi_statements (see
+# get_dbConn) the whole batch is sent in a single round trip;
+# otherwise the statements are sent one at a time.
+# Returns the number of rows modified by each statement.
+#
+def execute_batch(dbConn, statements):
+  """
+  Executes several sql ACTION queries with a single commit and
+  returns the number of rows modified by each
+
+  Parameters
+  __________
+  dbConn : the database connection,
+  statements : list of (sql, parameters) pairs, where parameters
+               is a list of values or None
+
+  Returns
+  _______
+  list with the number of rows modified by each statement
+  """
+
+  writer = _writer(dbConn)
+  dbCursor = writer.cursor()
+  in_transaction = _in_transaction(dbConn)
+  start = time.perf_counter()
+  counts = []
+
+  try:
+    attempt = 0
+    while True:
+      try:
+        counts = _execute_statements(writer, dbCursor, statements)
+        if not in_transaction:
+          writer.commit()
+        return counts
+
+      except OPERATIONAL_ERRORS as err:
+        attempt += 1
+        if not _should_retry_lock_error(err, attempt, in_transaction):
+          raise
+        writer.rollback()
+        _sleep_before_lock_retry("execute_batch", err, attempt)
+
+  except Exception as err:
+    if not in_transaction:
+      writer.rollback()
+    print("datatier.execute_batch() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    dbCursor.close()
+    _record_query("; ".join(stmt for stmt, _ in statements),
+                  time.perf_counter() - start, sum(counts))
+
+
+def _execute_statements(writer, dbCursor, statements):
+  if len(statements) > 1 and _allows_multi_statements(writer):
+    # bind parameters client-side and send one query:
+    sql = ";\n".join(
+      get_driver().mogrify(dbCursor, stmt.strip().rstrip(";"), parameters or None)
+      for stmt, parameters in statements)
+    dbCursor.execute(sql)
+    counts = [dbCursor.rowcount]
+    while dbCursor.nextset():
+      counts.append(dbCursor.rowcount)
+  else:
+    counts = []
+    for stmt, parameters in statements:
+      dbCursor.execute(stmt, parameters or None)
+      counts.append(dbCursor.rowcount)
+
+  return counts
+
+
+def _should_retry_lock_error(err, attempt, in_transaction):
+  #
+  # a deadlock rolls back the whole transaction, so statements
+  # inside transaction() cannot be replayed one by one; the
+  # caller owning the transaction must retry it as a whole:
+  #
+  return not in_transaction \
+    and len(err.args) > 0 \
+    and err.args[0] in (ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT) \
+    and attempt < LOCK_RETRY_ATTEMPTS
+
+
+def _sleep_before_lock_retry(name, err, attempt):
+  print("datatier.%s(): %s, retry %d of %d"
+        % (name, str(err), attempt, LOCK_RETRY_ATTEMPTS - 1))
+  time.sleep(_jittered_backoff(attempt - 1, LOCK_RETRY_BASE_DELAY,
+                               LOCK_RETRY_BASE_DELAY * 8))
+
+
+def _allows_multi_statements(dbConn):
+  # both drivers use the same MULTI_STATEMENTS bit
+  return bool(getattr(dbConn, "client_flag", 0) & CLIENT.MULTI_STATEMENTS)
+
+
+_transactions = set()     # id() of connections inside transaction()
+_transactions_lock = threading.Lock()
+
+
+def _in_transaction(dbConn):
+  with _transactions_lock:
+    return id(dbConn) in _transactions
+
+
+###############################################################
+#
+# transaction:
+#
+# Context manager that groups every perform_action and
+# execute_batch call in its block into one transaction:
+# committed once when the block exits normally, rolled back
+# if it raises. Nested transaction() blocks join the
+# outermost one.
+#
+#   with datatier.transaction(dbConn):
+#     datatier.perform_action(dbConn, sql1, [...])
+#     datatier.perform_action(dbConn, sql2, [...])
+#
+@contextmanager
+def transaction(dbConn):
+  with _transactions_lock:
+    nested = id(dbConn) in _transactions
+    _transactions.add(id(dbConn))
+
+  if nested:
+    yield dbConn
+    return
+
+  try:
+    yield dbConn
+    dbConn.commit()
+
+  except Exception as err:
+    dbConn.rollback()
+    print("datatier.transaction() rolled back:")
+    print(str(err))
+    raise
+
+  finally:
+    with _transactions_lock:
+      _transactions.discard(id(dbConn))
+
+
+###############################################################
+#
+# Query instrumentation:
+#
+# Every statement run through datatier (and datatier_async) is
+# reported to the registered query hooks and added to the
+# current invocation's totals. Handlers decorated with
+# instrument_handler print one compact JSON summary per
+# invocation, ranked by time spent per query fingerprint.
+#
+_query_hooks = []
+_invocation = None        # per-invocation totals, see begin_invocation
+_stats_lock = threading.Lock()
+
+_FP_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_FP_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_FP_SPACE = re.compile(r"\s+")
+
+
+###############################################################
+#
+# fingerprint:
+#
+# Normalizes an SQL statement so that every execution of the
+# same query shape maps to one string: literals and %s
+# placeholders become ?, value lists collapse to (?+), and
+# whitespace is squeezed.
+#
+@functools.lru_cache(maxsize=512)
+def fingerprint(sql):
+  """
+  Returns the normalized fingerprint of an SQL statement
+
+  Parameters
+  ----------
+  sql : the SQL statement (string)
+
+  Returns
+  -------
+  the fingerprint (string)
+  """
+  fp = _FP_STRING.sub("?", sql)
+  fp = fp.replace("%s", "?")
+  fp = _FP_NUMBER.sub("?", fp)
+  fp = _FP_VALUE_LIST.sub("(?+)", fp)
+  fp = _FP_SPACE.sub(" ", fp).strip()
+  return fp.rstrip(";").rstrip()
+
+
+def add_query_hook(hook):
+  """
+  Registers hook(record) to be called after every statement with
+  a dictionary: fingerprint, seconds, rows
+  """
+  with _stats_lock:
+    _query_hooks.append(hook)
+
+
+def remove_query_hook(hook):
+  with _stats_lock:
+    if hook in _query_hooks:
+      _query_hooks.remove(hook)
+
+
+def _record_query(sql, seconds, rows):
+  record = {"fingerprint": fingerprint(sql), "seconds": seconds, "rows": rows}
+
+  with _stats_lock:
+    hooks = list(_query_hooks)
+    if _invocation is not None:
+      totals = _invocation["queries"].setdefault(record["fingerprint"], [0, 0.0, 0])
+      totals[0] += 1
+      totals[1] += seconds
+      totals[2] += rows
+
+  for hook in hooks:
+    try:
+      hook(record)
+    except Exception as err:
+      print("datatier query hook failed:", str(err))
+
+
+def _note_circuit_open(retry_after):
+  # a CircuitOpenError is reaching the caller (see checkout_dbConn)
+  with _stats_lock:
+    if _invocation is not None:
+      _invocation["retry_after"] = max(_invocation.get("retry_after", 0), retry_after)
+
+
+def _record_acquire(seconds):
+  with _stats_lock:
+    if _invocation is not None:
+      _invocation["acquires"] += 1
+      _invocation["acquire_seconds"] += seconds
+
+
+###############################################################
+#
+# begin_invocation / end_invocation:
+#
+# Start and finish collecting per-invocation totals;
+# end_invocation returns the summary record (a dictionary).
+#
+def begin_invocation():
+  global _invocation
+
+  with _stats_lock:
+    _invocation = {"queries": {}, "acquires": 0, "acquire_seconds": 0.0}
+
+
+def end_invocation(handler_name):
+  global _invocation
+
+  with _stats_lock:
+    stats = _invocation
+    _invocation = None
+
+  if stats is None:
+    return None
+
+  summary = _summarize(handler_name, stats)
+  if "retry_after" in stats:
+    summary["circuit_open"] = True
+    summary["retry_after"] = round(stats["retry_after"], 2)
+  return summary
+
+
+def _summarize(handler_name, stats):
+  queries = sorted(stats["queries"].items(), key=lambda item: item[1][1], reverse=True)
+
+  return {
+    "handler": handler_name,
+    "queries": sum(totals[0] for _, totals in queries),
+    "sql_ms": round(sum(totals[1] for _, totals in queries) * 1000, 2),
+    "acquires": stats["acquires"],
+    "acquire_ms": round(stats["acquire_seconds"] * 1000, 2),
+    "top": [
+      {"sql": fp, "calls": totals[0], "ms": round(totals[1] * 1000, 2), "rows": totals[2]}
+      for fp, totals in queries
+    ]
+  }
+
+
+###############################################################
+#
+# instrument_handler:
+#
+# Decorator for lambda_handler: collects the statistics of
+# every query the invocation runs and prints them as one JSON
+# line, {"datatier_summary": {...}}, when the handler returns.
+#
+# If the invocation failed because a circuit breaker was open,
+# the handler's error response is replaced by a 503 with a
+# Retry-After header, so clients back off instead of retrying.
+#
+def instrument_handler(handler):
+  @functools.wraps(handler)
+  def wrapper(event, context):
+    begin_invocation()
+    summary = None
+    try:
+      response = handler(event, context)
+    finally:
+      name = getattr(context, "function_name", None) or handler.__module__
+      summary = end_invocation(name)
+      if summary is not None:
+        print(json.dumps({"datatier_summary": summary}))
+
+    if summary is not None and summary.get("circuit_open"):
+      return unavailable_response(response, summary["retry_after"])
+    return response
+
+  return wrapper
+
+
+def unavailable_response(response, retry_after):
+  """
+  Turns a handler's error response into a 503; successful
+  responses are returned unchanged
+  """
+  if not isinstance(response, dict) or response.get("statusCode", 500) < 400:
+    return response
+
+  headers = dict(response.get("headers") or {})
+  headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+
+  return {
+    "statusCode": 503,
+    "headers": headers,
+    "body": json.dumps({
+      "message": "Database temporarily unavailable, please retry later."
+    })
+  }
+
+
+###################################################################
+#
+# etag_handler:
+#
+# Decorator for lambda_handler: gives every 200 response an ETag
+# (a hash of its body) and answers a request whose If-None-Match
+# carries that ETag with a 304 and an empty body, so a client
+# polling for an unchanged result does not download it again.
+# Apply it inside instrument_handler:
+#
+#   @datatier.instrument_handler
+#   @datatier.etag_handler
+#   def lambda_handler(event, context):
+#
+def etag_handler(handler):
+  @functools.wraps(handler)
+  def wrapper(event, context):
+    return conditional_response(event, handler(event, context))
+
+  return wrapper
+
+
+def compute_etag(body):
+  """
+  Returns the (strong, quoted) ETag of a response body
+  """
+  if isinstance(body, str):
+    body = body.encode("utf-8")
+  return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def conditional_response(event, response):
+  """
+  Adds an ETag to a 200 response, or turns it into a 304 when the
+  request's If-None-Match already has it; other responses are
+  returned unchanged
+
+  Parameters
+  __________
+  event : the lambda event (for its If-None-Match header),
+  response : the handler's response dict
+
+  Returns
+  _______
+  response dict
+  """
+  if not isinstance(response, dict) or response.get("statusCode") != 200:
+    return response
+
+  etag = compute_etag(response.get("body") or "")
+
+  headers = dict(response.get("headers") or {})
+  headers["ETag"] = etag
+  headers["Access-Control-Expose-Headers"] = "ETag"
+
+  if etag_matches(_request_header(event, "If-None-Match"), etag):
+    return {"statusCode": 304, "headers": headers, "body": ""}
+
+  response = dict(response)
+  response["headers"] = headers
+  return response
+
+
+def etag_matches(if_none_match, etag):
+  """
+  True if an If-None-Match header value lists etag (or is *);
+  weak (W/) validators compare equal to their strong form
+  """
+  if not if_none_match:
+    return False
+
+  for candidate in if_none_match.split(","):
+    candidate = candidate.strip()
+    if candidate.startswith("W/"):
+      candidate = candidate[2:]
+    if candidate == "*" or candidate == etag:
+      return True
+
+  return False
+
+
+def _request_header(event, name):
+  #
+  # API Gateway passes headers as sent, so match case-insensitively
+  #
+  headers = event.get("headers") if isinstance(event, dict) else None
+  for key, value in (headers or {}).items():
+    if key.lower() == name.lower():
+      return value
+  return None
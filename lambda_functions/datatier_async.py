@@ -0,0 +1,363 @@
+#
+# datatier_async.py
+#
+# asyncio counterpart of datatier.py. Every query runs on its
+# own pooled connection, so independent queries can be awaited
+# together and a handler waits for the slowest of them instead
+# of their sum:
+#
+#   source = datatier_async.get_source(secret_name, dbname)
+#   row1, row2 = datatier_async.gather(
+#     datatier_async.retrieve_one_row(source, sql1, [...]),
+#     datatier_async.retrieve_one_row(source, sql2, [...]))
+#
+# Uses the aiomysql driver when it is installed. Without it,
+# each query runs on a pooled pymysql connection from datatier
+# in a worker thread, which overlaps the network waits just
+# the same.
+#
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymysql
+
+try:
+  import aiomysql
+except ImportError:
+  aiomysql = None
+
+try:
+  import datatier
+except:
+  from . import datatier
+
+
+###################################################################
+#
+# Source:
+#
+# Where queries run: the secret holding the credentials, the
+# database name and whether reads may go to a read replica.
+#
+class Source:
+  def __init__(self, secret_name, dbname, use_replicas=False):
+    self.secret_name = secret_name
+    self.dbname = dbname
+    self.use_replicas = use_replicas
+
+
+#
+# handlers using only this module decorate with
+# datatier_async.instrument_handler (and etag_handler); queries
+# here are counted in the same per-invocation summary as
+# datatier's
+#
+instrument_handler = datatier.instrument_handler
+etag_handler = datatier.etag_handler
+
+
+def get_source(secret_name, dbname, use_replicas=False):
+  """
+  Returns a Source to pass to the query coroutines
+
+  Parameters
+  ----------
+  secret_name : Secrets Manager secret id (string),
+  dbname : database name (string),
+  use_replicas : send reads to read replicas if any (boolean)
+  """
+  return Source(secret_name, dbname, use_replicas)
+
+
+#
+# The event loop lives as long as the container, like the
+# connection pools in datatier; aiomysql pools are bound to the
+# loop they were created on, so asyncio.run() (a new loop per
+# call) would throw them away on every invocation.
+#
+_loop = None
+_loop_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=datatier.POOL_MAX_SIZE)
+
+
+def _get_loop():
+  global _loop
+
+  with _loop_lock:
+    if _loop is None or _loop.is_closed():
+      _loop = asyncio.new_event_loop()
+    return _loop
+
+
+###################################################################
+#
+# run:
+#
+# Runs a coroutine to completion on the module's event loop and
+# returns its result. Use from a (synchronous) lambda_handler.
+#
+def run(coro):
+  return _get_loop().run_until_complete(coro)
+
+
+###################################################################
+#
+# gather:
+#
+# Runs several query coroutines concurrently and returns their
+# results as a list, in the order given.
+#
+def gather(*coros):
+  async def _all():
+    return await asyncio.gather(*coros)
+
+  return run(_all())
+
+
+##################################################################
+#
+# retrieve_one_row:
+#
+# Same as datatier.retrieve_one_row, on a connection of its own.
+#
+async def retrieve_one_row(source, sql, parameters=[]):
+  """
+  Executes an sql SELECT query and returns the first row as a
+  tuple
+
+  Parameters
+  __________
+  source : Source from get_source,
+  sql : the SQL SELECT query (can be parameterized with %s),
+  parameters: optional list of values if parameterized
+
+  Returns
+  _______
+  First row as a tuple, or () if SELECT retrieves no data
+  """
+  if aiomysql is None:
+    return await _in_thread(source, datatier.retrieve_one_row, sql, parameters)
+
+  async def fetch(dbCursor):
+    row = await dbCursor.fetchone()
+    return () if row is None else row
+
+  return await _execute(source, "retrieve_one_row", sql, parameters, fetch)
+
+
+##################################################################
+#
+# retrieve_all_rows:
+#
+# Same as datatier.retrieve_all_rows, on a connection of its own.
+#
+async def retrieve_all_rows(source, sql, parameters=[]):
+  """
+  Executes an sql SELECT query and returns all rows as a list of
+  tuples
+
+  Parameters
+  __________
+  source : Source from get_source,
+  sql : the SQL SELECT query (can be parameterized with %s),
+  parameters: optional list of values if parameterized
+
+  Returns
+  _______
+  All rows as a list of tuples, or [] if SELECT retrieves no
+  data
+  """
+  if aiomysql is None:
+    return await _in_thread(source, datatier.retrieve_all_rows, sql, parameters)
+
+  async def fetch(dbCursor):
+    rows = await dbCursor.fetchall()
+    return [] if rows is None else list(rows)
+
+  return await _execute(source, "retrieve_all_rows", sql, parameters, fetch)
+
+
+###############################################################
+#
+# perform_action:
+#
+# Same as datatier.perform_action, on a connection of its own
+# (always the primary).
+#
+async def perform_action(source, sql, parameters=[]):
+  """
+  Executes an sql ACTION query and returns number of rows
+  modified
+
+  Parameters
+  __________
+  source : Source from get_source,
+  sql : the SQL ACTION query (can be parameterized with %s),
+  parameters: optional list of values if parameterized
+
+  Returns
+  _______
+  number of rows modified
+  """
+  if aiomysql is None:
+    return await _in_thread(source, datatier.perform_action, sql, parameters,
+                            write=True)
+
+  async def fetch(dbCursor):
+    return dbCursor.rowcount
+
+  return await _execute(source, "perform_action", sql, parameters, fetch,
+                        write=True)
+
+
+#
+# thread fallback (no aiomysql): pooled pymysql connection per query
+#
+async def _in_thread(source, fn, sql, parameters, write=False):
+  def call():
+    dbConn = datatier.checkout_dbConn_from_secret(
+      source.secret_name, source.dbname,
+      use_replicas=source.use_replicas and not write)
+    try:
+      return fn(dbConn, sql, parameters)
+    finally:
+      datatier.return_dbConn(dbConn)
+
+  return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+#
+# aiomysql: one pool per endpoint, created on first use
+#
+_pools = {}
+
+
+async def _get_pool(host, portnum, username, pwd, dbname):
+  key = (host, portnum, username, dbname)
+  pool = _pools.get(key)
+
+  if pool is None:
+    pool = await aiomysql.create_pool(host=host,
+                                      port=portnum,
+                                      user=username,
+                                      password=pwd,
+                                      db=dbname,
+                                      minsize=0,
+                                      maxsize=datatier.POOL_MAX_SIZE,
+                                      pool_recycle=datatier.POOL_IDLE_TIMEOUT,
+                                      autocommit=True)
+    _pools[key] = pool
+
+  return pool
+
+
+def _pick_endpoint(source, secret, write):
+  #
+  # round robin over healthy replicas (shared with datatier's
+  # health tracking) for reads, the primary otherwise:
+  #
+  primary = (secret['host'], secret['port'])
+  if write or not source.use_replicas or datatier.FORCE_PRIMARY:
+    return primary
+
+  endpoints = datatier.replica_endpoints(secret)
+  healthy = [e for e in endpoints
+             if datatier.replica_is_healthy(*e) and not datatier.get_breaker(*e).is_open()]
+  if not healthy:
+    return primary
+
+  with datatier._replica_lock:
+    start = datatier._replica_next
+    datatier._replica_next += 1
+
+  return healthy[start % len(healthy)]
+
+
+async def _execute(source, name, sql, parameters, fetch, write=False,
+                   refreshed=False):
+  secret = datatier.get_db_secret(source.secret_name, force_refresh=refreshed)
+  host, portnum = _pick_endpoint(source, secret, write)
+
+  try:
+    pool, dbConn = await _acquire(host, portnum, secret, source.dbname)
+    try:
+      start = time.perf_counter()
+      async with dbConn.cursor() as dbCursor:
+        await dbCursor.execute(sql, parameters)
+        result = await fetch(dbCursor)
+
+      datatier._record_query(sql, time.perf_counter() - start, _row_count(result))
+      return result
+    finally:
+      pool.release(dbConn)
+
+  except pymysql.err.OperationalError as err:
+    if datatier._is_auth_failure(err) and not refreshed:
+      # password rotated: drop the pool and retry with a fresh secret
+      print("datatier_async: access denied, refreshing secret", source.secret_name)
+      await _close_pool((host, portnum, secret['username'], source.dbname))
+      return await _execute(source, name, sql, parameters, fetch, write,
+                            refreshed=True)
+
+    if (host, portnum) != (secret['host'], secret['port']):
+      datatier.mark_replica_down(host, portnum)
+
+    print("datatier_async.%s() failed:" % name)
+    print(str(err))
+    raise
+
+  except Exception as err:
+    print("datatier_async.%s() failed:" % name)
+    print(str(err))
+    raise
+
+
+#
+# connects go through the same per-server circuit breaker as
+# datatier's, so while a server is failing these fail fast instead
+# of joining the reconnect storm
+#
+async def _acquire(host, portnum, secret, dbname):
+  breaker = datatier.get_breaker(host, portnum)
+  try:
+    breaker.before_connect()
+  except datatier.CircuitOpenError as err:
+    datatier._note_circuit_open(err.retry_after)
+    raise
+
+  start = time.perf_counter()
+  try:
+    pool = await _get_pool(host, portnum, secret['username'],
+                           secret['password'], dbname)
+    dbConn = await pool.acquire()
+
+  except Exception as err:
+    if datatier._is_auth_failure(err):
+      # the server is up, only the credentials are wrong
+      breaker.record_success()
+    else:
+      breaker.record_failure()
+    raise
+
+  finally:
+    datatier._record_acquire(time.perf_counter() - start)
+
+  breaker.record_success()
+  return pool, dbConn
+
+
+def _row_count(result):
+  if isinstance(result, int):
+    return result        # rows modified
+  if isinstance(result, list):
+    return len(result)
+  return 1 if result else 0
+
+
+async def _close_pool(key):
+  pool = _pools.pop(key, None)
+  if pool is not None:
+    pool.close()
+    await pool.wait_closed()
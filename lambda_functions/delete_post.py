@@ -8,7 +8,6 @@ try:
 except:
     from . import datatier
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -19,6 +18,7 @@ CORS_HEADERS = {
 
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     
@@ -29,6 +29,10 @@ def lambda_handler(event, context):
     
     On Success:
         - Removes tweet from PostInfo table
+        - Removes it from every HomeTimeline, bumping the
+          timeline_version of their owners
+        - Uncounts a root post from its author's UserInfo.post_count,
+          and a reply from its parent's PostCounters.comment_count
 
     """
     try:
@@ -67,16 +71,10 @@ def lambda_handler(event, context):
 
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
 
         #
@@ -107,11 +105,49 @@ def lambda_handler(event, context):
                     })
                 }
 
+            purge_sql = """
+                DELETE FROM HomeTimeline
+                WHERE postid = %s;
+            """
+
             sql_statement = """
                 DELETE FROM PostInfo
                 WHERE postid = %s;
             """
-            datatier.perform_action(db_conn, sql_statement, [postid])
+
+            statements = []
+
+            # row is (postid, userid, dateposted, textcontent, image_file_key, reply_to_postid)
+            if row[5] is None:
+                # Invalidate the cached timeline pages (timeline_cache.py)
+                # of everyone whose home timeline shows the post, before
+                # the purge forgets who that is
+                version_sql = """
+                    UPDATE UserInfo u
+                    JOIN HomeTimeline t ON t.owner = u.userid
+                    SET u.timeline_version = u.timeline_version + 1
+                    WHERE t.postid = %s;
+                """
+                statements.append((version_sql, [postid]))
+
+            statements += [
+                (purge_sql, [postid]),
+                (sql_statement, [postid]),
+            ]
+
+            if row[5] is None:
+                count_sql = "UPDATE UserInfo SET post_count = GREATEST(post_count - 1, 0) WHERE userid = %s;"
+                statements.append((count_sql, [row[1]]))
+            else:
+                # right after the DELETE, so ROW_COUNT() is 0 if a
+                # concurrent request deleted the reply first
+                counter_sql = """
+                    UPDATE PostCounters SET comment_count = GREATEST(comment_count - ROW_COUNT(), 0)
+                    WHERE postid = %s AND shard = 0;
+                """
+                statements.append((counter_sql, [row[5]]))
+
+            datatier.execute_batch(db_conn, statements)
 
             print("Delete successful.")
 
@@ -126,6 +162,9 @@ def lambda_handler(event, context):
         except Exception as e:
             print("Updating database ERR: ", e)
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
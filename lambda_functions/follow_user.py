@@ -4,10 +4,11 @@ from configparser import ConfigParser
 import os
 try:
     import datatier
+    import datatier_async
 except:
     from . import datatier
+    from . import datatier_async
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -16,7 +17,12 @@ CORS_HEADERS = {
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+# how many of the followee's most recent posts a new follow copies
+# into the follower's home timeline
+BACKFILL_LIMIT = 800
 
+
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     follow_user.py
@@ -27,6 +33,8 @@ def lambda_handler(event, context):
     
     On Success:
         - Adds a follower relationship to the Followers table
+        - Backfills the follower's HomeTimeline with the followee's
+          most recent root posts, and bumps their timeline_version
     """
     try:
         if "body" not in event:
@@ -65,23 +73,40 @@ def lambda_handler(event, context):
         # Establishing DB connection
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_source = datatier_async.get_source(secret_name, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
-            # Check if follower exists
+            # The prechecks are independent (the relationship checks
+            # join on the followee's username), so run them concurrently
             check_follower_sql = "SELECT userid FROM UserInfo WHERE userid = %s;"
-            follower_result = datatier.retrieve_all_rows(db_conn, check_follower_sql, [follower])
-            
-            if not follower_result:
+            check_followee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
+
+            # Check if the relationship already exists
+            check_relationship_sql = """
+                SELECT 1 FROM Followers f
+                JOIN UserInfo u ON f.followee = u.userid
+                WHERE f.follower = %s AND u.username = %s;
+            """
+
+            # Check if the user is blocked
+            check_blocked_sql = """
+                SELECT 1 FROM Blocked b
+                JOIN UserInfo u ON b.blocker = u.userid
+                WHERE u.username = %s AND b.blockee = %s;
+            """
+
+            follower_row, followee_row, existing_relationship, is_blocked = datatier_async.gather(
+                datatier_async.retrieve_one_row(db_source, check_follower_sql, [follower]),
+                datatier_async.retrieve_one_row(db_source, check_followee_sql, [followee_username]),
+                datatier_async.retrieve_one_row(db_source, check_relationship_sql, [follower, followee_username]),
+                datatier_async.retrieve_one_row(db_source, check_blocked_sql, [followee_username, follower])
+            )
+
+            if not follower_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -90,11 +115,7 @@ def lambda_handler(event, context):
                     })
                 }
                 
-            # Get followee userid from username
-            check_followee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
-            followee_result = datatier.retrieve_all_rows(db_conn, check_followee_sql, [followee_username])
-            
-            if not followee_result:
+            if not followee_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -103,7 +124,7 @@ def lambda_handler(event, context):
                     })
                 }
             
-            followee = followee_result[0][0]  # Extract userid from result
+            followee = followee_row[0]  # Extract userid from result
             
             # Check if users are trying to follow themselves
             if follower == followee:
@@ -115,10 +136,6 @@ def lambda_handler(event, context):
                     })
                 }
                 
-            # Check if the relationship already exists
-            check_relationship_sql = "SELECT * FROM Followers WHERE follower = %s AND followee = %s;"
-            existing_relationship = datatier.retrieve_all_rows(db_conn, check_relationship_sql, [follower, followee])
-            
             if existing_relationship:
                 return {
                     "statusCode": 400,
@@ -128,10 +145,6 @@ def lambda_handler(event, context):
                     })
                 }
                 
-            # Check if the user is blocked
-            check_blocked_sql = "SELECT * FROM Blocked WHERE blocker = %s AND blockee = %s;"
-            is_blocked = datatier.retrieve_all_rows(db_conn, check_blocked_sql, [followee, follower])
-            
             if is_blocked:
                 return {
                     "statusCode": 403,
@@ -147,7 +160,26 @@ def lambda_handler(event, context):
                 VALUES (%s, %s);
             """
 
-            datatier.perform_action(db_conn, sql_statement, [follower, followee])
+            # Backfill the follower's home timeline with the followee's
+            # newest root posts; older ones stay on the followee's profile
+            backfill_sql = """
+                INSERT IGNORE INTO HomeTimeline (owner, dateposted, postid, authorid)
+                SELECT %s, p.dateposted, p.postid, p.userid
+                FROM PostInfo p
+                WHERE p.userid = %s AND p.reply_to_postid IS NULL
+                ORDER BY p.dateposted DESC, p.postid DESC
+                LIMIT %s;
+            """
+
+            # Cached timeline pages of the follower are stale now
+            # (timeline_cache.py)
+            version_sql = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+            datatier.execute_batch(db_conn, [
+                (sql_statement, [follower, followee]),
+                (backfill_sql, [follower, followee, BACKFILL_LIMIT]),
+                (version_sql, [follower]),
+            ])
 
             return {
                 "statusCode": 200,
@@ -167,6 +199,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -1,54 +1,120 @@
 import os
+import time
 try:
+    import counts_cache
     import datatier
+    import datatier_async
 except:
+    from . import counts_cache
     from . import datatier
+    from . import datatier_async
 import json
-import boto3
 
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
-def get_all_counts_union(db_conn, postids):
-    placeholders = ','.join(['%s'] * len(postids))
-    
-    sql = f'''
-        SELECT originalpost as postid, 'likes' as type, COUNT(*) as count, NULL as comment_id
-        FROM Likes 
-        WHERE originalpost IN ({placeholders})
-        GROUP BY originalpost
-        
-        UNION ALL
-        
-        SELECT originalpost as postid, 'retweets' as type, COUNT(*) as count, NULL as comment_id
-        FROM Retweets 
-        WHERE originalpost IN ({placeholders})
-        GROUP BY originalpost
-        
-        UNION ALL
-        
-        SELECT reply_to_postid as postid, 'comments' as type, COUNT(*) as count, NULL as comment_id
-        FROM PostInfo 
-        WHERE reply_to_postid IN ({placeholders})
-        GROUP BY reply_to_postid
-    '''
-    
-    rows = datatier.retrieve_all_rows(db_conn, sql, postids * 3)
-    
+# The frontend sends every postid it has loaded, so a long session
+# sends thousands. Lists are read COUNTS_CHUNK_SIZE postids per
+# statement; longer ones are split into chunks read concurrently on
+# pooled connections (datatier_async), and past COUNTS_JOIN_THRESHOLD
+# into one chunk per pooled connection, each joined against its
+# postids as a JSON_TABLE instead of a long IN list.
+COUNTS_CHUNK_SIZE = int(os.environ.get("COUNTS_CHUNK_SIZE", "500"))
+COUNTS_JOIN_THRESHOLD = int(os.environ.get("COUNTS_JOIN_THRESHOLD", "5000"))
+
+COUNTS_IN_SQL = '''
+    SELECT postid, SUM(like_count), SUM(retweet_count), SUM(comment_count)
+    FROM PostCounters
+    WHERE postid IN ({placeholders})
+    GROUP BY postid
+    ORDER BY postid
+'''
+
+# DISTINCT: the same post sent as 101 and "101" must not be summed twice
+COUNTS_JOIN_SQL = '''
+    SELECT c.postid, SUM(c.like_count), SUM(c.retweet_count), SUM(c.comment_count)
+    FROM (SELECT DISTINCT postid
+          FROM JSON_TABLE(%s, '$[*]' COLUMNS (postid INT PATH '$')) j) ids
+    JOIN PostCounters c ON c.postid = ids.postid
+    GROUP BY c.postid
+    ORDER BY c.postid
+'''
+
+def split_postids(postids):
+    """
+    Splits the postids into the chunks read by one statement each.
+    """
+    if len(postids) > COUNTS_JOIN_THRESHOLD:
+        parallel = max(datatier.POOL_MAX_SIZE, 1)
+        size = -(-len(postids) // parallel)
+    else:
+        size = max(COUNTS_CHUNK_SIZE, 1)
+
+    return [postids[i:i + size] for i in range(0, len(postids), size)]
+
+def counts_query(chunk):
+    """
+    Returns (sql, parameters) reading one chunk's counters from
+    PostCounters, one primary-key range (the post's shards) per postid.
+    """
+    if len(chunk) > COUNTS_CHUNK_SIZE:
+        return COUNTS_JOIN_SQL, [json.dumps(chunk)]
+
+    placeholders = ','.join(['%s'] * len(chunk))
+    return COUNTS_IN_SQL.format(placeholders=placeholders), list(chunk)
+
+def count_rows(rows):
+    """
+    The rows with SUM()'s Decimals made ints.
+    """
+    return [(row[0], int(row[1]), int(row[2]), int(row[3])) for row in rows]
+
+def read_counts(db_conn, postids):
+    """
+    Reads the posts' counter rows on one connection, a chunk at a time.
+    """
+    rows = []
+    for chunk in split_postids(postids):
+        rows += count_rows(datatier.retrieve_all_rows(db_conn, *counts_query(chunk)))
+    return rows
+
+def read_counts_parallel(db_source, postids):
+    """
+    Same as read_counts, reading the chunks concurrently, each on a
+    pooled connection of its own.
+    """
+    chunk_rows = datatier_async.gather(*[
+        datatier_async.retrieve_all_rows(db_source, *counts_query(chunk))
+        for chunk in split_postids(postids)
+    ])
+    return [row for rows in chunk_rows for row in count_rows(rows)]
+
+def organize_counts(rows):
+    """
+    Returns (likes, retweets, comment_counts) listing only the posts
+    with a nonzero count of each kind, in postid order.
+    """
+    merged = {}
+    for row in rows:
+        merged.setdefault(row[0], row)
+    rows = [merged[postid] for postid in sorted(merged)]
+
     # Organize results by type
-    likes = [{"originalpost": row[0], "like_count": row[2]} 
-             for row in rows if row[1] == 'likes']
-    retweets = [{"originalpost": row[0], "retweet_count": row[2]} 
-                for row in rows if row[1] == 'retweets']
-    comment_counts = [{"reply_to_postid": row[0], "comment_count": row[2]} 
-                      for row in rows if row[1] == 'comments']
+    likes = [{"originalpost": row[0], "like_count": row[1]}
+             for row in rows if row[1] > 0]
+    retweets = [{"originalpost": row[0], "retweet_count": row[2]}
+                for row in rows if row[2] > 0]
+    comment_counts = [{"reply_to_postid": row[0], "comment_count": row[3]}
+                      for row in rows if row[3] > 0]
 
     return likes, retweets, comment_counts
 
+@datatier.instrument_handler
+@datatier.etag_handler
 def lambda_handler(event, context):
     """
     get_counts.py
@@ -83,7 +149,8 @@ def lambda_handler(event, context):
                 })
             }
         
-        postids = event_body['postids']
+        # repeated postids would only lengthen the statements
+        postids = list(dict.fromkeys(event_body['postids']))
 
         if not postids:  # Check for empty list
             return {
@@ -96,22 +163,35 @@ def lambda_handler(event, context):
                 })
             }
 
-        # Establishing DB connection
-        print("*** Establishing DB connection ***")
+        # Popular posts' counts come from the container's cache
+        # (counts_cache.py); only the rest are read
+        cache = counts_cache.get_cache()
+        rows, missing = cache.lookup(postids)
 
-        secret_manager = boto3.client('secretsmanager')
+        # Establishing DB connection
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = None
+        if missing and len(missing) <= COUNTS_CHUNK_SIZE:
+            print("*** Establishing DB connection ***")
+            db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, use_replicas=True)
+        elif missing:
+            # no connection is held here, so every pooled one is free
+            # for the chunks
+            db_source = datatier_async.get_source(secret_name, rds_dbname, use_replicas=True)
 
         try:
-            likes, retweets, comment_counts = get_all_counts_union(db_conn, postids)
+            if missing:
+                start = time.perf_counter()
+                if db_conn is not None:
+                    fetched = read_counts(db_conn, missing)
+                else:
+                    fetched = read_counts_parallel(db_source, missing)
+                cache.store(missing, fetched, time.perf_counter() - start)
+                rows = rows + fetched
+
+            likes, retweets, comment_counts = organize_counts(rows)
 
             print(f"Likes: {likes}")
             print(f"Retweets: {retweets}")
@@ -139,6 +219,10 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            if db_conn is not None:
+                datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -1,27 +1,55 @@
 from configparser import ConfigParser
 import os
 import json
-import boto3
+import base64
+import binascii
 from datetime import datetime
 try:
+    import block_set
     import datatier
+    import timeline_cache
+    import timeline_merge
 except:
+    from . import block_set
     from . import datatier
+    from . import timeline_cache
+    from . import timeline_merge
 
 CORS_HEADERS = {
    'Access-Control-Allow-Origin': '*',
-   'Access-Control-Allow-Headers': 'Content-Type',
+   'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
    'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
-def serialize_rows(rows, include_likes_retweets=True):
+# page size when a cursor is sent without a limit, and the largest
+# page a client may ask for
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# keyset predicate: rows strictly older than the cursor's
+# (dateposted, postid); spelled out rather than as a row comparison
+# so MySQL turns it into a range scan on the (..., dateposted, postid)
+# indexes. {k} is the alias of the table the index belongs to.
+KEYSET_CLAUSE = " AND ({k}.dateposted < %s OR ({k}.dateposted = %s AND {k}.postid < %s))"
+# the reverse, for "since" (delta) requests: rows newer than the cursor
+SINCE_CLAUSE = " AND ({k}.dateposted > %s OR ({k}.dateposted = %s AND {k}.postid > %s))"
+ORDER_CLAUSE = " ORDER BY {k}.dateposted DESC, {k}.postid DESC"
+
+# home timeline engine: "fanout" reads the HomeTimeline table the
+# write handlers maintain; "merge" builds pages at read time from
+# followees' recent posts (timeline_merge.py), falling back to one
+# query over PostInfo when its caches cannot answer
+TIMELINE_ENGINE = os.environ.get("TIMELINE_ENGINE", "fanout")
+
+def serialize_rows(rows, include_likes_retweets=True, counts=None):
    """
    Converts rows with datetime objects into JSON-serializable format.
-   If include_likes_retweets is False, skips those fields.
+   If include_likes_retweets is False, skips those fields. If counts
+   (from fetch_counts) is given, adds like_count, retweet_count and
+   comment_count to each post.
    """
    serialized = []
    for row in rows:
-       print(row)
        base = {
            "post_id": row[0],
            "userid": row[1],
@@ -35,11 +63,222 @@ def serialize_rows(rows, include_likes_retweets=True):
            base["liked"] = row[6]
            base["retweeted"] = row[7]
 
+       if counts is not None:
+           base["like_count"], base["retweet_count"], base["comment_count"] = counts.get(row[0], (0, 0, 0))
+
        serialized.append(base)
 
    return serialized
 
 
+def serialize_columns(rows, include_likes_retweets=True, counts=None, columns=None, authors=None):
+   """
+   Compact form of serialize_rows: one array per field instead of one
+   dict per post, with each author's username and picture stored once
+   in authors, keyed by userid. Pass the columns and authors of an
+   earlier call to append to them. Returns (columns, authors).
+   """
+   if columns is None:
+       names = ["post_id", "userid", "dateposted", "content"]
+       if include_likes_retweets:
+           names += ["liked", "retweeted"]
+       if counts is not None:
+           names += ["like_count", "retweet_count", "comment_count"]
+       columns = {name: [] for name in names}
+       authors = {}
+
+   post_ids = columns["post_id"]
+   userids = columns["userid"]
+   dates = columns["dateposted"]
+   contents = columns["content"]
+   username = 8 if include_likes_retweets else 6
+
+   for row in rows:
+       post_ids.append(row[0])
+       userids.append(row[1])
+       dates.append(row[2].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row[2], datetime) else row[2])
+       contents.append(row[3])
+       if row[1] not in authors:
+           authors[row[1]] = {"username": row[username], "image": row[4]}
+
+   if include_likes_retweets:
+       columns["liked"].extend(row[6] for row in rows)
+       columns["retweeted"].extend(row[7] for row in rows)
+
+   if counts is not None:
+       engagement = [counts.get(row[0], (0, 0, 0)) for row in rows]
+       columns["like_count"].extend(c[0] for c in engagement)
+       columns["retweet_count"].extend(c[1] for c in engagement)
+       columns["comment_count"].extend(c[2] for c in engagement)
+
+   return columns, authors
+
+
+def posts_fields(rows, include_likes_retweets=True, counts=None, compact=False):
+   """
+   The "posts" field of a response (plus "authors" in the compact
+   format).
+   """
+   if compact:
+       columns, authors = serialize_columns(rows, include_likes_retweets, counts)
+       return {"posts": columns, "authors": authors}
+
+   return {"posts": serialize_rows(rows, include_likes_retweets, counts)}
+
+
+def dump_row_batches(batches, include_likes_retweets=True, compact=False):
+   """
+   Serializes batches of rows (as yielded by datatier.iter_rows) straight
+   to a JSON array string, one batch at a time, so the full result is never
+   held as rows and dicts at once. Produces the same text as
+   json.dumps(serialize_rows(rows)), or in the compact format the same
+   as json.dumps(posts_fields(rows, compact=True)).
+   """
+   if compact:
+       columns = authors = None
+       for rows in batches:
+           columns, authors = serialize_columns(rows, include_likes_retweets, None, columns, authors)
+       if columns is None:
+           columns, authors = serialize_columns([], include_likes_retweets)
+       return json.dumps({"posts": columns, "authors": authors})
+
+   parts = []
+   for rows in batches:
+       parts.extend(json.dumps(post) for post in serialize_rows(rows, include_likes_retweets))
+
+   return "[" + ", ".join(parts) + "]"
+
+
+def encode_cursor(row):
+   """
+   Builds the opaque cursor pointing just past row, from its
+   (dateposted, postid).
+   """
+   return encode_key(row[2], row[0])
+
+
+def encode_key(dateposted, postid):
+   """
+   Builds the opaque cursor for a (dateposted, postid) position.
+   """
+   if isinstance(dateposted, datetime):
+       dateposted = dateposted.strftime('%Y-%m-%d %H:%M:%S')
+   raw = json.dumps([dateposted, postid]).encode()
+   return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+   """
+   Returns the (dateposted, postid) stored in a cursor from
+   encode_cursor. Raises ValueError if the cursor is malformed.
+   """
+   try:
+       dateposted, postid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+   except (AttributeError, TypeError, binascii.Error, UnicodeDecodeError, ValueError):
+       raise ValueError("invalid cursor")
+
+   if not isinstance(dateposted, str) or not isinstance(postid, int):
+       raise ValueError("invalid cursor")
+
+   return dateposted, postid
+
+
+def parse_limit(value):
+   """
+   Validates the requested page size, capped at MAX_PAGE_SIZE.
+   Raises ValueError if it is not a positive integer.
+   """
+   if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+       raise ValueError("limit must be a positive integer")
+
+   return min(value, MAX_PAGE_SIZE)
+
+
+def fetch_counts(db_conn, postids):
+   """
+   Returns {postid: (like_count, retweet_count, comment_count)} for
+   the given posts, summing their PostCounters shards (kept by the
+   write handlers). Posts with no engagement are absent.
+   """
+   if not postids:
+       return {}
+
+   placeholders = ', '.join(['%s'] * len(postids))
+   sql_statement = f"""
+       SELECT postid, SUM(like_count), SUM(retweet_count), SUM(comment_count)
+       FROM PostCounters
+       WHERE postid IN ({placeholders})
+       GROUP BY postid
+   """
+   rows = datatier.retrieve_all_rows(db_conn, sql_statement, list(postids))
+
+   return {row[0]: (max(int(row[1]), 0), max(int(row[2]), 0), max(int(row[3]), 0)) for row in rows}
+
+
+def read_visible(db_conn, sql_statement, parameters, key, count, blocked, after=None):
+   """
+   Runs sql_statement (without ORDER BY / LIMIT) newest first and
+   returns up to count rows whose author is not in blocked. Reads
+   count rows at a time, seeking past the last row read, until count
+   are visible or the query runs out, so filtering never shortens a
+   page that has more rows behind it.
+   """
+   visible = []
+   while True:
+       sql = sql_statement
+       params = list(parameters)
+       if after is not None:
+           sql += KEYSET_CLAUSE.format(k=key)
+           params += [after[0], after[0], after[1]]
+       sql += ORDER_CLAUSE.format(k=key) + " LIMIT %s"
+       rows = datatier.retrieve_all_rows(db_conn, sql, params + [count])
+
+       visible += [row for row in rows if row[1] not in blocked]
+       if len(visible) >= count or len(rows) < count:
+           return visible[:count]
+
+       last = rows[-1]
+       after = (last[2].strftime('%Y-%m-%d %H:%M:%S') if isinstance(last[2], datetime) else last[2], last[0])
+
+
+def page_body(rows, limit, include_likes_retweets=True, counts=None, extra=None, compact=False):
+   """
+   Serializes one page of a query run with LIMIT limit + 1: the extra
+   row only tells us whether there is a next page. extra holds any
+   further top-level fields (e.g. a profile's post_count).
+   """
+   more = len(rows) > limit
+   rows = rows[:limit]
+   next_cursor = encode_cursor(rows[-1]) if more else None
+
+   body = posts_fields(rows, include_likes_retweets, counts, compact)
+   body["next_cursor"] = next_cursor
+   body["newest_cursor"] = encode_cursor(rows[0]) if rows else None
+   body.update(extra or {})
+
+   return json.dumps(body)
+
+
+def delta_body(rows, limit, since, include_likes_retweets=True, counts=None, extra=None, compact=False):
+   """
+   Serializes the posts newer than since, from a query run with
+   LIMIT limit + 1. More than limit new posts means the gap is too
+   large to patch in: the client should reload the timeline.
+   newest_cursor is what to send as since on the next poll.
+   """
+   gap_too_large = len(rows) > limit
+   rows = rows[:limit]
+
+   body = posts_fields(rows, include_likes_retweets, counts, compact)
+   body["newest_cursor"] = encode_cursor(rows[0]) if rows else encode_key(*since)
+   body["gap_too_large"] = gap_too_large
+   body.update(extra or {})
+
+   return json.dumps(body)
+
+
+@datatier.instrument_handler
+@datatier.etag_handler
 def lambda_handler(event, context):
    try:
        if "body" not in event:
@@ -63,27 +302,88 @@ def lambda_handler(event, context):
        userid = event_body['userid']
        postid = event_body.get('postid', None)  # Optional
        profileUsername = event_body.get('profileUsername', None)  # Optional - NEW
+       include_counts = bool(event_body.get('include_counts', False))  # Optional: inline engagement counts
+       compact = event_body.get('format', None) == "compact"  # Optional: columnar posts + authors
+
+       # Optional keyset pagination: sending a limit and/or cursor
+       # returns {"posts": [...], "next_cursor": ...} instead of the
+       # whole list. Sending since (a newest_cursor from an earlier
+       # response) or since_postid instead returns only newer posts,
+       # up to limit of them (default MAX_PAGE_SIZE).
+       delta = "since" in event_body or "since_postid" in event_body
+       paged = ("limit" in event_body or "cursor" in event_body) and not delta
+       since = None
+       since_postid = None
+       if paged or delta:
+           try:
+               if delta and "cursor" in event_body:
+                   raise ValueError("cursor and since cannot be combined")
+               limit = parse_limit(event_body.get('limit', MAX_PAGE_SIZE if delta else DEFAULT_PAGE_SIZE))
+               cursor = event_body.get('cursor', None)
+               after = decode_cursor(cursor) if cursor is not None else None
+               if "since" in event_body:
+                   since = decode_cursor(event_body['since'])
+               elif delta:
+                   since_postid = event_body['since_postid']
+                   if isinstance(since_postid, bool) or not isinstance(since_postid, int):
+                       raise ValueError("since_postid must be an integer")
+           except ValueError as e:
+               return {
+                   "statusCode": 400,
+                   "headers": CORS_HEADERS,
+                   "body": json.dumps({"message": str(e)})
+               }
 
        # Establish DB connection
-       secret_manager = boto3.client('secretsmanager')
        secret_name = "prod/twitterclone/sql"
-       secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-       rds_endpoint = secret['host']
-       rds_portnum = secret['port']
-       rds_username = secret['username']
-       rds_pwd = secret['password']
        rds_dbname = "TwitterClone"
 
-       db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+       db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, use_replicas=True)
 
        try:
            print("userid:", userid)
            print("postid:", postid)
            print("username:", profileUsername)
 
+           merged = None
+           extra = None
+
+           # The viewer's versions: timeline_version for the page cache,
+           # block_version for their block set (users they blocked or
+           # who blocked them), which every path filters against in
+           # memory
+           versions = datatier.retrieve_one_row(db_conn, "SELECT timeline_version, block_version FROM UserInfo WHERE userid = %s", [userid])
+           blocked = block_set.blocked_users(db_conn, userid, versions[1]) if versions else frozenset()
+
+           # Pages of the home timeline are served from the container's
+           # cache while the user's timeline_version (bumped by every
+           # write that changes their timeline) still matches
+           cache_key = None
+           if paged and profileUsername is None and postid is None:
+               if versions:
+                   version = versions[0]
+                   cache_key = (TIMELINE_ENGINE, cursor, limit, include_counts, compact)
+                   body = timeline_cache.get_cache().get(userid, cache_key, version)
+                   if body is not None:
+                       return {
+                           "statusCode": 200,
+                           "headers": CORS_HEADERS,
+                           "body": body
+                       }
+
            if profileUsername is not None:
                # Fetch root posts from a specific user by username - NEW
                print(f"Fetching root posts from user: {profileUsername}")
+
+               # resolve the username once, with the author's post count
+               author_sql = "SELECT u.userid, u.post_count FROM UserInfo u WHERE u.username = %s"
+               author = datatier.retrieve_one_row(db_conn, author_sql, [profileUsername])
+               if author and author[0] in blocked:
+                   author = None   # shown like an unknown user: no posts, no count
+               extra = {"post_count": author[1] if author else 0}
+
+               # range scan of (userid, reply_to_postid, dateposted, postid);
+               # an unknown or blocked author binds NULL, which matches nothing
                sql_statement = """
                    SELECT
                        p.postid,
@@ -95,12 +395,10 @@ def lambda_handler(event, context):
                        u.username
                    FROM PostInfo p
                    JOIN UserInfo u ON p.userid = u.userid
-                   LEFT JOIN Blocked b ON p.userid = b.blockee AND b.blocker = %s
-                   WHERE u.username = %s AND p.reply_to_postid IS NULL AND b.blockee IS NULL
-                   ORDER BY p.dateposted DESC
-               """
-               rows = datatier.retrieve_all_rows(db_conn, sql_statement, [userid, profileUsername])
-               serialized_rows = serialize_rows(rows, include_likes_retweets=False)
+                   WHERE p.userid = %s AND p.reply_to_postid IS NULL"""
+               parameters = [author[0] if author else None]
+               include_likes_retweets = False
+               key = "p"
            elif postid is not None:
                # Fetch replies to a specific post
                print(f"Checking to see if {userid} liked post {postid}")
@@ -119,16 +417,14 @@ def lambda_handler(event, context):
                    JOIN UserInfo u ON p.userid = u.userid
                    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
                    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
-                   LEFT JOIN Blocked b ON p.userid = b.blockee AND b.blocker = %s
-                   WHERE p.reply_to_postid = %s AND b.blockee IS NULL
-                   ORDER BY p.dateposted DESC;
-               """
-               rows = datatier.retrieve_all_rows(db_conn, sql_statement, [userid, userid, userid, postid])
-               serialized_rows = serialize_rows(rows, include_likes_retweets=True)
-           else:
-               # Fetch general recent tweets (original logic)
+                   WHERE p.reply_to_postid = %s"""
+               parameters = [userid, userid, postid]
+               include_likes_retweets = True
+               key = "p"
+           elif TIMELINE_ENGINE == "merge":
+               # Home timeline pulled from followees' posts at read time
                sql_statement = """
-                   SELECT DISTINCT
+                   SELECT
                        p.postid,
                        p.userid,
                        p.dateposted,
@@ -140,20 +436,89 @@ def lambda_handler(event, context):
                        u.username
                    FROM PostInfo p
                    JOIN UserInfo u ON p.userid = u.userid
-                   LEFT JOIN Followers f ON p.userid = f.followee
                    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
                    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
-                   LEFT JOIN Blocked b ON p.userid = b.blockee AND b.blocker = %s
-                   WHERE (f.follower = %s OR p.userid = %s) AND p.reply_to_postid IS NULL AND b.blockee IS NULL
-                   ORDER BY p.dateposted DESC
-               """
-               rows = datatier.retrieve_all_rows(db_conn, sql_statement, [userid, userid, userid, userid, userid])
-               serialized_rows = serialize_rows(rows, include_likes_retweets=True)
+                   WHERE (p.userid = %s OR p.userid IN (SELECT followee FROM Followers WHERE follower = %s))
+                     AND p.reply_to_postid IS NULL"""
+               parameters = [userid, userid, userid, userid]
+               include_likes_retweets = True
+               key = "p"
+
+               if paged:
+                   merged = timeline_merge.timeline_page(db_conn, userid, limit + 1, after, blocked=blocked)
+           else:
+               # Fetch the home timeline (own and followed root posts),
+               # materialized in HomeTimeline by the write handlers
+               sql_statement = """
+                   SELECT
+                       p.postid,
+                       p.userid,
+                       p.dateposted,
+                       p.textcontent,
+                       u.picture,
+                       p.reply_to_postid,
+                       CASE WHEN l.liker IS NOT NULL THEN 1 ELSE 0 END AS is_liked,
+                       CASE WHEN r.retweetuserid IS NOT NULL THEN 1 ELSE 0 END AS is_retweeted,
+                       u.username
+                   FROM HomeTimeline t
+                   JOIN PostInfo p ON p.postid = t.postid
+                   JOIN UserInfo u ON p.userid = u.userid
+                   LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
+                   LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
+                   WHERE t.owner = %s"""
+               parameters = [userid, userid, userid]
+               include_likes_retweets = True
+               key = "t"
+
+           if delta and since is None:
+               # since_postid: start from that post's (dateposted, postid)
+               row = datatier.retrieve_one_row(db_conn, "SELECT dateposted, postid FROM PostInfo WHERE postid = %s", [since_postid])
+               if row:
+                   dateposted = row[0].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row[0], datetime) else row[0]
+                   since = (dateposted, row[1])
+
+           if delta and since is None:
+               # the post is gone, so there is nothing to count from
+               body = json.dumps({"posts": [], "newest_cursor": None, "gap_too_large": True})
+           elif delta:
+               # only what is newer than since: a short range at the top
+               # of the same (..., dateposted, postid) index
+               sql_statement += SINCE_CLAUSE.format(k=key)
+               parameters += [since[0], since[0], since[1]]
+               rows = read_visible(db_conn, sql_statement, parameters, key, limit + 1, blocked)
+
+               counts = fetch_counts(db_conn, [row[0] for row in rows[:limit]]) if include_counts else None
+               body = delta_body(rows, limit, since, include_likes_retweets, counts, extra, compact)
+           elif paged:
+               if merged is not None:
+                   rows = merged
+               else:
+                   # one page: seek past the cursor and read limit + 1 rows
+                   rows = read_visible(db_conn, sql_statement, parameters, key, limit + 1, blocked, after)
+
+               counts = fetch_counts(db_conn, [row[0] for row in rows[:limit]]) if include_counts else None
+               body = page_body(rows, limit, include_likes_retweets, counts, extra, compact)
+               if cache_key is not None:
+                   timeline_cache.get_cache().put(userid, cache_key, version, body)
+           elif include_counts:
+               # counts need every postid before serializing, so this
+               # reads the whole list instead of streaming it
+               rows = datatier.retrieve_all_rows(db_conn, sql_statement + ORDER_CLAUSE.format(k=key), parameters)
+               rows = [row for row in rows if row[1] not in blocked]
+               counts = fetch_counts(db_conn, [row[0] for row in rows])
+               if compact:
+                   body = json.dumps(posts_fields(rows, include_likes_retweets, counts, compact))
+               else:
+                   body = json.dumps(serialize_rows(rows, include_likes_retweets, counts))
+           else:
+               batches = datatier.iter_rows(db_conn, sql_statement + ORDER_CLAUSE.format(k=key), parameters)
+               batches = ([row for row in rows if row[1] not in blocked] for rows in batches)
+               body = dump_row_batches(batches, include_likes_retweets, compact)
 
            return {
                "statusCode": 200,
                "headers": CORS_HEADERS,
-               "body": json.dumps(serialized_rows)
+               "body": body
            }
 
        except Exception as e:
@@ -166,6 +531,9 @@ def lambda_handler(event, context):
                })
            }
 
+       finally:
+           datatier.return_dbConn(db_conn)
+
    except Exception as e:
        return {
            "statusCode": 400,
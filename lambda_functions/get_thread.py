@@ -0,0 +1,319 @@
+import json
+from datetime import datetime
+try:
+    import datatier
+except:
+    from . import datatier
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST'
+}
+
+# reply levels below the post (depth) and replies kept per post
+# (breadth): defaults, and the most a client may ask for
+DEFAULT_DEPTH = 3
+MAX_DEPTH = 10
+DEFAULT_BREADTH = 10
+MAX_BREADTH = 50
+
+# ancestors followed up the thread, and posts returned in total
+MAX_ANCESTORS = 50
+MAX_THREAD_POSTS = 500
+
+# parent posts whose replies are read in one UNION ALL statement
+PARENT_CHUNK_SIZE = 100
+
+# the columns of a thread post, with liked/retweeted flags for the
+# viewer; every query below binds (viewer, viewer) for the joins
+POST_COLUMNS = """
+        p.postid,
+        p.userid,
+        p.dateposted,
+        p.textcontent,
+        u.picture,
+        p.reply_to_postid,
+        CASE WHEN l.liker IS NOT NULL THEN 1 ELSE 0 END AS is_liked,
+        CASE WHEN r.retweetuserid IS NOT NULL THEN 1 ELSE 0 END AS is_retweeted,
+        u.username
+"""
+
+POST_JOINS = """
+    JOIN UserInfo u ON p.userid = u.userid
+    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
+    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
+"""
+
+# authors the viewer blocked or who blocked the viewer (both
+# directions, as in block_set.py); binds (viewer, viewer)
+NOT_BLOCKED = """
+    NOT EXISTS (SELECT 1 FROM Blocked b
+                WHERE (b.blocker = %s AND b.blockee = p.userid)
+                   OR (b.blocker = p.userid AND b.blockee = %s))
+"""
+
+#
+# The post and its ancestors: a recursive CTE walking up
+# reply_to_postid from the post (depth 0, -1, -2, ...). Needs
+# MySQL 8.0+ (WITH RECURSIVE).
+#
+ANCESTORS_SQL = """
+    WITH RECURSIVE ancestors (postid, reply_to_postid, depth) AS (
+        SELECT postid, reply_to_postid, 0
+        FROM PostInfo
+        WHERE postid = %s
+        UNION ALL
+        SELECT p.postid, p.reply_to_postid, a.depth - 1
+        FROM PostInfo p
+        JOIN ancestors a ON p.postid = a.reply_to_postid
+        WHERE a.depth > -%s
+    )
+    SELECT a.depth,""" + POST_COLUMNS + """
+    FROM ancestors a
+    JOIN PostInfo p ON p.postid = a.postid""" + POST_JOINS + """
+    WHERE""" + NOT_BLOCKED + """
+    ORDER BY a.depth
+"""
+
+#
+# The newest breadth + 1 replies of one parent (the extra one only
+# flags that there are more), read through the
+# (reply_to_postid, dateposted, postid) index so a popular post costs
+# no more than the replies returned. The descendants are walked one
+# level at a time with one UNION ALL of these per chunk of parents,
+# rather than one recursive CTE with a LATERAL and a LIMIT in its
+# recursive part, which older MySQL 8.0 releases reject.
+#
+REPLIES_SQL = """
+    (SELECT""" + POST_COLUMNS + """
+     FROM PostInfo p""" + POST_JOINS + """
+     WHERE p.reply_to_postid = %s AND""" + NOT_BLOCKED + """
+     ORDER BY p.dateposted DESC, p.postid DESC
+     LIMIT %s)"""
+
+
+def load_replies(dbConn, userid, parents, size):
+    """
+    Returns {parent: [post row, ...]} newest first, at most size
+    replies per parent; parents without visible replies are absent.
+    """
+    replies = {}
+    for i in range(0, len(parents), PARENT_CHUNK_SIZE):
+        chunk = parents[i:i + PARENT_CHUNK_SIZE]
+        sql = " UNION ALL ".join([REPLIES_SQL] * len(chunk))
+        parameters = []
+        for parent in chunk:
+            parameters += [userid, userid, parent, userid, userid, size]
+
+        for row in datatier.retrieve_all_rows(dbConn, sql, parameters):
+            replies.setdefault(row[5], []).append(row)
+
+    for rows in replies.values():
+        rows.sort(key=lambda row: (row[2], row[0]), reverse=True)
+
+    return replies
+
+
+def load_thread(dbConn, userid, postid, depth, breadth):
+    """
+    Returns the thread rows (depth first) for build_thread: the post
+    and its ancestors, then its replies level by level down to depth.
+    Only the newest breadth replies of a post are walked further, and
+    the walk stops after MAX_THREAD_POSTS posts. Returns [] if the
+    post does not exist or its author is blocked either way.
+    """
+    rows = datatier.retrieve_all_rows(
+        dbConn, ANCESTORS_SQL, [postid, MAX_ANCESTORS, userid, userid, userid, userid])
+    if not any(row[0] == 0 for row in rows):
+        return []
+
+    parents = [postid]
+    for level in range(1, depth + 1):
+        if not parents or len(rows) >= MAX_THREAD_POSTS:
+            break
+
+        replies = load_replies(dbConn, userid, parents, breadth + 1)
+        next_parents = []
+        for parent in parents:
+            children = replies.get(parent, [])
+            rows += [(level,) + tuple(row) for row in children]
+            next_parents += [row[0] for row in children[:breadth]]
+        parents = next_parents
+
+    return rows[:MAX_THREAD_POSTS]
+
+
+def serialize_post(row):
+    """
+    Converts a thread row (depth first) into the same post format
+    get_recent_tweets returns.
+    """
+    return {
+        "post_id": row[1],
+        "userid": row[2],
+        "dateposted": row[3].strftime('%Y-%m-%d %H:%M:%S') if isinstance(row[3], datetime) else row[3],
+        "content": row[4],
+        "image": row[5],
+        "reply_to_postid": row[6],
+        "liked": row[7],
+        "retweeted": row[8],
+        "username": row[9],
+    }
+
+
+def build_thread(rows, postid, breadth):
+    """
+    Assembles thread rows into {"ancestors": [...], "post": {...}}:
+    ancestors oldest first, and the post with its replies nested
+    under "replies", newest first. A post with more than breadth
+    replies keeps the newest breadth and gets "more_replies": true.
+    Returns None if the post itself is not among the rows.
+    """
+    ancestors = []
+    posts = {}
+    for row in rows:
+        depth = row[0]
+        post = serialize_post(row)
+        if depth < 0:
+            ancestors.append((depth, post))
+            continue
+
+        parent = posts.get(post["reply_to_postid"])
+        if depth > 0 and parent is None:
+            continue    # its parent was cut by the breadth budget
+
+        post["replies"] = []
+        post["more_replies"] = False
+        if depth > 0:
+            if len(parent["replies"]) == breadth:
+                parent["more_replies"] = True
+                continue
+            parent["replies"].append(post)
+        posts[post["post_id"]] = post
+
+    if postid not in posts:
+        return None
+
+    ancestors.sort(key=lambda item: item[0])
+    return {
+        "ancestors": [post for depth, post in ancestors],
+        "post": posts[postid]
+    }
+
+
+def parse_budget(event_body, name, default, maximum, minimum):
+    """
+    Validates an optional integer budget, capped at maximum.
+    Raises ValueError if it is not an integer >= minimum.
+    """
+    value = event_body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValueError(f"{name} must be an integer >= {minimum}")
+
+    return min(value, maximum)
+
+
+@datatier.instrument_handler
+@datatier.etag_handler
+def lambda_handler(event, context):
+    """
+    get_thread.py
+    --------------
+    Receives:
+        - userid : the user viewing the thread
+        - postid : any post in the thread
+        - [OPTIONAL] depth : reply levels to return below the post
+        - [OPTIONAL] breadth : replies to return per post
+
+    On Success:
+        - Returns the post's ancestors (oldest first) and the post
+          with its replies nested to the given depth and breadth,
+          skipping users the viewer blocked or who blocked the
+          viewer, with liked/retweeted
+          flags for the viewer
+    """
+    try:
+        if "body" not in event:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({
+                    "message": "User error. No data received."
+                })
+            }
+
+        event_body = json.loads(event['body'])
+
+        if "userid" not in event_body:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "userid missing."})
+            }
+
+        if "postid" not in event_body:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "postid missing."})
+            }
+
+        userid = event_body['userid']
+
+        try:
+            postid = int(event_body['postid'])
+            depth = parse_budget(event_body, 'depth', DEFAULT_DEPTH, MAX_DEPTH, 0)
+            breadth = parse_budget(event_body, 'breadth', DEFAULT_BREADTH, MAX_BREADTH, 1)
+        except (TypeError, ValueError) as e:
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": str(e)})
+            }
+
+        # Establish DB connection
+        secret_name = "prod/twitterclone/sql"
+        rds_dbname = "TwitterClone"
+
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, use_replicas=True)
+
+        try:
+            rows = load_thread(db_conn, userid, postid, depth, breadth)
+            thread = build_thread(rows, postid, breadth)
+            if thread is None:
+                return {
+                    "statusCode": 404,
+                    "headers": CORS_HEADERS,
+                    "body": json.dumps({
+                        "message": f"Post with postid {postid} does not exist."
+                    })
+                }
+
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps(thread)
+            }
+
+        except Exception as e:
+            print("Database operation ERR:", e)
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({
+                    "message": f"An error occurred (get_thread): {str(e)}"
+                })
+            }
+
+        finally:
+            datatier.return_dbConn(db_conn)
+
+    except Exception as e:
+        return {
+            "statusCode": 400,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({
+                "message": f"An error occurred (get_thread): {str(e)}"
+            })
+        }
@@ -1,19 +1,20 @@
 from configparser import ConfigParser
 import os
 import json
-import boto3
 from datetime import datetime
 try:
-    import datatier
+    import datatier_async
 except:
-    from . import datatier
+    from . import datatier_async
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+@datatier_async.instrument_handler
+@datatier_async.etag_handler
 def lambda_handler(event, context):
     """
     Input:
@@ -55,21 +56,35 @@ def lambda_handler(event, context):
         username = event_body['username']
 
         # Establish DB connection
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_source = datatier_async.get_source(secret_name, rds_dbname, use_replicas=True)
 
         try:
-            # Get profile info
+            # Profile info and both relationship checks are independent
+            # (the checks join on username), so run them concurrently
             profile_sql = "SELECT userid, bio, picture FROM UserInfo WHERE username = %s;"
-            profile_row = datatier.retrieve_one_row(db_conn, profile_sql, [username])
+
+            # Check if current user follows this user
+            follow_sql = """
+                SELECT 1 FROM Followers f
+                JOIN UserInfo u ON f.followee = u.userid
+                WHERE f.follower = %s AND u.username = %s;
+            """
+
+            # Check if current user blocks this user
+            block_sql = """
+                SELECT 1 FROM Blocked b
+                JOIN UserInfo u ON b.blockee = u.userid
+                WHERE b.blocker = %s AND u.username = %s;
+            """
+
+            profile_row, follow_row, block_row = datatier_async.gather(
+                datatier_async.retrieve_one_row(db_source, profile_sql, [username]),
+                datatier_async.retrieve_one_row(db_source, follow_sql, [current_userid, username]),
+                datatier_async.retrieve_one_row(db_source, block_sql, [current_userid, username])
+            )
             
             if not profile_row:
                 return {
@@ -79,14 +94,8 @@ def lambda_handler(event, context):
                 }
             
             target_userid, bio, picture = profile_row
-            
-            # Check if current user follows this user
-            follow_sql = "SELECT 1 FROM Followers WHERE follower = %s AND followee = %s;"
-            is_following = bool(datatier.retrieve_one_row(db_conn, follow_sql, [current_userid, target_userid]))
-            
-            # Check if current user blocks this user
-            block_sql = "SELECT 1 FROM Blocked WHERE blocker = %s AND blockee = %s;"
-            is_blocked = bool(datatier.retrieve_one_row(db_conn, block_sql, [current_userid, target_userid]))
+            is_following = bool(follow_row)
+            is_blocked = bool(block_row)
             
             return {
                 "statusCode": 200,
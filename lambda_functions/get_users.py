@@ -1,25 +1,30 @@
 from configparser import ConfigParser
 import os
 import json
-import boto3
 from datetime import datetime
 try:
+    import block_set
     import datatier
 except:
+    from . import block_set
     from . import datatier
 
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+@datatier.instrument_handler
+@datatier.etag_handler
 def lambda_handler(event, context):
     """
     Input:
     -----
     - userid -- The userid of the user that is logged in, so that we don't get their information accidentally. 
 
+    Users the logged-in user blocked, or who blocked them, are left out.
+
     """
     try:
         if "body" not in event:
@@ -43,24 +48,27 @@ def lambda_handler(event, context):
         userid = event_body['userid']
 
         # Establish DB connection
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, use_replicas=True)
 
         try:
             sql = "SELECT userid, username, picture FROM UserInfo WHERE userid != %s;"
-            rows = datatier.retrieve_all_rows(db_conn, sql, [userid])
+
+            # both directions of blocking, filtered in memory
+            blocked = block_set.blocked_users(db_conn, userid)
+
+            # Serialize batch by batch so the full user list is
+            # never held as rows and JSON at the same time
+            serialized = []
+            for rows in datatier.iter_rows(db_conn, sql, [userid]):
+                serialized.extend(json.dumps(row) for row in rows if row[0] not in blocked)
+
             return {
                 "statusCode": 200,
                 "headers": CORS_HEADERS,
-                "body": json.dumps(rows)
+                "body": "[" + ", ".join(serialized) + "]"
             }
 
         except Exception as e:
@@ -73,6 +81,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -4,12 +4,15 @@
 from configparser import ConfigParser
 import os
 try:
+    import counter_buffer
+    import counter_shards
     import datatier
 except:
+    from . import counter_buffer
+    from . import counter_shards
     from . import datatier
 import json
 from datetime import datetime
-import boto3
 
 
 CORS_HEADERS = {
@@ -20,6 +23,7 @@ CORS_HEADERS = {
 
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     
@@ -30,7 +34,8 @@ def lambda_handler(event, context):
         - The pageid of the post being liked
     
     On Success:
-        - Adds a like to the Likes table 
+        - Adds a like to the Likes table
+        - Increments the post's like_count in PostCounters
 
     """
     try:
@@ -74,17 +79,11 @@ def lambda_handler(event, context):
 
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
 
         #
@@ -119,7 +118,33 @@ def lambda_handler(event, context):
                 VALUES (%s, %s);
             """
 
-            datatier.perform_action(db_conn, sql_statement, [userid, postid])
+            # The user's cached timeline pages show the old flag now
+            # (timeline_cache.py)
+            version_sql = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+            # Count the like in PostCounters in the same transaction, on
+            # one of the post's shards: more than one once the post is
+            # hot (counter_shards.py)
+            counter_sql = """
+                INSERT INTO PostCounters (postid, shard, like_count) VALUES (%s, %s, 1)
+                ON DUPLICATE KEY UPDATE like_count = like_count + 1;
+            """
+
+            statements = [
+                (sql_statement, [userid, postid]),
+                (version_sql, [userid]),
+            ]
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                # queue the delta instead; it is applied to PostCounters
+                # in batches with other deltas (counter_buffer.py)
+                statements.insert(1, counter_buffer.delta_statement(postid, "like_count", 1))
+            else:
+                statements.insert(1, (counter_sql, [postid, counter_shards.pick(postid)]))
+
+            datatier.execute_batch(db_conn, statements)
+
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                counter_buffer.flush_if_due(db_conn)
 
             return {
                 "statusCode": 200,
@@ -130,6 +155,9 @@ def lambda_handler(event, context):
         except Exception as e:
             print("Updating database ERR: ", e)
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -8,7 +8,6 @@ try:
 except:
     from . import datatier
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -17,8 +16,13 @@ CORS_HEADERS = {
     'Access-Control-Allow-Methods': 'OPTIONS,POST'
 }
 
+# home timeline engine, set the same as get_recent_tweets': the
+# HomeTimeline fan-out is only written for "fanout"; "merge" reads
+# followees' posts at read time and needs no per-follower write
+TIMELINE_ENGINE = os.environ.get("TIMELINE_ENGINE", "fanout")
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     
@@ -32,6 +36,12 @@ def lambda_handler(event, context):
     
     On Success:
         - Adds new tweet to PostInfo table
+        - Fans a root post out to the HomeTimeline of its author and
+          their followers (unless TIMELINE_ENGINE is "merge")
+        - Bumps the timeline_version of a root post's author and
+          their followers
+        - Counts a root post in its author's UserInfo.post_count, and
+          a reply in its parent's PostCounters.comment_count
 
     """
     try:
@@ -90,16 +100,10 @@ def lambda_handler(event, context):
 
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
 
         #
@@ -120,7 +124,59 @@ def lambda_handler(event, context):
             print(f"image_file_key: {image_file_key}")
             print(f"root_post_id: {root_post_id}")
 
-            datatier.perform_action(db_conn, sql_statement, [userid, textcontent, image_file_key, root_post_id])
+            # Fan-out on write: copy a root post into the home timeline
+            # of its author and of everyone following them. Replies never
+            # show on home timelines. LAST_INSERT_ID() is the postid just
+            # inserted on this connection.
+            fanout_sql = """
+                INSERT INTO HomeTimeline (owner, dateposted, postid, authorid)
+                SELECT p.userid, p.dateposted, p.postid, p.userid
+                FROM PostInfo p
+                WHERE p.postid = LAST_INSERT_ID() AND p.reply_to_postid IS NULL
+                UNION ALL
+                SELECT f.follower, p.dateposted, p.postid, p.userid
+                FROM PostInfo p
+                JOIN Followers f ON f.followee = p.userid
+                WHERE p.postid = LAST_INSERT_ID() AND p.reply_to_postid IS NULL;
+            """
+
+            statements = [
+                (sql_statement, [userid, textcontent, image_file_key, root_post_id]),
+            ]
+
+            if root_post_id is not None:
+                # a reply counts toward its parent's comment_count
+                # (always on shard 0; see counter_shards.py)
+                counter_sql = """
+                    INSERT INTO PostCounters (postid, shard, comment_count) VALUES (%s, 0, 1)
+                    ON DUPLICATE KEY UPDATE comment_count = comment_count + 1;
+                """
+                statements.append((counter_sql, [root_post_id]))
+            else:
+                if TIMELINE_ENGINE != "merge":
+                    statements.append((fanout_sql, []))
+
+                # Invalidate the cached timeline pages of the author's
+                # followers, and of the author with the post_count bump
+                # (timeline_cache.py; post_count also versions the
+                # author's posts cached by timeline_merge.py)
+                version_sql = """
+                    UPDATE UserInfo u
+                    JOIN Followers f ON f.follower = u.userid
+                    SET u.timeline_version = u.timeline_version + 1
+                    WHERE f.followee = %s;
+                """
+                count_sql = """
+                    UPDATE UserInfo
+                    SET post_count = post_count + 1, timeline_version = timeline_version + 1
+                    WHERE userid = %s;
+                """
+                statements.append((version_sql, [userid]))
+                statements.append((count_sql, [userid]))
+
+            # One round trip and one commit for the post, its fan-out
+            # and the counters
+            datatier.execute_batch(db_conn, statements)
            
 
             print("Update successful.")
@@ -137,6 +193,9 @@ def lambda_handler(event, context):
         except Exception as e:
             print("Updating database ERR: ", e)
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
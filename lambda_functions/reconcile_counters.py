@@ -0,0 +1,112 @@
+import os
+import json
+try:
+    import counter_buffer
+    import datatier
+except:
+    from . import counter_buffer
+    from . import datatier
+
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST'
+}
+
+# how far back a scheduled run (no postids) recomputes counters
+RECONCILE_HOURS = int(os.environ.get("RECONCILE_HOURS", "24"))
+
+
+@datatier.instrument_handler
+def lambda_handler(event, context):
+    """
+    reconcile_counters.py
+    --------------
+    Receives (a request body, or the scheduled event itself; runs on
+    the schedules in deploy_reconcile_counters.yml, so everything is
+    optional):
+        - [OPTIONAL] flush_only : only apply the queued counter deltas
+        - [OPTIONAL] postids : the posts whose counters to recompute
+        - [OPTIONAL] hours : recompute every post from the last hours
+          (default RECONCILE_HOURS)
+
+    On Success:
+        - Applies the counter deltas the write handlers queued
+          (counter_buffer.py), then, unless flush_only, recomputes
+          the posts' PostCounters rows from Likes, Retweets and
+          PostInfo, a batch of posts per transaction, repairing any
+          drift
+    """
+    try:
+        if event.get('body'):
+            event_body = json.loads(event['body'])
+        else:
+            event_body = event
+
+        flush_only = event_body.get('flush_only', False) is True
+        postids = event_body.get('postids', None)
+        hours = event_body.get('hours', RECONCILE_HOURS)
+
+        if postids is not None and not isinstance(postids, list):
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "postids must be a list."})
+            }
+
+        if postids is None and (isinstance(hours, bool) or not isinstance(hours, int) or hours < 1):
+            return {
+                "statusCode": 400,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({"message": "hours must be a positive integer."})
+            }
+
+        # Establishing DB connection
+        secret_name = "prod/twitterclone/sql"
+        rds_dbname = "TwitterClone"
+
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
+
+        try:
+            # deltas queued by write handlers whose containers have
+            # gone idle are applied here, at least once a minute
+            deltas = counter_buffer.flush_all(db_conn)
+
+            rows = 0
+            if not flush_only and postids is not None:
+                rows = counter_buffer.reconcile(db_conn, postids=postids)
+            elif not flush_only:
+                rows = counter_buffer.reconcile(db_conn, hours=hours)
+
+            return {
+                "statusCode": 200,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({
+                    "message": "Counters flushed." if flush_only else "Counters reconciled.",
+                    "deltas_applied": deltas,
+                    "rows_affected": rows
+                })
+            }
+
+        except Exception as e:
+            print("Database operation ERR: ", e)
+            return {
+                "statusCode": 500,
+                "headers": CORS_HEADERS,
+                "body": json.dumps({
+                    "message": f"Database error: {str(e)}"
+                })
+            }
+
+        finally:
+            datatier.return_dbConn(db_conn)
+
+    except Exception as e:
+        return {
+            "statusCode": 400,
+            "headers": CORS_HEADERS,
+            "body": json.dumps({
+                "message": f"An error occurred (reconcile_counters): {str(e)}"
+            })
+        }
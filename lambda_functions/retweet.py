@@ -1,11 +1,14 @@
 from configparser import ConfigParser
 import os
 try:
+    import counter_buffer
+    import counter_shards
     import datatier
 except:
+    from . import counter_buffer
+    from . import counter_shards
     from . import datatier
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -15,6 +18,7 @@ CORS_HEADERS = {
 }
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     retweet.py
@@ -25,6 +29,7 @@ def lambda_handler(event, context):
     
     On Success:
         - Adds a retweet to the Retweets table
+        - Increments the post's retweet_count in PostCounters
     """
     try:
         if "body" not in event:
@@ -63,16 +68,10 @@ def lambda_handler(event, context):
         # Establishing DB connection
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
             # Check if user exists
@@ -138,7 +137,33 @@ def lambda_handler(event, context):
                 VALUES (%s, %s);
             """
 
-            datatier.perform_action(db_conn, sql_statement, [userid, postid])
+            # The user's cached timeline pages show the old flag now
+            # (timeline_cache.py)
+            version_sql = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+            # Count the retweet in PostCounters in the same transaction, on
+            # one of the post's shards: more than one once the post is
+            # hot (counter_shards.py)
+            counter_sql = """
+                INSERT INTO PostCounters (postid, shard, retweet_count) VALUES (%s, %s, 1)
+                ON DUPLICATE KEY UPDATE retweet_count = retweet_count + 1;
+            """
+
+            statements = [
+                (sql_statement, [userid, postid]),
+                (version_sql, [userid]),
+            ]
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                # queue the delta instead; it is applied to PostCounters
+                # in batches with other deltas (counter_buffer.py)
+                statements.insert(1, counter_buffer.delta_statement(postid, "retweet_count", 1))
+            else:
+                statements.insert(1, (counter_sql, [postid, counter_shards.pick(postid)]))
+
+            datatier.execute_batch(db_conn, statements)
+
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                counter_buffer.flush_if_due(db_conn)
 
             return {
                 "statusCode": 200,
@@ -158,6 +183,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
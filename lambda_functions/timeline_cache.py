@@ -0,0 +1,96 @@
+#
+# timeline_cache.py
+#
+# Per-container cache of rendered home-timeline pages, in front of
+# the get_recent_tweets SQL:
+#
+#   body = timeline_cache.get_cache().get(userid, key, version)
+#
+# Entries are keyed by (userid, key), where key holds the cursor and
+# whatever else shapes the response, and tagged with the user's
+# UserInfo.timeline_version. The write handlers (post_tweet,
+# delete_post, follow_user, unfollow_user, block_user, unblock_user,
+# like_post, delete_like, retweet, unretweet) bump that version for
+# every user whose timeline they change, in the same transaction as
+# the change, so an entry is only served while the version it was
+# rendered at is still current -- whichever container did the write.
+# The TTL bounds how stale the parts no version covers (engagement
+# counts, authors' profile changes) can get.
+#
+import os
+import time
+from collections import OrderedDict
+
+
+#
+# Cache settings: how many pages are kept before evicting the least
+# recently used, and for how long (seconds). A size of 0 turns the
+# cache off.
+#
+TIMELINE_CACHE_SIZE = int(os.environ.get("TIMELINE_CACHE_SIZE", "1000"))
+TIMELINE_CACHE_TTL = float(os.environ.get("TIMELINE_CACHE_TTL", "15"))
+
+
+###################################################################
+#
+# TimelineCache:
+#
+# Rendered response bodies keyed by (userid, key), each stored with
+# the timeline version it was rendered at.
+#
+class TimelineCache:
+  def __init__(self, size=None, ttl=None):
+    self.size = TIMELINE_CACHE_SIZE if size is None else size
+    self.ttl = TIMELINE_CACHE_TTL if ttl is None else ttl
+    self._entries = OrderedDict()   # (userid, key) -> (stored_at, version, body)
+
+  def get(self, userid, key, version):
+    """
+    Returns the cached body for userid and key if it was rendered at
+    version and has not expired, else None
+
+    Parameters
+    __________
+    userid : whose timeline,
+    key : hashable description of the request (cursor, limit, ...),
+    version : the user's current timeline_version
+
+    Returns
+    _______
+    body string or None
+    """
+    entry = self._entries.get((userid, key))
+    if entry is None:
+      return None
+
+    if entry[1] != version or time.monotonic() - entry[0] > self.ttl:
+      del self._entries[(userid, key)]
+      return None
+
+    self._entries.move_to_end((userid, key))
+    return entry[2]
+
+  def put(self, userid, key, version, body):
+    if self.size <= 0:
+      return
+
+    self._entries[(userid, key)] = (time.monotonic(), version, body)
+    self._entries.move_to_end((userid, key))
+    while len(self._entries) > self.size:
+      self._entries.popitem(last=False)
+
+  def clear(self):
+    self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+#
+# the container-wide cache used by get_recent_tweets
+#
+_cache = TimelineCache()
+
+
+def get_cache():
+  return _cache
@@ -0,0 +1,346 @@
+#
+# timeline_merge.py
+#
+# Pull-based home timeline engine. Instead of reading a
+# materialized timeline (HomeTimeline, filled on write), a page is
+# built at read time by merging the recent posts of everyone the
+# reader follows:
+#
+#   rows = timeline_merge.timeline_page(dbConn, userid, 21, after)
+#
+# Each author's newest AUTHOR_CACHE_SIZE root posts are kept as
+# (dateposted, postid) keys in a per-container cache, so a warm
+# page costs one Followers lookup, an in-memory heap merge that
+# stops as soon as the page is full, and one primary-key lookup
+# of the posts on the page.
+#
+# Cached lists are tagged with the author's UserInfo.post_count,
+# read along with the followees, which post_tweet and delete_post
+# change in the same transaction as the post: a list is only used
+# while its author's count is unchanged, so a new post shows on the
+# next page read in any container. (Only a delete and a new post
+# within AUTHOR_CACHE_TTL leave the count as it was; the TTL bounds
+# that case.)
+#
+import heapq
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+  import datatier
+except:
+  from . import datatier
+
+
+#
+# Per-author cache settings: how many recent root posts are kept
+# per author, for how long (seconds) before they are re-read, and
+# how many authors the cache holds before evicting the least
+# recently used.
+#
+AUTHOR_CACHE_SIZE = int(os.environ.get("TIMELINE_AUTHOR_CACHE_SIZE", "200"))
+AUTHOR_CACHE_TTL = float(os.environ.get("TIMELINE_AUTHOR_CACHE_TTL", "30"))
+AUTHOR_CACHE_MAX_AUTHORS = int(os.environ.get("TIMELINE_AUTHOR_CACHE_MAX_AUTHORS", "20000"))
+
+#
+# Authors per statement when filling the cache.
+#
+LOAD_CHUNK_SIZE = 100
+
+
+###################################################################
+#
+# AuthorPostCache:
+#
+# Newest root posts per author as lists of (dateposted, postid),
+# newest first, each stored with the author's post_count it was
+# read at. An entry is "complete" when it holds all of the
+# author's root posts, i.e. fewer than the cache size were found.
+#
+class AuthorPostCache:
+  def __init__(self, size=None, ttl=None, max_authors=None):
+    self.size = AUTHOR_CACHE_SIZE if size is None else size
+    self.ttl = AUTHOR_CACHE_TTL if ttl is None else ttl
+    self.max_authors = AUTHOR_CACHE_MAX_AUTHORS if max_authors is None else max_authors
+    self._entries = OrderedDict()   # author -> (loaded_at, version, keys, complete)
+
+  def get_many(self, dbConn, authors):
+    """
+    Returns {author: (keys, complete)} for the given authors,
+    loading missing, expired or outdated ones from the database
+
+    Parameters
+    __________
+    dbConn : open connection to MySQL server,
+    authors : dict of userid -> the author's current post_count
+              (None: always reload)
+
+    Returns
+    _______
+    dict of author -> (list of (dateposted, postid) newest first,
+    True if the list holds all of the author's root posts)
+    """
+    now = time.monotonic()
+    found = {}
+    stale = []
+
+    for author, version in authors.items():
+      entry = self._entries.get(author)
+      if entry is None or version is None or entry[1] != version or now - entry[0] > self.ttl:
+        stale.append(author)
+      else:
+        self._entries.move_to_end(author)
+        found[author] = (entry[2], entry[3])
+
+    if stale:
+      loaded = load_recent_posts(dbConn, stale, self.size)
+      for author in stale:
+        keys = loaded.get(author, [])
+        complete = len(keys) < self.size
+        self._put(author, (now, authors[author], keys, complete))
+        found[author] = (keys, complete)
+
+    return found
+
+  def invalidate(self, author):
+    self._entries.pop(author, None)
+
+  def clear(self):
+    self._entries.clear()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _put(self, author, entry):
+    self._entries[author] = entry
+    self._entries.move_to_end(author)
+    while len(self._entries) > self.max_authors:
+      self._entries.popitem(last=False)
+
+
+#
+# the container-wide cache used by timeline_page
+#
+_cache = AuthorPostCache()
+
+
+def get_cache():
+  return _cache
+
+
+###################################################################
+#
+# load_recent_posts:
+#
+# Reads the newest `size` root posts of each author, one LIMITed
+# range scan on PostInfo(userid, reply_to_postid, dateposted,
+# postid) per author, LOAD_CHUNK_SIZE authors per statement.
+#
+def load_recent_posts(dbConn, authors, size):
+  """
+  Returns {author: [(dateposted, postid), ...]} newest first, at
+  most size per author; authors without root posts are absent
+  """
+  per_author = """
+    (SELECT p.userid, p.dateposted, p.postid
+     FROM PostInfo p
+     WHERE p.userid = %s AND p.reply_to_postid IS NULL
+     ORDER BY p.dateposted DESC, p.postid DESC
+     LIMIT %s)"""
+
+  recent = {}
+  for i in range(0, len(authors), LOAD_CHUNK_SIZE):
+    chunk = authors[i:i + LOAD_CHUNK_SIZE]
+    sql = " UNION ALL ".join([per_author] * len(chunk))
+    parameters = []
+    for author in chunk:
+      parameters += [author, size]
+
+    for userid, dateposted, postid in datatier.retrieve_all_rows(dbConn, sql, parameters):
+      recent.setdefault(userid, []).append((dateposted, postid))
+
+  for keys in recent.values():
+    keys.sort(reverse=True)
+
+  return recent
+
+
+###################################################################
+#
+# followees:
+#
+# The authors on userid's home timeline: userid itself and
+# everyone they follow, minus anyone in their block set (whom they
+# blocked or who blocked them, see block_set.py), each with their
+# post_count, the version of their cached posts.
+#
+def followees(dbConn, userid, blocked=frozenset()):
+  """
+  Returns {author: post_count}, userid first
+  """
+  sql = """
+    SELECT u.userid, u.post_count
+    FROM UserInfo u
+    WHERE u.userid = %s
+    UNION ALL
+    SELECT u.userid, u.post_count
+    FROM Followers f
+    JOIN UserInfo u ON u.userid = f.followee
+    WHERE f.follower = %s
+  """
+  rows = datatier.retrieve_all_rows(dbConn, sql, [userid, userid])
+
+  authors = {userid: None}
+  for author, post_count in rows:
+    if author == userid or author not in blocked:
+      authors[author] = post_count
+  return authors
+
+
+###################################################################
+#
+# merge_keys:
+#
+# Heap-based k-way merge of per-author key lists (newest first),
+# skipping keys at or newer than `after`, stopping after `count`
+# keys. Returns (keys, authors) -- the merged keys and who wrote
+# each -- or None if the caches cannot answer: a list truncated at
+# the cache size ran out before the page was full, so older posts
+# of that author could belong on the page.
+#
+def merge_keys(lists, count, after=None):
+  """
+  Parameters
+  __________
+  lists : dict author -> (keys newest first, complete),
+  count : number of keys wanted,
+  after : optional (dateposted, postid); only older keys are
+          returned
+
+  Returns
+  _______
+  (keys, authors) or None
+  """
+  #
+  # every key at or after the horizon -- the newest "oldest cached
+  # key" of any truncated list -- is known to be in some list:
+  #
+  horizon = None
+  for keys, complete in lists.values():
+    if not complete and keys:
+      oldest = keys[-1]
+      if horizon is None or oldest > horizon:
+        horizon = oldest
+
+  def tagged(author, keys):
+    for key in keys:
+      if after is None or key < after:
+        yield key, author
+
+  streams = [tagged(author, keys) for author, (keys, complete) in lists.items() if keys]
+
+  merged = []
+  authors = []
+  for key, author in heapq.merge(*streams, reverse=True):
+    if horizon is not None and key < horizon:
+      return None
+    merged.append(key)
+    authors.append(author)
+    if len(merged) == count:
+      return merged, authors
+
+  # ran out of posts: this is the end of the timeline, unless a
+  # truncated list was what ran out
+  if horizon is not None:
+    return None
+
+  return merged, authors
+
+
+###################################################################
+#
+# timeline_page:
+#
+# One page of userid's home timeline, in the same 9-column row
+# shape as the HomeTimeline query in get_recent_tweets.
+#
+def timeline_page(dbConn, userid, count, after=None, cache=None, blocked=frozenset()):
+  """
+  Builds a page by merging followees' cached recent posts
+
+  Parameters
+  __________
+  dbConn : open connection to MySQL server,
+  userid : whose home timeline,
+  count : rows wanted (page size + 1 to detect a next page),
+  after : optional cursor (dateposted string, postid); only older
+          posts are returned,
+  cache : AuthorPostCache to use (default: the container's),
+  blocked : userid's block set; those authors are left out
+
+  Returns
+  _______
+  list of rows (postid, userid, dateposted, textcontent, picture,
+  reply_to_postid, is_liked, is_retweeted, username) newest first,
+  or None if the page cannot be built from the caches and the
+  caller should fall back to SQL
+  """
+  if cache is None:
+    cache = _cache
+
+  if after is not None:
+    after = (datetime.strptime(after[0], '%Y-%m-%d %H:%M:%S'), after[1])
+
+  lists = cache.get_many(dbConn, followees(dbConn, userid, blocked))
+
+  result = merge_keys(lists, count, after)
+  if result is None:
+    return None
+
+  keys, authors = result
+  if not keys:
+    return []
+
+  rows = hydrate(dbConn, userid, [key[1] for key in keys])
+
+  if len(rows) < len(keys):
+    # a cached post was deleted since it was cached: forget those
+    # authors and let the caller answer this page from SQL
+    found = {row[0] for row in rows}
+    for key, author in zip(keys, authors):
+      if key[1] not in found:
+        cache.invalidate(author)
+    return None
+
+  return rows
+
+
+def hydrate(dbConn, userid, postids):
+  """
+  Returns the timeline rows for postids, in the order given;
+  posts that no longer exist are left out
+  """
+  sql = """
+    SELECT
+      p.postid,
+      p.userid,
+      p.dateposted,
+      p.textcontent,
+      u.picture,
+      p.reply_to_postid,
+      CASE WHEN l.liker IS NOT NULL THEN 1 ELSE 0 END AS is_liked,
+      CASE WHEN r.retweetuserid IS NOT NULL THEN 1 ELSE 0 END AS is_retweeted,
+      u.username
+    FROM PostInfo p
+    JOIN UserInfo u ON p.userid = u.userid
+    LEFT JOIN Likes l ON p.postid = l.originalpost AND l.liker = %s
+    LEFT JOIN Retweets r ON p.postid = r.originalpost AND r.retweetuserid = %s
+    WHERE p.postid IN ({})
+  """.format(", ".join(["%s"] * len(postids)))
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, [userid, userid] + list(postids))
+
+  by_postid = {row[0]: row for row in rows}
+  return [by_postid[postid] for postid in postids if postid in by_postid]
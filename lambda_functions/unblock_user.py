@@ -4,10 +4,11 @@ from configparser import ConfigParser
 import os
 try:
     import datatier
+    import datatier_async
 except:
     from . import datatier
+    from . import datatier_async
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -17,6 +18,7 @@ CORS_HEADERS = {
 }
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     unblock_user.py
@@ -27,6 +29,7 @@ def lambda_handler(event, context):
     
     On Success:
         - Removes a block relationship from the Blocked table
+        - Bumps both users' timeline_version and block_version
     """
     try:
         if "body" not in event:
@@ -63,23 +66,30 @@ def lambda_handler(event, context):
         blockee_username = event_body['blockee_username']
 
         # Establishing DB connection
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_source = datatier_async.get_source(secret_name, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
-            # Get blockee userid from username
+            # Both prechecks look the blockee up by username, so they
+            # run concurrently
             check_blockee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
-            blockee_result = datatier.retrieve_all_rows(db_conn, check_blockee_sql, [blockee_username])
-            
-            if not blockee_result:
+
+            # Check if block exists
+            check_block_sql = """
+                SELECT 1 FROM Blocked b
+                JOIN UserInfo u ON b.blockee = u.userid
+                WHERE b.blocker = %s AND u.username = %s;
+            """
+
+            blockee_row, existing_block = datatier_async.gather(
+                datatier_async.retrieve_one_row(db_source, check_blockee_sql, [blockee_username]),
+                datatier_async.retrieve_one_row(db_source, check_block_sql, [blocker, blockee_username])
+            )
+
+            if not blockee_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -88,12 +98,8 @@ def lambda_handler(event, context):
                     })
                 }
             
-            blockee = blockee_result[0][0]  # Extract userid from result
-            
-            # Check if block exists
-            check_block_sql = "SELECT * FROM Blocked WHERE blocker = %s AND blockee = %s;"
-            existing_block = datatier.retrieve_all_rows(db_conn, check_block_sql, [blocker, blockee])
-            
+            blockee = blockee_row[0]  # Extract userid from result
+
             if not existing_block:
                 return {
                     "statusCode": 404,
@@ -109,7 +115,18 @@ def lambda_handler(event, context):
                 WHERE blocker = %s AND blockee = %s;
             """
 
-            datatier.perform_action(db_conn, sql_statement, [blocker, blockee])
+            # Cached timeline pages and block sets of both users are
+            # stale now (timeline_cache.py, block_set.py)
+            version_sql = """
+                UPDATE UserInfo
+                SET timeline_version = timeline_version + 1, block_version = block_version + 1
+                WHERE userid IN (%s, %s);
+            """
+
+            datatier.execute_batch(db_conn, [
+                (sql_statement, [blocker, blockee]),
+                (version_sql, [blocker, blockee]),
+            ])
 
             return {
                 "statusCode": 200,
@@ -129,6 +146,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -4,10 +4,11 @@ from configparser import ConfigParser
 import os
 try:
     import datatier
+    import datatier_async
 except:
-    from . import datatier 
+    from . import datatier
+    from . import datatier_async
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -17,6 +18,7 @@ CORS_HEADERS = {
 }
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     unfollow_user.py
@@ -27,6 +29,8 @@ def lambda_handler(event, context):
     
     On Success:
         - Removes a follower relationship from the Followers table
+        - Removes the followee's posts from the follower's HomeTimeline
+          and bumps their timeline_version
     """
     try:
         if "body" not in event:
@@ -65,23 +69,30 @@ def lambda_handler(event, context):
         # Establishing DB connection
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_source = datatier_async.get_source(secret_name, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
-            # Get followee userid from username
+            # Both prechecks look the followee up by username, so they
+            # run concurrently
             check_followee_sql = "SELECT userid FROM UserInfo WHERE username = %s;"
-            followee_result = datatier.retrieve_all_rows(db_conn, check_followee_sql, [followee_username])
-            
-            if not followee_result:
+
+            # Check if the relationship exists
+            check_relationship_sql = """
+                SELECT 1 FROM Followers f
+                JOIN UserInfo u ON f.followee = u.userid
+                WHERE f.follower = %s AND u.username = %s;
+            """
+
+            followee_row, existing_relationship = datatier_async.gather(
+                datatier_async.retrieve_one_row(db_source, check_followee_sql, [followee_username]),
+                datatier_async.retrieve_one_row(db_source, check_relationship_sql, [follower, followee_username])
+            )
+
+            if not followee_row:
                 return {
                     "statusCode": 404,
                     "headers": CORS_HEADERS,
@@ -90,12 +101,8 @@ def lambda_handler(event, context):
                     })
                 }
             
-            followee = followee_result[0][0]  # Extract userid from result
-            
-            # Check if the relationship exists
-            check_relationship_sql = "SELECT * FROM Followers WHERE follower = %s AND followee = %s;"
-            existing_relationship = datatier.retrieve_all_rows(db_conn, check_relationship_sql, [follower, followee])
-            
+            followee = followee_row[0]  # Extract userid from result
+
             if not existing_relationship:
                 return {
                     "statusCode": 404,
@@ -111,7 +118,21 @@ def lambda_handler(event, context):
                 WHERE follower = %s AND followee = %s;
             """
 
-            datatier.perform_action(db_conn, sql_statement, [follower, followee])
+            # Purge the followee's posts from the follower's home timeline
+            purge_sql = """
+                DELETE FROM HomeTimeline
+                WHERE owner = %s AND authorid = %s;
+            """
+
+            # Cached timeline pages of the follower are stale now
+            # (timeline_cache.py)
+            version_sql = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+            datatier.execute_batch(db_conn, [
+                (sql_statement, [follower, followee]),
+                (purge_sql, [follower, followee]),
+                (version_sql, [follower]),
+            ])
 
             return {
                 "statusCode": 200,
@@ -131,6 +152,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
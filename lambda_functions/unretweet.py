@@ -1,11 +1,14 @@
 from configparser import ConfigParser
 import os
 try:
+    import counter_buffer
+    import counter_shards
     import datatier
 except:
+    from . import counter_buffer
+    from . import counter_shards
     from . import datatier
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -16,6 +19,7 @@ CORS_HEADERS = {
 
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     unretweet.py
@@ -26,6 +30,7 @@ def lambda_handler(event, context):
     
     On Success:
         - Removes a retweet from the Retweets table
+        - Decrements the post's retweet_count in PostCounters
     """
     try:
         if "body" not in event:
@@ -64,17 +69,11 @@ def lambda_handler(event, context):
         # Establishing DB connection
         print("*** Establishing DB connection ***")
        
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname, multi_statements=True)
 
         try:
             # Check if retweet exists
@@ -96,7 +95,36 @@ def lambda_handler(event, context):
                 WHERE retweetuserid = %s AND originalpost = %s;
             """
 
-            datatier.perform_action(db_conn, sql_statement, [userid, postid])
+            # The user's cached timeline pages show the old flag now
+            # (timeline_cache.py)
+            version_sql = "UPDATE UserInfo SET timeline_version = timeline_version + 1 WHERE userid = %s;"
+
+            # Uncount it in PostCounters in the same transaction, on
+            # one of the post's shards (counter_shards.py; a shard may
+            # go negative, the sum is what counts). Only if the DELETE
+            # just removed a row, so a concurrent duplicate request
+            # cannot uncount it twice.
+            counter_sql = """
+                INSERT INTO PostCounters (postid, shard, retweet_count)
+                SELECT %s, %s, -1 FROM DUAL WHERE ROW_COUNT() > 0
+                ON DUPLICATE KEY UPDATE retweet_count = retweet_count - 1;
+            """
+
+            statements = [
+                (sql_statement, [userid, postid]),
+                (version_sql, [userid]),
+            ]
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                # queue the delta instead; it is applied to PostCounters
+                # in batches with other deltas (counter_buffer.py)
+                statements.insert(1, counter_buffer.delta_statement(postid, "retweet_count", -1))
+            else:
+                statements.insert(1, (counter_sql, [postid, counter_shards.pick(postid)]))
+
+            datatier.execute_batch(db_conn, statements)
+
+            if counter_buffer.COUNTER_WRITE_BEHIND:
+                counter_buffer.flush_if_due(db_conn)
 
             return {
                 "statusCode": 200,
@@ -116,6 +144,9 @@ def lambda_handler(event, context):
                 })
             }
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         return {
             "statusCode": 400,
@@ -5,7 +5,6 @@ try:
 except:
     from . import datatier
 import json
-import boto3
 
 
 CORS_HEADERS = {
@@ -15,6 +14,7 @@ CORS_HEADERS = {
 }
 
 
+@datatier.instrument_handler
 def lambda_handler(event, context):
     """
     
@@ -50,17 +50,11 @@ def lambda_handler(event, context):
 
         print("*** Establishing DB connection ***")
 
-        secret_manager = boto3.client('secretsmanager')
         secret_name = "prod/twitterclone/sql"
-        secret = json.loads(secret_manager.get_secret_value(SecretId=secret_name)['SecretString'])
-        rds_endpoint = secret['host']
-        rds_portnum = secret['port']
-        rds_username = secret['username']
-        rds_pwd = secret['password']
         rds_dbname = "TwitterClone"
 
 
-        db_conn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+        db_conn = datatier.checkout_dbConn_from_secret(secret_name, rds_dbname)
 
 
         #
@@ -113,6 +107,9 @@ def lambda_handler(event, context):
         except Exception as e:
             print("Updating database ERR: ", e)
 
+        finally:
+            datatier.return_dbConn(db_conn)
+
     except Exception as e:
         print("ERR: ", e)
         return {
@@ -0,0 +1,69 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from lambda_functions.block_set import BlockSetCache, blocked_users, load_block_set
+
+
+class TestLoadBlockSet(unittest.TestCase):
+
+    @patch('lambda_functions.block_set.datatier')
+    def test_both_directions(self, mock_datatier):
+        """Users I blocked and users who blocked me are both in my set."""
+        # me -> 'blocked_by_me' and 'blocked_me' -> me
+        mock_datatier.retrieve_all_rows.return_value = [('blocked_by_me',), ('blocked_me',)]
+
+        blocked = load_block_set(MagicMock(), 'me')
+
+        self.assertEqual(blocked, frozenset(['blocked_by_me', 'blocked_me']))
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("SELECT blockee FROM Blocked WHERE blocker = %s", sql)
+        self.assertIn("SELECT blocker FROM Blocked WHERE blockee = %s", sql)
+        self.assertEqual(params, ['me', 'me'])
+
+
+class TestBlockSetCache(unittest.TestCase):
+
+    @patch('lambda_functions.block_set.load_block_set')
+    def test_reloads_when_version_changes(self, mock_load):
+        cache = BlockSetCache(size=10, ttl=60)
+        mock_load.return_value = frozenset(['a'])
+        self.assertEqual(cache.get(MagicMock(), 'me', 1), frozenset(['a']))
+        self.assertEqual(cache.get(MagicMock(), 'me', 1), frozenset(['a']))
+        self.assertEqual(mock_load.call_count, 1)
+
+        # block_user / unblock_user bumped block_version
+        mock_load.return_value = frozenset()
+        self.assertEqual(cache.get(MagicMock(), 'me', 2), frozenset())
+        self.assertEqual(mock_load.call_count, 2)
+
+    @patch('lambda_functions.block_set.load_block_set')
+    def test_expires_and_evicts(self, mock_load):
+        mock_load.return_value = frozenset()
+        cache = BlockSetCache(size=1, ttl=15)
+        with patch('lambda_functions.block_set.time.monotonic', return_value=100.0):
+            cache.get(MagicMock(), 'me', 1)
+        with patch('lambda_functions.block_set.time.monotonic', return_value=116.0):
+            cache.get(MagicMock(), 'me', 1)
+            cache.get(MagicMock(), 'other', 1)
+        self.assertEqual(mock_load.call_count, 3)
+        self.assertEqual(len(cache), 1)
+
+
+class TestBlockedUsers(unittest.TestCase):
+
+    @patch('lambda_functions.block_set.datatier')
+    def test_reads_version_when_not_given(self, mock_datatier):
+        mock_datatier.retrieve_one_row.return_value = (5,)
+        mock_datatier.retrieve_all_rows.return_value = [('x',)]
+        cache = BlockSetCache(size=10, ttl=60)
+
+        self.assertEqual(blocked_users(MagicMock(), 'me', cache=cache), frozenset(['x']))
+        self.assertIn("block_version", mock_datatier.retrieve_one_row.call_args[0][1])
+
+        # an unknown user has no blocks
+        mock_datatier.retrieve_one_row.return_value = None
+        self.assertEqual(blocked_users(MagicMock(), 'nobody', cache=cache), frozenset())
+
+
+if __name__ == '__main__':
+    unittest.main()
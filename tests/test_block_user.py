@@ -1,31 +1,24 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock, call
+from unittest.mock import patch, MagicMock, AsyncMock, call
 from lambda_functions.block_user import lambda_handler
 
 class TestBlockUser(unittest.TestCase):
 
-    @patch('lambda_functions.block_user.boto3')
+    @patch('lambda_functions.block_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.block_user.datatier')
-    def test_block_user_success(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager for database credentials
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_block_user_success(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('blocker_id',)],   # 1. Blocker exists
-            [('blockee_id',)],   # 2. Blockee exists (lookup by username)
-            []                   # 3. Not already blocked
+        mock_retrieve_one_row.side_effect = [
+            ('blocker_id',),  # 1. Blocker exists
+            ('blockee_id',),  # 2. Blockee exists (lookup by username)
+            None              # 3. Not already blocked
         ]
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 0, 0, 0, 0, 2]
 
         # Prepare the test event
         event = {
@@ -42,28 +35,35 @@ class TestBlockUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(json.loads(response['body'])['message'], 'Successfully blocked user.')
 
-        # Verify that the insert and two deletes were called
-        self.assertEqual(mock_datatier.perform_action.call_count, 3)
+        # Verify that the insert and two deletes were sent as one batch
+        mock_datatier.execute_batch.assert_called_once()
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(len(statements), 6)
+        self.assertEqual(statements[0][1], ['blocker_id', 'blockee_id'])
+        self.assertEqual(statements[1][1], ['blockee_id', 'blocker_id'])
+        self.assertEqual(statements[2][1], ['blocker_id', 'blockee_id'])
+        # Home timelines are purged in both directions
+        self.assertIn("DELETE FROM HomeTimeline", statements[3][0])
+        self.assertEqual(statements[3][1], ['blocker_id', 'blockee_id'])
+        self.assertEqual(statements[4][1], ['blockee_id', 'blocker_id'])
+        # and both users' cached timeline pages and block sets invalidated
+        self.assertIn("timeline_version", statements[5][0])
+        self.assertIn("block_version", statements[5][0])
+        self.assertEqual(statements[5][1], ['blocker_id', 'blockee_id'])
+        mock_datatier.perform_action.assert_not_called()
 
-    @patch('lambda_functions.block_user.boto3')
+    @patch('lambda_functions.block_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.block_user.datatier')
-    def test_already_blocked(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_already_blocked(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls to show an existing block
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('blocker_id',)],
-            [('blockee_id',)],
-            [('blocker_id', 'blockee_id')]  # Block already exists
+        mock_retrieve_one_row.side_effect = [
+            ('blocker_id',),
+            ('blockee_id',),
+            (1,)  # Block already exists
         ]
 
         event = {
@@ -77,6 +77,7 @@ class TestBlockUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 400)
         self.assertEqual(json.loads(response['body'])['message'], 'User is already blocked.')
         mock_datatier.perform_action.assert_not_called()
+        mock_datatier.execute_batch.assert_not_called()
 
     def test_block_self(self):
         # This test doesn't need extensive mocks as it should fail before most DB interaction
@@ -87,13 +88,17 @@ class TestBlockUser(unittest.TestCase):
             })
         }
         # We still need to mock the DB lookups that determine the user IDs are the same
-        with patch('lambda_functions.block_user.boto3'), patch('lambda_functions.block_user.datatier') as mock_datatier:
-            mock_datatier.retrieve_all_rows.side_effect = [
-                [('user1',)], # Blocker exists
-                [('user1',)]  # Blockee exists and has the same ID
+        with patch('lambda_functions.block_user.datatier') as mock_datatier, \
+             patch('lambda_functions.block_user.datatier_async.retrieve_one_row',
+                   new_callable=AsyncMock) as mock_retrieve_one_row:
+            mock_retrieve_one_row.side_effect = [
+                ('user1',),  # Blocker exists
+                ('user1',),  # Blockee exists and has the same ID
+                None         # Not already blocked
             ]
             response = lambda_handler(event, None)
             self.assertEqual(response['statusCode'], 400)
+            mock_datatier.execute_batch.assert_not_called()
 
     def test_missing_parameters(self):
         event_no_blocker = {'body': json.dumps({'blockee_username': 'user2'})}
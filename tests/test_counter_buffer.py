@@ -0,0 +1,137 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from lambda_functions import counter_buffer
+from lambda_functions.counter_buffer import delta_statement, flush, flush_all, flush_if_due, reconcile, upsert_statement
+
+
+class TestCounterBuffer(unittest.TestCase):
+
+    def test_delta_statement_follows_the_change(self):
+        sql, params = delta_statement(20001, "retweet_count", -1)
+        self.assertIn("INSERT INTO CounterDeltas (postid, retweet_delta)", sql)
+        self.assertIn("WHERE ROW_COUNT() > 0", sql)
+        self.assertEqual(params, [20001, -1])
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_deltas_coalesce_into_one_upsert(self, mock_datatier):
+        """A burst of likes on one post becomes one row of one statement."""
+        conn = MagicMock()
+        queued = [(i, 20001, 1, 0) for i in range(1, 1001)]
+        queued += [(1001, 20001, 0, 2), (1002, 20002, -1, 0), (1003, 20003, 1, 0), (1004, 20003, -1, 0)]
+        mock_datatier.retrieve_all_rows.return_value = queued
+
+        self.assertEqual(flush(conn), 1004)
+
+        mock_datatier.transaction.assert_called_once_with(conn)
+        claim_sql, claim_params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("FOR UPDATE SKIP LOCKED", claim_sql)
+        self.assertEqual(claim_params, [counter_buffer.COUNTER_FLUSH_MAX_ROWS])
+
+        upsert, delete = [c[0] for c in mock_datatier.perform_action.call_args_list]
+        self.assertIn("ON DUPLICATE KEY UPDATE", upsert[1])
+        # 20003's deltas cancel out and are only deleted
+        self.assertEqual(upsert[2], [20001, 1000, 2, 0, 20002, -1, 0, 0])
+        self.assertIn("DELETE FROM CounterDeltas WHERE id IN", delete[1])
+        self.assertEqual(delete[2], list(range(1, 1005)))
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_empty_queue(self, mock_datatier):
+        mock_datatier.retrieve_all_rows.return_value = []
+        self.assertEqual(flush(MagicMock()), 0)
+        mock_datatier.perform_action.assert_not_called()
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_flush_all_drains_the_queue(self, mock_datatier):
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [(1, 5, 1, 0), (2, 5, 1, 0)],
+            [(3, 5, 1, 0)],
+        ]
+        with patch.object(counter_buffer, 'COUNTER_FLUSH_MAX_ROWS', 2):
+            self.assertEqual(flush_all(MagicMock()), 3)
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 2)
+
+    def test_upsert_adds_to_shard_zero_of_existing_posts(self):
+        sql, params = upsert_statement([(5, [1, 0, 0]), (7, [-1, 0, 0])])
+        self.assertIn("SELECT d.postid, 0, d.l, d.r, d.c", sql)
+        self.assertIn("like_count = PostCounters.like_count + d.l", sql)
+        self.assertIn("JOIN PostInfo p ON p.postid = d.postid", sql)
+        self.assertEqual(sql.count("SELECT %s"), 2)
+        self.assertEqual(params, [5, 1, 0, 0, 7, -1, 0, 0])
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_flush_if_due(self, mock_datatier):
+        mock_datatier.retrieve_all_rows.return_value = [(1, 5, 1, 0)]
+        with patch.object(counter_buffer, '_last_flush', None), \
+             patch.object(counter_buffer, 'COUNTER_FLUSH_INTERVAL', 1.0):
+            with patch('lambda_functions.counter_buffer.time.monotonic', return_value=100.0):
+                self.assertEqual(flush_if_due(MagicMock()), 1)     # first in the container
+                self.assertEqual(flush_if_due(MagicMock()), 0)     # within the interval
+            with patch('lambda_functions.counter_buffer.time.monotonic', return_value=101.0):
+                self.assertEqual(flush_if_due(MagicMock()), 1)
+        self.assertEqual(mock_datatier.transaction.call_count, 2)
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_flush_if_due_swallows_errors(self, mock_datatier):
+        """The like is already committed; its delta stays queued."""
+        mock_datatier.transaction.return_value.__exit__.return_value = False
+        mock_datatier.retrieve_all_rows.side_effect = Exception("lock wait timeout")
+        with patch.object(counter_buffer, '_last_flush', None):
+            self.assertEqual(flush_if_due(MagicMock()), 0)
+
+
+class TestReconcile(unittest.TestCase):
+
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_recomputes_from_source_tables(self, mock_datatier):
+        mock_datatier.execute_batch.return_value = [3, 2, 4]
+        self.assertEqual(reconcile(MagicMock(), postids=[1, 2]), 9)
+
+        # the other shards and queued deltas are dropped and shard 0
+        # rewritten, in one batch
+        (drop_sql, drop_params), (sql, params), (deltas_sql, deltas_params) = \
+            mock_datatier.execute_batch.call_args[0][1]
+        self.assertIn("DELETE c FROM PostCounters c", drop_sql)
+        self.assertIn("c.shard > 0", drop_sql)
+        self.assertIn("REPLACE INTO PostCounters", sql)
+        for table in ("FROM Likes", "FROM Retweets", "FROM PostInfo c"):
+            self.assertIn(table, sql)
+        self.assertIn("DELETE d FROM CounterDeltas d", deltas_sql)
+        self.assertEqual(params, [1, 2])
+        self.assertEqual(drop_params, [1, 2])
+        self.assertEqual(deltas_params, [1, 2])
+
+    @patch('lambda_functions.counter_buffer.RECONCILE_BATCH_SIZE', 2)
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_postids_in_batches(self, mock_datatier):
+        """Each batch of posts is recomputed in a transaction of its own."""
+        mock_datatier.execute_batch.return_value = [0, 1, 0]
+        self.assertEqual(reconcile(MagicMock(), postids=[5, 1, 3, 1]), 2)
+
+        batches = [c[0][1][1][1] for c in mock_datatier.execute_batch.call_args_list]
+        self.assertEqual(batches, [[1, 3], [5]])
+
+    @patch('lambda_functions.counter_buffer.RECONCILE_BATCH_SIZE', 2)
+    @patch('lambda_functions.counter_buffer.datatier')
+    def test_window_walked_by_keyset(self, mock_datatier):
+        """The last hours are read a batch of postids at a time, after the last one done."""
+        mock_datatier.retrieve_all_rows.side_effect = [[(10,), (11,)], [(14,), (15,)], []]
+        mock_datatier.execute_batch.return_value = [0, 2, 1]
+        self.assertEqual(reconcile(MagicMock(), hours=6), 6)
+
+        sql, params = mock_datatier.retrieve_all_rows.call_args_list[0][0][1:]
+        self.assertIn("INTERVAL %s HOUR", sql)
+        self.assertIn("ORDER BY p.postid", sql)
+        self.assertEqual([c[0][2] for c in mock_datatier.retrieve_all_rows.call_args_list],
+                         [[6, 0, 2], [6, 11, 2], [6, 15, 2]])
+
+        # the recompute only ever names the batch's posts
+        batches = [c[0][1][1][1] for c in mock_datatier.execute_batch.call_args_list]
+        self.assertEqual(batches, [[10, 11], [14, 15]])
+        for statements in (c[0][1] for c in mock_datatier.execute_batch.call_args_list):
+            for sql, params in statements:
+                self.assertNotIn("INTERVAL", sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import patch
+
+from lambda_functions.counter_shards import ShardPicker
+
+
+class TestShardPicker(unittest.TestCase):
+
+    def test_shard_count_doubles_with_rate(self):
+        picker = ShardPicker(threshold=5, max_shards=16)
+        self.assertEqual(picker.shards_for(0), 1)
+        self.assertEqual(picker.shards_for(4.9), 1)
+        self.assertEqual(picker.shards_for(5), 2)
+        self.assertEqual(picker.shards_for(10), 4)
+        self.assertEqual(picker.shards_for(20), 8)
+        self.assertEqual(picker.shards_for(1000), 16)
+
+    def test_cold_post_uses_shard_zero(self):
+        picker = ShardPicker(threshold=5, max_shards=16)
+        with patch('lambda_functions.counter_shards.time.monotonic', side_effect=[0.0, 60.0, 120.0]):
+            self.assertEqual([picker.pick(1) for _ in range(3)], [0, 0, 0])
+
+    def test_hot_post_spreads_then_cools_down(self):
+        picker = ShardPicker(threshold=5, max_shards=16, tau=5.0)
+
+        # 100 writes/second for two seconds
+        times = [i / 100.0 for i in range(200)]
+        with patch('lambda_functions.counter_shards.time.monotonic', side_effect=times):
+            shards = {picker.pick(7) for _ in times}
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(0 <= s < 16 for s in shards))
+
+        # a minute later the rate has decayed
+        with patch('lambda_functions.counter_shards.time.monotonic', return_value=62.0):
+            rate = picker.record(7)
+        self.assertEqual(picker.shards_for(rate), 1)
+
+        # other posts are unaffected
+        with patch('lambda_functions.counter_shards.time.monotonic', return_value=62.0):
+            self.assertEqual(picker.pick(8), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+from lambda_functions.counts_cache import CountsCache
+
+
+class TestCountsCache(unittest.TestCase):
+
+    def test_only_misses_are_read(self):
+        cache = CountsCache(size=10, ttl=60)
+        cache.store([101, 102], [(101, 15, 7, 0)], 0.01)
+
+        rows, missing = cache.lookup([101, 102, 103])
+        # 102 has no counters: cached as zeros
+        self.assertEqual(sorted(rows), [(101, 15, 7, 0), (102, 0, 0, 0)])
+        self.assertEqual(missing, [103])
+
+    def test_postids_sent_as_strings_are_not_cached_as_zeros(self):
+        cache = CountsCache(size=10, ttl=60)
+        cache.store(["101"], [(101, 15, 0, 0)], 0.01)
+
+        self.assertEqual(cache.lookup(["101"]), ([], ["101"]))
+        self.assertEqual(cache.lookup([101]), ([(101, 15, 0, 0)], []))
+
+    def test_expires_after_ttl(self):
+        cache = CountsCache(size=10, ttl=5, beta=0)
+        with patch('lambda_functions.counts_cache.time.monotonic', return_value=100.0):
+            cache.store([101], [(101, 1, 0, 0)], 0.01)
+        with patch('lambda_functions.counts_cache.time.monotonic', return_value=104.0):
+            self.assertEqual(cache.lookup([101]), ([(101, 1, 0, 0)], []))
+        with patch('lambda_functions.counts_cache.time.monotonic', return_value=105.5):
+            self.assertEqual(cache.lookup([101]), ([], [101]))
+        self.assertEqual(len(cache), 0)
+
+    def test_refreshes_early_more_often_near_expiry(self):
+        cache = CountsCache(size=10, ttl=5)
+        with patch('lambda_functions.counts_cache.time.monotonic', return_value=100.0):
+            cache.store([101], [(101, 1, 0, 0)], 0.01)   # refresh gap 0.25s
+
+        # -log(1 - 0.5) * 0.25 ~ 0.17s early
+        with patch('lambda_functions.counts_cache.random.random', return_value=0.5):
+            with patch('lambda_functions.counts_cache.time.monotonic', return_value=102.0):
+                self.assertEqual(cache.lookup([101])[1], [])
+            with patch('lambda_functions.counts_cache.time.monotonic', return_value=104.9):
+                self.assertEqual(cache.lookup([101])[1], [101])
+
+        # an early refresh keeps the entry until the new read is stored
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = CountsCache(size=2, ttl=60)
+        cache.store([1, 2], [], 0.01)
+        cache.lookup([1])
+        cache.store([3], [], 0.01)
+        self.assertEqual(cache.lookup([1, 2, 3])[1], [2])
+
+    def test_size_zero_disables(self):
+        cache = CountsCache(size=0, ttl=60)
+        cache.store([101], [(101, 1, 0, 0)], 0.01)
+        self.assertEqual(cache.lookup([101]), ([], [101]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,18 +5,11 @@ from lambda_functions.create_user import lambda_handler
 
 class TestCreateUser(unittest.TestCase):
 
-    @patch('lambda_functions.create_user.boto3')
     @patch('lambda_functions.create_user.datatier')
-    def test_create_new_user_success(self, mock_datatier, mock_boto3):
+    def test_create_new_user_success(self, mock_datatier):
         """Tests successfully creating a new user."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         
         # Simulate that the user does not exist, then simulate a successful insert
         mock_datatier.retrieve_one_row.return_value = None
@@ -39,18 +32,11 @@ class TestCreateUser(unittest.TestCase):
         self.assertEqual(body['bio'], "This user hasn't written a bio yet.")
         mock_datatier.perform_action.assert_called_once()
 
-    @patch('lambda_functions.create_user.boto3')
     @patch('lambda_functions.create_user.datatier')
-    def test_get_existing_user_success(self, mock_datatier, mock_boto3):
+    def test_get_existing_user_success(self, mock_datatier):
         """Tests successfully retrieving an existing user's info."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Simulate that the user already exists
         existing_user_data = ('ExistingUser', 'existing_pic.jpg', 'A cool bio.')
@@ -0,0 +1,679 @@
+import unittest
+import json
+import pymysql
+from unittest.mock import patch, MagicMock, PropertyMock
+from lambda_functions import datatier
+
+
+def make_conn():
+    conn = MagicMock()
+    conn.open = True
+    return conn
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        datatier.close_pools()
+
+    def tearDown(self):
+        datatier.close_pools()
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_reuses_returned_connection(self, mock_get_dbConn):
+        """A returned connection is handed out again instead of reconnecting."""
+        conn = make_conn()
+        mock_get_dbConn.return_value = conn
+
+        first = datatier.checkout_dbConn('h', 1, 'u', 'p', 'db')
+        datatier.return_dbConn(first)
+        second = datatier.checkout_dbConn('h', 1, 'u', 'p', 'db')
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_get_dbConn.call_count, 1)
+        conn.ping.assert_called_once_with(reconnect=False)
+        conn.rollback.assert_called_once()
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_dead_connection_is_replaced(self, mock_get_dbConn):
+        """A connection that fails its liveness ping is closed and replaced."""
+        dead, fresh = make_conn(), make_conn()
+        dead.ping.side_effect = Exception("gone away")
+        mock_get_dbConn.side_effect = [dead, fresh]
+
+        datatier.return_dbConn(datatier.checkout_dbConn('h', 1, 'u', 'p', 'db'))
+        conn = datatier.checkout_dbConn('h', 1, 'u', 'p', 'db')
+
+        self.assertIs(conn, fresh)
+        dead.close.assert_called_once()
+
+    @patch('lambda_functions.datatier.time')
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_idle_connection_is_evicted(self, mock_get_dbConn, mock_time):
+        """Connections idle longer than idle_timeout are closed, not reused."""
+        old, fresh = make_conn(), make_conn()
+        mock_get_dbConn.side_effect = [old, fresh]
+        mock_time.monotonic.return_value = 0
+
+        pool = datatier.ConnectionPool('h', 1, 'u', 'p', 'db', max_size=2, idle_timeout=10)
+        pool.checkin(pool.checkout())
+
+        mock_time.monotonic.return_value = 11
+        conn = pool.checkout()
+
+        self.assertIs(conn, fresh)
+        old.close.assert_called_once()
+        old.ping.assert_not_called()
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_max_size(self, mock_get_dbConn):
+        """Checking out more than max_size connections fails fast."""
+        mock_get_dbConn.side_effect = [make_conn(), make_conn()]
+        pool = datatier.ConnectionPool('h', 1, 'u', 'p', 'db', max_size=1)
+
+        pool.checkout()
+        with self.assertRaises(datatier.PoolExhaustedError):
+            pool.checkout()
+        self.assertEqual(pool.size(), 1)
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_failed_connect_frees_slot(self, mock_get_dbConn):
+        """A connect error does not permanently use up a pool slot."""
+        conn = make_conn()
+        mock_get_dbConn.side_effect = [Exception("refused"), conn]
+        pool = datatier.ConnectionPool('h', 1, 'u', 'p', 'db', max_size=1)
+
+        with self.assertRaises(Exception):
+            pool.checkout()
+        self.assertIs(pool.checkout(), conn)
+
+    def test_unpooled_connection_is_closed(self):
+        """return_dbConn closes connections that no pool handed out."""
+        conn = make_conn()
+        datatier.return_dbConn(conn)
+        conn.close.assert_called_once()
+
+
+class StubSecretsClient:
+    """Local stand-in for the Secrets Manager client."""
+
+    def __init__(self, *passwords):
+        self.passwords = list(passwords)
+        self.calls = 0
+
+    def get_secret_value(self, SecretId):
+        password = self.passwords[min(self.calls, len(self.passwords) - 1)]
+        self.calls += 1
+        return {'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': password})}
+
+
+class TestSecretCache(unittest.TestCase):
+
+    def tearDown(self):
+        datatier.set_secrets_client(None)
+        datatier.close_pools()
+
+    def test_secret_is_cached(self):
+        """Repeated lookups within the TTL do not call Secrets Manager again."""
+        client = StubSecretsClient('p')
+        datatier.set_secrets_client(client)
+
+        first = datatier.get_db_secret('s')
+        second = datatier.get_db_secret('s')
+
+        self.assertEqual(first, second)
+        self.assertEqual(client.calls, 1)
+
+    @patch('lambda_functions.datatier.time')
+    def test_secret_expires_after_ttl(self, mock_time):
+        """An expired cache entry is fetched again."""
+        client = StubSecretsClient('old', 'new')
+        datatier.set_secrets_client(client)
+
+        mock_time.monotonic.return_value = 0
+        datatier.get_db_secret('s', ttl=60)
+        mock_time.monotonic.return_value = 61
+        secret = datatier.get_db_secret('s', ttl=60)
+
+        self.assertEqual(secret['password'], 'new')
+        self.assertEqual(client.calls, 2)
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_access_denied_refreshes_secret(self, mock_get_dbConn):
+        """A rotated password triggers one forced refresh and a retry."""
+        client = StubSecretsClient('old', 'new')
+        datatier.set_secrets_client(client)
+        conn = make_conn()
+        mock_get_dbConn.side_effect = [
+            pymysql.err.OperationalError(1045, "Access denied"),
+            conn
+        ]
+
+        self.assertIs(datatier.checkout_dbConn_from_secret('s', 'db'), conn)
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(mock_get_dbConn.call_args[0][3], 'new')
+
+    @patch('lambda_functions.datatier.get_dbConn')
+    def test_other_errors_do_not_refresh(self, mock_get_dbConn):
+        """Connection errors other than access denied are raised as-is."""
+        client = StubSecretsClient('p')
+        datatier.set_secrets_client(client)
+        mock_get_dbConn.side_effect = pymysql.err.OperationalError(2003, "Can't connect")
+
+        with self.assertRaises(pymysql.err.OperationalError):
+            datatier.checkout_dbConn_from_secret('s', 'db')
+        self.assertEqual(client.calls, 1)
+
+
+class TestTransactions(unittest.TestCase):
+
+    def test_transaction_commits_once(self):
+        """perform_action inside transaction() defers the commit to the block exit."""
+        conn = make_conn()
+
+        with datatier.transaction(conn):
+            datatier.perform_action(conn, "DELETE FROM Likes WHERE liker = %s;", ['u'])
+            datatier.perform_action(conn, "DELETE FROM Retweets WHERE retweetuserid = %s;", ['u'])
+            conn.commit.assert_not_called()
+
+        conn.commit.assert_called_once()
+        conn.rollback.assert_not_called()
+
+    def test_transaction_rolls_back_on_error(self):
+        """An exception inside the block rolls back and propagates."""
+        conn = make_conn()
+        conn.cursor.return_value.execute.side_effect = [None, Exception("duplicate key")]
+
+        with self.assertRaises(Exception):
+            with datatier.transaction(conn):
+                datatier.perform_action(conn, "INSERT INTO Likes VALUES (%s, %s);", ['u', 1])
+                datatier.perform_action(conn, "INSERT INTO Likes VALUES (%s, %s);", ['u', 1])
+
+        conn.commit.assert_not_called()
+        conn.rollback.assert_called_once()
+
+    def test_nested_transaction_joins_outer(self):
+        """Only the outermost transaction() commits."""
+        conn = make_conn()
+
+        with datatier.transaction(conn):
+            with datatier.transaction(conn):
+                datatier.perform_action(conn, "DELETE FROM Likes;")
+            conn.commit.assert_not_called()
+
+        conn.commit.assert_called_once()
+
+    def test_execute_batch_single_round_trip(self):
+        """With multi-statement support the batch is sent as one query."""
+        conn = make_conn()
+        conn.client_flag = datatier.CLIENT.MULTI_STATEMENTS
+        cursor = conn.cursor.return_value
+        cursor.mogrify.side_effect = lambda sql, params: sql % tuple(repr(p) for p in params)
+        cursor.nextset.side_effect = [True, True, None]
+        type(cursor).rowcount = PropertyMock(side_effect=[1, 0, 1])
+
+        counts = datatier.execute_batch(conn, [
+            ("INSERT INTO Blocked (blocker, blockee) VALUES (%s, %s);", ['a', 'b']),
+            ("DELETE FROM Followers WHERE follower = %s AND followee = %s;", ['b', 'a']),
+            ("DELETE FROM Followers WHERE follower = %s AND followee = %s;", ['a', 'b']),
+        ])
+
+        self.assertEqual(counts, [1, 0, 1])
+        cursor.execute.assert_called_once()
+        sent = cursor.execute.call_args[0][0]
+        self.assertEqual(sent.count(';'), 2)
+        conn.commit.assert_called_once()
+
+    @patch('lambda_functions.datatier.pymysql.connect')
+    def test_multi_statements_only_when_asked(self, mock_connect):
+        """Only connections opened for execute_batch accept stacked statements."""
+        with patch.object(datatier, '_driver', datatier.PyMySQLDriver()):
+            datatier.get_dbConn('h', 3306, 'u', 'p', 'db')
+            self.assertEqual(mock_connect.call_args[1]['client_flag'], 0)
+
+            datatier.get_dbConn('h', 3306, 'u', 'p', 'db', multi_statements=True)
+            self.assertEqual(mock_connect.call_args[1]['client_flag'], datatier.CLIENT.MULTI_STATEMENTS)
+
+        self.assertIsNot(datatier.get_pool('h', 3306, 'u', 'p', 'db'),
+                         datatier.get_pool('h', 3306, 'u', 'p', 'db', multi_statements=True))
+        datatier.close_pools()
+
+    def test_execute_batch_without_multi_statements(self):
+        """Without multi-statement support statements run one by one, still one commit."""
+        conn = make_conn()
+        conn.client_flag = 0
+        cursor = conn.cursor.return_value
+
+        datatier.execute_batch(conn, [
+            ("DELETE FROM Likes WHERE liker = %s;", ['a']),
+            ("DELETE FROM Retweets WHERE retweetuserid = %s;", ['a']),
+        ])
+
+        self.assertEqual(cursor.execute.call_count, 2)
+        conn.commit.assert_called_once()
+
+
+class TestIterRows(unittest.TestCase):
+
+    def test_yields_batches(self):
+        """Rows come back in fetchmany-sized batches from an unbuffered cursor."""
+        conn = make_conn()
+        cursor = conn.cursor.return_value
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+
+        batches = list(datatier.iter_rows(conn, "SELECT postid FROM PostInfo;", [], chunk_size=2))
+
+        self.assertEqual(batches, [[(1,), (2,)], [(3,)]])
+        conn.cursor.assert_called_once_with(datatier.pymysql.cursors.SSCursor)
+        cursor.fetchmany.assert_called_with(2)
+        cursor.close.assert_called_once()
+
+    def test_closes_cursor_when_abandoned(self):
+        """Stopping early still closes (and drains) the cursor."""
+        conn = make_conn()
+        cursor = conn.cursor.return_value
+        cursor.fetchmany.side_effect = [[(1,)], [(2,)], []]
+
+        rows = datatier.iter_rows(conn, "SELECT postid FROM PostInfo;")
+        next(rows)
+        rows.close()
+
+        cursor.close.assert_called_once()
+
+
+class ReplicaSecretsClient:
+    """Stub secret listing one primary and two read replicas."""
+
+    def get_secret_value(self, SecretId):
+        return {'SecretString': json.dumps({
+            'host': 'primary', 'port': 3306, 'username': 'u', 'password': 'p',
+            'read_replicas': ['replica1', 'replica2:3307']
+        })}
+
+
+class TestReadReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        datatier.set_secrets_client(ReplicaSecretsClient())
+        datatier._replica_down_until.clear()
+        datatier._replica_next = 0
+        self.conns = {}
+
+        def checkout(host, port, username, pwd, dbname, multi_statements=False):
+            conn = make_conn()
+            conn.host = host
+            self.conns.setdefault(host, []).append(conn)
+            return conn
+
+        patcher = patch('lambda_functions.datatier._checkout_pooled', side_effect=checkout)
+        self.mock_checkout = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        datatier.set_secrets_client(None)
+        datatier._replica_down_until.clear()
+
+    def test_parses_replica_endpoints(self):
+        secret = json.loads(ReplicaSecretsClient().get_secret_value('s')['SecretString'])
+        self.assertEqual(datatier.replica_endpoints(secret), [('replica1', 3306), ('replica2', 3307)])
+        self.assertEqual(datatier.replica_endpoints({'host': 'h', 'port': 1}), [])
+
+    def test_reads_go_to_replica_writes_to_primary(self):
+        """SELECTs use a replica; action queries use the primary."""
+        conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+
+        datatier.retrieve_one_row(conn, "SELECT 1;")
+        self.assertEqual(list(self.conns), ['replica1'])
+
+        datatier.perform_action(conn, "DELETE FROM Likes;")
+        self.assertIn('primary', self.conns)
+        self.conns['primary'][0].commit.assert_called_once()
+
+        # read-your-writes: later reads stick to the primary
+        datatier.retrieve_all_rows(conn, "SELECT 1;")
+        self.assertEqual(self.conns['primary'][0].cursor.call_count, 2)
+
+        datatier.return_dbConn(conn)
+
+    def test_round_robin(self):
+        """Consecutive invocations alternate between replicas."""
+        hosts = []
+        for _ in range(3):
+            conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+            hosts.append(conn.reader().host)
+        self.assertEqual(hosts, ['replica1', 'replica2', 'replica1'])
+
+    def test_unreachable_replica_is_skipped(self):
+        """A replica that fails to connect is marked down and the next one used."""
+        def checkout(host, port, username, pwd, dbname, multi_statements=False):
+            if host == 'replica1':
+                raise pymysql.err.OperationalError(2003, "Can't connect")
+            return make_conn()
+        self.mock_checkout.side_effect = checkout
+
+        conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+        conn.reader()
+
+        self.assertFalse(datatier.replica_is_healthy('replica1', 3306))
+        self.assertEqual(self.mock_checkout.call_args[0][0], 'replica2')
+
+    def test_all_replicas_down_falls_back_to_primary(self):
+        datatier.mark_replica_down('replica1', 3306)
+        datatier.mark_replica_down('replica2', 3307)
+
+        conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+        datatier.retrieve_one_row(conn, "SELECT 1;")
+
+        self.assertEqual(list(self.conns), ['primary'])
+
+    def test_force_primary(self):
+        conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+        conn.force_primary = True
+        datatier.retrieve_one_row(conn, "SELECT 1;")
+        self.assertEqual(list(self.conns), ['primary'])
+
+    def test_without_use_replicas_uses_primary(self):
+        conn = datatier.checkout_dbConn_from_secret('s', 'db')
+        self.assertEqual(conn.host, 'primary')
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        datatier.end_invocation('test')
+
+    def test_fingerprint(self):
+        """Literals, placeholders and value lists are normalized away."""
+        self.assertEqual(
+            datatier.fingerprint("SELECT *\n  FROM Likes WHERE liker = %s AND originalpost IN (%s, %s, %s);"),
+            "SELECT * FROM Likes WHERE liker = ? AND originalpost IN (?+)"
+        )
+        self.assertEqual(
+            datatier.fingerprint("SELECT 1 FROM UserInfo WHERE username = 'it''s' AND t1 = 42"),
+            "SELECT ? FROM UserInfo WHERE username = ? AND t1 = ?"
+        )
+
+    def test_hooks_receive_every_statement(self):
+        records = []
+        datatier.add_query_hook(records.append)
+        self.addCleanup(datatier.remove_query_hook, records.append)
+
+        conn = make_conn()
+        conn.cursor.return_value.fetchall.return_value = [(1,), (2,)]
+        conn.cursor.return_value.rowcount = 3
+
+        datatier.retrieve_all_rows(conn, "SELECT postid FROM PostInfo WHERE userid = %s;", ['u'])
+        datatier.perform_action(conn, "DELETE FROM Likes WHERE liker = %s;", ['u'])
+
+        self.assertEqual([r['fingerprint'] for r in records], [
+            "SELECT postid FROM PostInfo WHERE userid = ?",
+            "DELETE FROM Likes WHERE liker = ?"
+        ])
+        self.assertEqual([r['rows'] for r in records], [2, 3])
+        self.assertTrue(all(r['seconds'] >= 0 for r in records))
+
+    def test_failing_hook_does_not_break_query(self):
+        def bad_hook(record):
+            raise ValueError("boom")
+        datatier.add_query_hook(bad_hook)
+        self.addCleanup(datatier.remove_query_hook, bad_hook)
+
+        conn = make_conn()
+        conn.cursor.return_value.fetchone.return_value = (1,)
+        self.assertEqual(datatier.retrieve_one_row(conn, "SELECT 1;"), (1,))
+
+    def test_instrumented_handler_prints_one_summary(self):
+        """The decorator aggregates per fingerprint and prints a single JSON record."""
+        conn = make_conn()
+        conn.cursor.return_value.fetchone.return_value = (1,)
+
+        @datatier.instrument_handler
+        def handler(event, context):
+            datatier.retrieve_one_row(conn, "SELECT 1 FROM Likes WHERE liker = %s;", ['a'])
+            datatier.retrieve_one_row(conn, "SELECT 1 FROM Likes WHERE liker = %s;", ['b'])
+            datatier._record_acquire(0.002)
+            return "ok"
+
+        with patch('builtins.print') as mock_print:
+            self.assertEqual(handler({}, None), "ok")
+
+        self.assertEqual(mock_print.call_count, 1)
+        summary = json.loads(mock_print.call_args[0][0])['datatier_summary']
+        self.assertEqual(summary['queries'], 2)
+        self.assertEqual(summary['acquires'], 1)
+        self.assertEqual(summary['acquire_ms'], 2.0)
+        self.assertEqual(len(summary['top']), 1)
+        self.assertEqual(summary['top'][0]['sql'], "SELECT ? FROM Likes WHERE liker = ?")
+        self.assertEqual(summary['top'][0]['calls'], 2)
+        self.assertEqual(summary['top'][0]['rows'], 2)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        datatier._breakers.clear()
+
+    def tearDown(self):
+        datatier._breakers.clear()
+
+    @patch('lambda_functions.datatier.pymysql.connect')
+    def test_opens_after_threshold_and_fails_fast(self, mock_connect):
+        """After repeated connect failures, connects fail without touching the network."""
+        mock_connect.side_effect = pymysql.err.OperationalError(1040, "Too many connections")
+
+        for _ in range(datatier.BREAKER_THRESHOLD):
+            with self.assertRaises(pymysql.err.OperationalError):
+                datatier.get_dbConn('h', 1, 'u', 'p', 'db')
+
+        with self.assertRaises(datatier.CircuitOpenError) as ctx:
+            datatier.get_dbConn('h', 1, 'u', 'p', 'db')
+
+        self.assertEqual(mock_connect.call_count, datatier.BREAKER_THRESHOLD)
+        self.assertGreater(ctx.exception.retry_after, 0)
+        # other servers are unaffected
+        self.assertFalse(datatier.get_breaker('other', 1).is_open())
+
+    @patch('lambda_functions.datatier.time')
+    def test_half_open_probe(self, mock_time):
+        """After the backoff one probe is let through; failure re-opens with a longer delay."""
+        mock_time.monotonic.return_value = 0
+        breaker = datatier.CircuitBreaker('h:1', threshold=1, base_delay=1, max_delay=30)
+
+        breaker.record_failure()
+        with self.assertRaises(datatier.CircuitOpenError):
+            breaker.before_connect()
+
+        mock_time.monotonic.return_value = 10
+        breaker.before_connect()  # probe allowed
+        with self.assertRaises(datatier.CircuitOpenError):
+            breaker.before_connect()  # only one probe at a time
+
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        # second opening uses the doubled delay: between 1 and 2 seconds
+        mock_time.monotonic.return_value = 10.99
+        self.assertTrue(breaker.is_open())
+        mock_time.monotonic.return_value = 12.01
+        self.assertFalse(breaker.is_open())
+
+        breaker.before_connect()
+        breaker.record_success()
+        breaker.before_connect()
+        breaker.before_connect()  # closed again: no probe limit
+
+    def test_jittered_backoff_bounds(self):
+        for attempt in range(8):
+            delay = min(30, 1 * 2 ** attempt)
+            for _ in range(20):
+                value = datatier._jittered_backoff(attempt, 1, 30)
+                self.assertGreaterEqual(value, delay / 2)
+                self.assertLessEqual(value, delay)
+
+    def test_open_circuit_turns_error_into_503(self):
+        """A handler that failed because the breaker was open answers 503 + Retry-After."""
+        datatier.get_breaker('h', 1)._open_until = datatier.time.monotonic() + 5
+
+        @datatier.instrument_handler
+        def handler(event, context):
+            try:
+                datatier.checkout_dbConn('h', 1, 'u', 'p', 'db')
+            except Exception as e:
+                return {"statusCode": 400, "headers": {"A": "b"}, "body": str(e)}
+
+        with patch('builtins.print'):
+            response = handler({}, None)
+
+        self.assertEqual(response['statusCode'], 503)
+        self.assertEqual(response['headers']['A'], 'b')
+        self.assertIn(response['headers']['Retry-After'], ('5', '6'))
+
+    @patch('lambda_functions.datatier.pymysql.connect')
+    def test_replica_breaker_with_primary_fallback_keeps_response(self, mock_connect):
+        """Open replica breakers the read falls back from leave a 4xx alone."""
+        mock_connect.return_value = make_conn()
+        datatier.set_secrets_client(ReplicaSecretsClient())
+        datatier._replica_down_until.clear()
+        self.addCleanup(datatier.set_secrets_client, None)
+        self.addCleanup(datatier.close_pools)
+        for host, port in (('replica1', 3306), ('replica2', 3307)):
+            datatier.get_breaker(host, port)._open_until = datatier.time.monotonic() + 5
+
+        @datatier.instrument_handler
+        def handler(event, context):
+            conn = datatier.checkout_dbConn_from_secret('s', 'db', use_replicas=True)
+            try:
+                datatier.retrieve_one_row(conn, "SELECT 1;")
+                return {"statusCode": 404, "body": "User not found."}
+            finally:
+                datatier.return_dbConn(conn)
+
+        with patch('builtins.print'):
+            response = handler({}, None)
+
+        self.assertEqual(response['statusCode'], 404)
+        self.assertEqual(mock_connect.call_args[1]['host'], 'primary')
+
+
+@patch('lambda_functions.datatier.time.sleep')
+class TestLockRetry(unittest.TestCase):
+
+    def test_deadlock_is_retried(self, mock_sleep):
+        conn = make_conn()
+        cursor = conn.cursor.return_value
+        cursor.execute.side_effect = [pymysql.err.OperationalError(1213, "Deadlock found"), None]
+        cursor.rowcount = 1
+
+        self.assertEqual(datatier.perform_action(conn, "UPDATE PostCounters SET likes = likes + 1;"), 1)
+        self.assertEqual(cursor.execute.call_count, 2)
+        conn.rollback.assert_called_once()
+        conn.commit.assert_called_once()
+        mock_sleep.assert_called_once()
+
+    def test_retries_are_bounded(self, mock_sleep):
+        conn = make_conn()
+        conn.cursor.return_value.execute.side_effect = pymysql.err.OperationalError(1205, "Lock wait timeout")
+
+        with self.assertRaises(pymysql.err.OperationalError):
+            datatier.perform_action(conn, "DELETE FROM Likes;")
+        self.assertEqual(conn.cursor.return_value.execute.call_count, datatier.LOCK_RETRY_ATTEMPTS)
+
+    def test_other_errors_are_not_retried(self, mock_sleep):
+        conn = make_conn()
+        conn.cursor.return_value.execute.side_effect = pymysql.err.OperationalError(1054, "Unknown column")
+
+        with self.assertRaises(pymysql.err.OperationalError):
+            datatier.perform_action(conn, "DELETE FROM Likes;")
+        self.assertEqual(conn.cursor.return_value.execute.call_count, 1)
+
+    def test_no_retry_inside_transaction(self, mock_sleep):
+        conn = make_conn()
+        conn.cursor.return_value.execute.side_effect = pymysql.err.OperationalError(1213, "Deadlock found")
+
+        with self.assertRaises(pymysql.err.OperationalError):
+            with datatier.transaction(conn):
+                datatier.perform_action(conn, "DELETE FROM Likes;")
+        self.assertEqual(conn.cursor.return_value.execute.call_count, 1)
+
+    def test_batch_deadlock_is_retried(self, mock_sleep):
+        conn = make_conn()
+        conn.client_flag = 0
+        cursor = conn.cursor.return_value
+        cursor.execute.side_effect = [None, pymysql.err.OperationalError(1213, "Deadlock found"), None, None]
+
+        datatier.execute_batch(conn, [("DELETE FROM Likes;", None), ("DELETE FROM Retweets;", None)])
+        self.assertEqual(cursor.execute.call_count, 4)
+        conn.commit.assert_called_once()
+
+
+class TestDrivers(unittest.TestCase):
+
+    def tearDown(self):
+        datatier.set_driver('pymysql')
+
+    def test_pymysql_driver(self):
+        driver = datatier.set_driver('pymysql')
+        self.assertIs(datatier.get_driver(), driver)
+        self.assertIs(driver.unbuffered_cursor, pymysql.cursors.SSCursor)
+
+    def test_auto_falls_back_to_pymysql(self):
+        with patch('lambda_functions.datatier.MySQLdb', None):
+            self.assertEqual(datatier.set_driver('auto').name, 'pymysql')
+            with self.assertRaises(ValueError):
+                datatier.set_driver('mysqlclient')
+
+    def test_unknown_driver(self):
+        with self.assertRaises(ValueError):
+            datatier.set_driver('sqlite')
+
+    def test_mysqlclient_mogrify(self):
+        """Client-side binding for mysqlclient escapes through the connection."""
+        driver = datatier.MySQLClientDriver.__new__(datatier.MySQLClientDriver)
+        cursor = MagicMock()
+        cursor.connection.encoding = 'utf8'
+        cursor.connection.literal.side_effect = lambda value: ("'%s'" % value).encode('utf8')
+
+        sql = driver.mogrify(cursor, "DELETE FROM Likes WHERE liker = %s AND originalpost = %s", ['a', 1])
+
+        self.assertEqual(sql, "DELETE FROM Likes WHERE liker = 'a' AND originalpost = '1'")
+        self.assertEqual(driver.mogrify(cursor, "SELECT 1", None), "SELECT 1")
+
+
+
+class TestConditionalResponses(unittest.TestCase):
+
+    def setUp(self):
+        self.response = {"statusCode": 200, "headers": {"Access-Control-Allow-Origin": "*"}, "body": '[{"a": 1}]'}
+
+    def test_etag_added_to_ok_responses(self):
+        response = datatier.conditional_response({}, self.response)
+        self.assertEqual(response["statusCode"], 200)
+        self.assertEqual(response["body"], self.response["body"])
+        self.assertEqual(response["headers"]["ETag"], datatier.compute_etag('[{"a": 1}]'))
+        self.assertEqual(response["headers"]["Access-Control-Expose-Headers"], "ETag")
+        self.assertNotIn("ETag", self.response["headers"])     # shared header dicts untouched
+
+    def test_matching_if_none_match_gives_304(self):
+        etag = datatier.compute_etag(self.response["body"])
+        for value in (etag, 'W/' + etag, '"other", ' + etag, '*'):
+            event = {"headers": {"if-none-match": value}}
+            response = datatier.conditional_response(event, self.response)
+            self.assertEqual(response["statusCode"], 304, value)
+            self.assertEqual(response["body"], "")
+            self.assertEqual(response["headers"]["ETag"], etag)
+
+    def test_stale_etag_and_errors_pass_through(self):
+        event = {"headers": {"If-None-Match": '"stale"'}}
+        self.assertEqual(datatier.conditional_response(event, self.response)["statusCode"], 200)
+
+        error = {"statusCode": 400, "headers": {}, "body": "{}"}
+        self.assertIs(datatier.conditional_response(event, error), error)
+
+    def test_decorator(self):
+        handler = datatier.etag_handler(lambda event, context: self.response)
+        first = handler({"headers": None}, None)
+        second = handler({"headers": {"If-None-Match": first["headers"]["ETag"]}}, None)
+        self.assertEqual(second["statusCode"], 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
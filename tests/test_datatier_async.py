@@ -0,0 +1,145 @@
+import json
+import unittest
+import time
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import pymysql
+
+from lambda_functions import datatier, datatier_async
+
+
+class TestDatatierAsync(unittest.TestCase):
+
+    def setUp(self):
+        datatier._replica_down_until.clear()
+        datatier._replica_next = 0
+
+    @patch('lambda_functions.datatier_async.aiomysql', None)
+    @patch('lambda_functions.datatier_async.datatier.return_dbConn')
+    @patch('lambda_functions.datatier_async.datatier.checkout_dbConn_from_secret')
+    @patch('lambda_functions.datatier_async.datatier.retrieve_one_row')
+    def test_gather_runs_queries_concurrently(self, mock_retrieve_one_row, mock_checkout, mock_return):
+        """Independent queries overlap: total time is close to the slowest, not the sum."""
+        def slow_query(dbConn, sql, parameters):
+            time.sleep(0.2)
+            return (sql,)
+        mock_retrieve_one_row.side_effect = slow_query
+        mock_checkout.side_effect = lambda *args, **kwargs: MagicMock()
+
+        source = datatier_async.get_source('s', 'db', use_replicas=True)
+        start = time.monotonic()
+        rows = datatier_async.gather(
+            datatier_async.retrieve_one_row(source, 'q1'),
+            datatier_async.retrieve_one_row(source, 'q2'),
+            datatier_async.retrieve_one_row(source, 'q3'),
+        )
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(rows, [('q1',), ('q2',), ('q3',)])
+        self.assertLess(elapsed, 0.5)
+        # each query used (and returned) its own connection
+        self.assertEqual(mock_checkout.call_count, 3)
+        self.assertEqual(mock_return.call_count, 3)
+
+    @patch('lambda_functions.datatier_async.aiomysql', None)
+    @patch('lambda_functions.datatier_async.datatier.return_dbConn')
+    @patch('lambda_functions.datatier_async.datatier.checkout_dbConn_from_secret')
+    @patch('lambda_functions.datatier_async.datatier.perform_action')
+    def test_writes_use_primary(self, mock_perform_action, mock_checkout, mock_return):
+        mock_perform_action.return_value = 1
+        source = datatier_async.get_source('s', 'db', use_replicas=True)
+
+        self.assertEqual(datatier_async.run(datatier_async.perform_action(source, 'DELETE FROM Likes;')), 1)
+        self.assertFalse(mock_checkout.call_args.kwargs['use_replicas'])
+
+    def test_pick_endpoint(self):
+        """Reads rotate over healthy replicas; writes always use the primary."""
+        secret = {'host': 'primary', 'port': 3306, 'read_replicas': ['r1', 'r2']}
+        source = datatier_async.get_source('s', 'db', use_replicas=True)
+
+        self.assertEqual(datatier_async._pick_endpoint(source, secret, write=True), ('primary', 3306))
+        self.assertEqual(datatier_async._pick_endpoint(source, secret, write=False), ('r1', 3306))
+        self.assertEqual(datatier_async._pick_endpoint(source, secret, write=False), ('r2', 3306))
+
+        datatier.mark_replica_down('r1', 3306)
+        datatier.mark_replica_down('r2', 3306)
+        self.assertEqual(datatier_async._pick_endpoint(source, secret, write=False), ('primary', 3306))
+
+
+
+class PrimarySecretsClient:
+    def get_secret_value(self, SecretId):
+        return {'SecretString': json.dumps({
+            'host': 'primary', 'port': 3306, 'username': 'u', 'password': 'p'
+        })}
+
+
+class FakeCursor:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def execute(self, sql, parameters):
+        pass
+
+    async def fetchone(self):
+        return (1,)
+
+
+class TestAiomysqlCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        datatier.set_secrets_client(PrimarySecretsClient())
+        datatier._breakers.clear()
+        datatier_async._pools.clear()
+        self.mock_aiomysql = MagicMock()
+        patcher = patch('lambda_functions.datatier_async.aiomysql', self.mock_aiomysql)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        datatier.set_secrets_client(None)
+        datatier._breakers.clear()
+        datatier_async._pools.clear()
+
+    def query(self):
+        source = datatier_async.get_source('s', 'db')
+        return datatier_async.run(datatier_async.retrieve_one_row(source, 'SELECT 1;'))
+
+    def test_failing_server_opens_the_breaker(self):
+        """Connect failures on the aiomysql path open the breaker; later calls fail fast."""
+        self.mock_aiomysql.create_pool = AsyncMock(
+            side_effect=pymysql.err.OperationalError(2003, "Can't connect"))
+
+        with patch('builtins.print'):
+            for _ in range(datatier.BREAKER_THRESHOLD):
+                with self.assertRaises(pymysql.err.OperationalError):
+                    self.query()
+
+            datatier.begin_invocation()
+            with self.assertRaises(datatier.CircuitOpenError):
+                self.query()
+            summary = datatier.end_invocation('h')
+
+        self.assertEqual(self.mock_aiomysql.create_pool.call_count, datatier.BREAKER_THRESHOLD)
+        self.assertTrue(summary['circuit_open'])
+
+    def test_success_closes_the_breaker(self):
+        conn = MagicMock()
+        conn.cursor.return_value = FakeCursor()
+        pool = MagicMock()
+        pool.acquire = AsyncMock(return_value=conn)
+        self.mock_aiomysql.create_pool = AsyncMock(return_value=pool)
+
+        breaker = datatier.get_breaker('primary', 3306)
+        breaker.record_failure()
+        self.assertEqual(self.query(), (1,))
+
+        self.assertEqual(breaker._failures, 0)
+        pool.release.assert_called_once_with(conn)
+
+
+if __name__ == '__main__':
+    unittest.main()
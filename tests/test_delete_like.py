@@ -5,23 +5,15 @@ from lambda_functions.delete_like import lambda_handler
 
 class TestDeleteLike(unittest.TestCase):
 
-    @patch('lambda_functions.delete_like.boto3')
     @patch('lambda_functions.delete_like.datatier')
-    def test_successful_delete(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_successful_delete(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls: An existing like is found
         mock_datatier.retrieve_all_rows.return_value = [('user1', 20001)]
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1, 1]
 
         event = {'body': json.dumps({'userid': 'user1', 'postid': 20001})}
         response = lambda_handler(event, None)
@@ -29,19 +21,19 @@ class TestDeleteLike(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(response['body'], "Successfully removed like from the Likes table.")
 
-    @patch('lambda_functions.delete_like.boto3')
-    @patch('lambda_functions.delete_like.datatier')
-    def test_like_not_found(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+        # the counter drops, on a shard, only if the DELETE removed a
+        # row, in the same batch
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertIn("DELETE FROM Likes", statements[0][0])
+        self.assertIn("WHERE ROW_COUNT() > 0", statements[1][0])
+        self.assertIn("like_count = like_count - 1", statements[1][0])
+        self.assertEqual(statements[1][1], [20001, 0])
 
+    @patch('lambda_functions.delete_like.datatier')
+    def test_like_not_found(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls: No existing like is found
         mock_datatier.retrieve_all_rows.return_value = []
@@ -5,21 +5,14 @@ from lambda_functions.delete_post import lambda_handler
 
 class TestDeletePost(unittest.TestCase):
 
-    @patch('lambda_functions.delete_post.boto3')
     @patch('lambda_functions.delete_post.datatier')
-    def test_successful_post_deletion(self, mock_datatier, mock_boto3):
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+    def test_successful_post_deletion(self, mock_datatier):
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database checks to show the post exists
-        mock_datatier.retrieve_one_row.return_value = (1,) # Simulate finding the post
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.retrieve_one_row.return_value = (1, 'user1', None, 'text', None, None) # Simulate finding the post
+        mock_datatier.execute_batch.return_value = [2, 2, 1, 1]
 
         # Create a valid event
         event = {"body": json.dumps({"postid": "1"})}
@@ -32,23 +25,42 @@ class TestDeletePost(unittest.TestCase):
         self.assertEqual(json.loads(response["body"])["message"], "Post posted successfully.")
         
         # Verify the delete action was called
-        mock_datatier.perform_action.assert_called_once_with(
-            mock_conn,
+        mock_datatier.execute_batch.assert_called_once()
+        conn, statements = mock_datatier.execute_batch.call_args[0]
+        self.assertIs(conn, mock_conn)
+        # Owners of the timelines showing the post get a new
+        # timeline_version before the purge removes it
+        self.assertIn("timeline_version", statements[0][0])
+        self.assertIn("JOIN HomeTimeline", statements[0][0])
+        self.assertEqual(statements[0][1], ['1'])
+        self.assertIn("DELETE FROM HomeTimeline", statements[1][0])
+        self.assertEqual(statements[2], (
             "\n                DELETE FROM PostInfo\n                WHERE postid = %s;\n            ",
             ['1']
-        )
+        ))
+        # A root post is uncounted from its author's post_count
+        self.assertIn("post_count", statements[3][0])
+        self.assertEqual(statements[3][1], ['user1'])
 
-    @patch('lambda_functions.delete_post.boto3')
     @patch('lambda_functions.delete_post.datatier')
-    def test_delete_non_existent_postid(self, mock_datatier, mock_boto3):
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+    def test_deleting_reply_keeps_post_count(self, mock_datatier):
+        """A reply is not in post_count; it is uncounted from its parent's comment_count."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_one_row.return_value = (2, 'user1', None, 'text', None, 1)
+
+        response = lambda_handler({"body": json.dumps({"postid": 2})}, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(len(statements), 3)
+        self.assertIn("DELETE FROM PostInfo", statements[1][0])
+        self.assertIn("comment_count - ROW_COUNT()", statements[2][0])
+        self.assertEqual(statements[2][1], [1])
+
+    @patch('lambda_functions.delete_post.datatier')
+    def test_delete_non_existent_postid(self, mock_datatier):
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         
         # Mock database check to show the post does NOT exist
         mock_datatier.retrieve_one_row.return_value = None
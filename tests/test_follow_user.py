@@ -1,37 +1,25 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
-from lambda_functions.follow_user import lambda_handler
+from unittest.mock import patch, MagicMock, AsyncMock
+from lambda_functions.follow_user import lambda_handler, BACKFILL_LIMIT
 
 class TestFollowUser(unittest.TestCase):
 
-    @patch('lambda_functions.follow_user.boto3')
+    @patch('lambda_functions.follow_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.follow_user.datatier')
-    def test_follow_user_success(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({
-                'host': 'test_host',
-                'port': 3306,
-                'username': 'test_user',
-                'password': 'test_password'
-            })
-        }
-
+    def test_follow_user_success(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('follower_id',)],  # Follower exists
-            [('followee_id',)],  # Followee exists
-            [],                  # Not already following
-            []                   # Not blocked
+        mock_retrieve_one_row.side_effect = [
+            ('follower_id',),  # Follower exists
+            ('followee_id',),  # Followee exists
+            None,              # Not already following
+            None               # Not blocked
         ]
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 3, 1]
 
         event = {
             'body': json.dumps({
@@ -44,30 +32,31 @@ class TestFollowUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(json.loads(response['body'])['message'], 'Successfully followed user.')
 
-    @patch('lambda_functions.follow_user.boto3')
-    @patch('lambda_functions.follow_user.datatier')
-    def test_already_following(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({
-                'host': 'test_host',
-                'port': 3306,
-                'username': 'test_user',
-                'password': 'test_password'
-            })
-        }
+        # The four prechecks run concurrently, keyed on the followee's username
+        self.assertEqual(mock_retrieve_one_row.call_count, 4)
+        self.assertEqual(mock_retrieve_one_row.call_args_list[3][0][2], ['followee_username', 'follower_id'])
+
+        # The follow and the home timeline backfill go in one batch
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(statements[0][1], ['follower_id', 'followee_id'])
+        self.assertIn("INSERT IGNORE INTO HomeTimeline", statements[1][0])
+        self.assertEqual(statements[1][1], ['follower_id', 'followee_id', BACKFILL_LIMIT])
+        self.assertIn("timeline_version", statements[2][0])
+        self.assertEqual(statements[2][1], ['follower_id'])
 
+    @patch('lambda_functions.follow_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
+    @patch('lambda_functions.follow_user.datatier')
+    def test_already_following(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('follower_id',)],  # Follower exists
-            [('followee_id',)],  # Followee exists
-            [('follower_id', 'followee_id')]  # Already following
+        mock_retrieve_one_row.side_effect = [
+            ('follower_id',),  # Follower exists
+            ('followee_id',),  # Followee exists
+            (1,),              # Already following
+            None               # Not blocked
         ]
 
         event = {
@@ -81,31 +70,19 @@ class TestFollowUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 400)
         self.assertEqual(json.loads(response['body'])['message'], 'User is already following this account.')
 
-    @patch('lambda_functions.follow_user.boto3')
+    @patch('lambda_functions.follow_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.follow_user.datatier')
-    def test_blocked_by_user(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({
-                'host': 'test_host',
-                'port': 3306,
-                'username': 'test_user',
-                'password': 'test_password'
-            })
-        }
-        
+    def test_blocked_by_user(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('follower_id',)], # Follower exists
-            [('followee_id',)], # Followee exists
-            [], # Not already following
-            [('followee_id', 'follower_id')] # Is blocked
+        mock_retrieve_one_row.side_effect = [
+            ('follower_id',),  # Follower exists
+            ('followee_id',),  # Followee exists
+            None,              # Not already following
+            (1,)               # Is blocked
         ]
 
         event = {
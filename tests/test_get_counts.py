@@ -1,29 +1,24 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+from lambda_functions import counts_cache
 from lambda_functions.get_counts import lambda_handler
 
 class TestGetCounts(unittest.TestCase):
 
-    @patch('lambda_functions.get_counts.boto3')
+    def setUp(self):
+        counts_cache.get_cache().clear()
+
     @patch('lambda_functions.get_counts.datatier')
-    def test_get_counts_success(self, mock_datatier, mock_boto3):
+    def test_get_counts_success(self, mock_datatier):
         """Tests successfully getting all counts for a list of post IDs."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
-        # Mock the return value of the UNION SQL query
+        # Mock the PostCounters rows (postid, likes, retweets, comments)
         mock_db_rows = [
-            (101, 'likes', 15, None),
-            (102, 'likes', 1, None),
-            (101, 'retweets', 7, None),
-            (102, 'comments', 3, None)
+            (101, 15, 7, 0),
+            (102, 1, 0, 3)
         ]
         mock_datatier.retrieve_all_rows.return_value = mock_db_rows
         
@@ -46,6 +41,98 @@ class TestGetCounts(unittest.TestCase):
         self.assertEqual(len(body['comment_counts']), 1)
         self.assertEqual(body['comment_counts'][0]['comment_count'], 3)
 
+        # one primary-key lookup, summing each post's shards
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("FROM PostCounters", sql)
+        self.assertIn("SUM(like_count)", sql)
+        self.assertEqual(params, [101, 102])
+
+    @patch('lambda_functions.get_counts.COUNTS_CHUNK_SIZE', 2)
+    @patch('lambda_functions.get_counts.datatier_async.retrieve_all_rows', new_callable=AsyncMock)
+    @patch('lambda_functions.get_counts.datatier')
+    def test_long_lists_are_read_in_parallel_chunks(self, mock_datatier, mock_retrieve_all_rows):
+        """Long lists are split into bounded chunks read concurrently; the response is the same."""
+        mock_retrieve_all_rows.side_effect = [
+            [(101, 15, 7, 0), (102, 1, 0, 3)],
+            [(104, 0, 2, 0)],
+            [],
+        ]
+
+        event = {"body": json.dumps({"postids": [101, 102, 101, 103, 104, 105, 106]})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body']), {
+            "likes": [{"originalpost": 101, "like_count": 15},
+                      {"originalpost": 102, "like_count": 1}],
+            "retweets": [{"originalpost": 101, "retweet_count": 7},
+                         {"originalpost": 104, "retweet_count": 2}],
+            "comment_counts": [{"reply_to_postid": 102, "comment_count": 3}],
+        })
+
+        # repeats dropped, chunks of at most 2, and no connection held
+        chunks = [call[0][2] for call in mock_retrieve_all_rows.call_args_list]
+        self.assertEqual(chunks, [[101, 102], [103, 104], [105, 106]])
+        mock_datatier.checkout_dbConn_from_secret.assert_not_called()
+
+    @patch('lambda_functions.get_counts.COUNTS_JOIN_THRESHOLD', 4)
+    @patch('lambda_functions.get_counts.COUNTS_CHUNK_SIZE', 2)
+    @patch('lambda_functions.get_counts.datatier_async.retrieve_all_rows', new_callable=AsyncMock)
+    @patch('lambda_functions.get_counts.datatier')
+    def test_very_long_lists_join_json_table(self, mock_datatier, mock_retrieve_all_rows):
+        """Past the join threshold, one chunk per pooled connection, joined as a JSON_TABLE."""
+        mock_datatier.POOL_MAX_SIZE = 2
+        mock_retrieve_all_rows.return_value = []
+
+        event = {"body": json.dumps({"postids": [1, 2, 3, 4, 5, 6]})}
+        response = lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+
+        calls = mock_retrieve_all_rows.call_args_list
+        self.assertEqual(len(calls), 2)
+        sql, params = calls[0][0][1:]
+        self.assertIn("JSON_TABLE", sql)
+        self.assertEqual(params, ["[1, 2, 3]"])
+
+    @patch('lambda_functions.get_counts.datatier')
+    def test_unchanged_counts_return_304(self, mock_datatier):
+        """A poll sending back the ETag of an unchanged result gets a 304 with no body."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [(101, 15, 0, 0)]
+        event = {"body": json.dumps({"postids": [101]})}
+
+        first = lambda_handler(event, None)
+        etag = first['headers']['ETag']
+
+        second = lambda_handler(dict(event, headers={"If-None-Match": etag}), None)
+        self.assertEqual(second['statusCode'], 304)
+        self.assertEqual(second['body'], "")
+
+        # liked meanwhile, and the cached count has expired
+        counts_cache.get_cache().clear()
+        mock_datatier.retrieve_all_rows.return_value = [(101, 16, 0, 0)]
+        third = lambda_handler(dict(event, headers={"If-None-Match": etag}), None)
+        self.assertEqual(third['statusCode'], 200)
+        self.assertNotEqual(third['headers']['ETag'], etag)
+
+    @patch('lambda_functions.get_counts.datatier')
+    def test_cached_posts_are_not_read_again(self, mock_datatier):
+        """Only the posts missing from the counts cache are read; a fully cached list needs no connection."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [(101, 15, 0, 0)]
+        first = lambda_handler({"body": json.dumps({"postids": [101, 102]})}, None)
+
+        mock_datatier.retrieve_all_rows.return_value = [(103, 0, 4, 0)]
+        second = lambda_handler({"body": json.dumps({"postids": [103, 101, 102]})}, None)
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_args[0][2], [103])
+        self.assertEqual(json.loads(second['body'])['likes'], json.loads(first['body'])['likes'])
+        self.assertEqual(json.loads(second['body'])['retweets'], [{"originalpost": 103, "retweet_count": 4}])
+
+        mock_datatier.reset_mock()
+        third = lambda_handler({"body": json.dumps({"postids": [101, 102, 103]})}, None)
+        self.assertEqual(third['body'], second['body'])
+        mock_datatier.checkout_dbConn_from_secret.assert_not_called()
+
     def test_empty_postid_list(self):
         """Tests that providing an empty list of postids returns empty counts."""
         event = {"body": json.dumps({"postids": []})}
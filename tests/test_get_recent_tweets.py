@@ -2,12 +2,21 @@ import unittest
 import json
 from unittest.mock import patch, MagicMock
 from datetime import datetime
-from lambda_functions.get_recent_tweets import lambda_handler
+from lambda_functions.get_recent_tweets import (
+    lambda_handler, serialize_rows, posts_fields, dump_row_batches, encode_cursor, decode_cursor, MAX_PAGE_SIZE
+)
+from lambda_functions import timeline_cache
 
 class TestGetRecentTweets(unittest.TestCase):
 
     def setUp(self):
         """Set up common mock objects for each test."""
+        timeline_cache.get_cache().clear()
+        # no blocks unless a test sets some
+        patcher = patch('lambda_functions.get_recent_tweets.block_set')
+        self.mock_block_set = patcher.start()
+        self.mock_block_set.blocked_users.return_value = frozenset()
+        self.addCleanup(patcher.stop)
         # This is a sample row structure for timeline/reply posts (9 columns)
         self.mock_post_row = (
             20001,  # postid
@@ -31,19 +40,12 @@ class TestGetRecentTweets(unittest.TestCase):
             'User Three' # username
         )
 
-    @patch('lambda_functions.get_recent_tweets.boto3')
     @patch('lambda_functions.get_recent_tweets.datatier')
-    def test_get_timeline_success(self, mock_datatier, mock_boto3):
+    def test_get_timeline_success(self, mock_datatier):
         """Tests successfully fetching a user's main timeline."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.iter_rows.return_value = iter([[self.mock_post_row]])
 
         # Event for a general timeline fetch
         event = {"body": json.dumps({"userid": "user1"})}
@@ -60,19 +62,12 @@ class TestGetRecentTweets(unittest.TestCase):
         self.assertEqual(body[0]['retweeted'], 0)
         self.assertEqual(body[0]['dateposted'], '2024-05-10 12:30:00')
 
-    @patch('lambda_functions.get_recent_tweets.boto3')
     @patch('lambda_functions.get_recent_tweets.datatier')
-    def test_get_replies_success(self, mock_datatier, mock_boto3):
+    def test_get_replies_success(self, mock_datatier):
         """Tests successfully fetching replies for a specific post."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.iter_rows.return_value = iter([[self.mock_post_row]])
 
         # Event to fetch replies for postid 20000
         event = {"body": json.dumps({"userid": "user1", "postid": 20000})}
@@ -86,19 +81,13 @@ class TestGetRecentTweets(unittest.TestCase):
         self.assertEqual(body[0]['post_id'], 20001)
         self.assertIn('liked', body[0]) # liked/retweeted fields should be present
 
-    @patch('lambda_functions.get_recent_tweets.boto3')
     @patch('lambda_functions.get_recent_tweets.datatier')
-    def test_get_user_posts_success(self, mock_datatier, mock_boto3):
+    def test_get_user_posts_success(self, mock_datatier):
         """Tests successfully fetching all posts for a specific user profile."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-        mock_datatier.retrieve_all_rows.return_value = [self.mock_user_post_row]
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.iter_rows.return_value = iter([[self.mock_user_post_row]])
+        mock_datatier.retrieve_one_row.return_value = ('user3', 1, 0)
 
         # Event to fetch posts from profile 'User Three'
         event = {"body": json.dumps({"userid": "user1", "profileUsername": "User Three"})}
@@ -115,6 +104,368 @@ class TestGetRecentTweets(unittest.TestCase):
         self.assertNotIn('liked', body[0])
         self.assertNotIn('retweeted', body[0])
 
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_get_timeline_first_page(self, mock_datatier):
+        """A limit returns one page plus a cursor when more rows exist."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        older_row = (20000,) + self.mock_post_row[1:2] + (datetime(2024, 5, 9, 8, 0, 0),) + self.mock_post_row[3:]
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row, older_row]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 1})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual([p['post_id'] for p in body['posts']], [20001])
+        self.assertEqual(decode_cursor(body['next_cursor']), ('2024-05-10 12:30:00', 20001))
+
+        # limit + 1 rows are read to detect the next page; no keyset predicate yet
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("FROM HomeTimeline t", sql)
+        self.assertIn("ORDER BY t.dateposted DESC, t.postid DESC LIMIT %s", sql)
+        self.assertNotIn("t.dateposted <", sql)
+        self.assertEqual(params[-1], 2)
+        mock_datatier.iter_rows.assert_not_called()
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_home_page_cached_until_version_changes(self, mock_datatier):
+        """A repeated page is served from the cache until the user's timeline_version moves."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+        mock_datatier.retrieve_one_row.return_value = (7, 0)
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 10})}
+        first = lambda_handler(event, None)
+        second = lambda_handler(event, None)
+
+        self.assertEqual(second["statusCode"], 200)
+        self.assertEqual(second["body"], first["body"])
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 1)
+        sql, params = mock_datatier.retrieve_one_row.call_args[0][1:]
+        self.assertIn("timeline_version, block_version", sql)
+        self.assertEqual(params, ["user1"])
+
+        # another cursor is another entry
+        cursor = encode_cursor(self.mock_post_row)
+        lambda_handler({"body": json.dumps({"userid": "user1", "limit": 10, "cursor": cursor})}, None)
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 2)
+
+        # a write bumped the version: the page is read again
+        mock_datatier.retrieve_one_row.return_value = (8, 0)
+        lambda_handler(event, None)
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 3)
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_get_replies_next_page(self, mock_datatier):
+        """A cursor seeks past (dateposted, postid); the last page has no cursor."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+        cursor = encode_cursor((20005, 'user2', datetime(2024, 5, 10, 12, 30, 0)))
+
+        event = {"body": json.dumps({"userid": "user1", "postid": 20000, "limit": 5, "cursor": cursor})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual(len(body['posts']), 1)
+        self.assertIsNone(body['next_cursor'])
+
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("(p.dateposted < %s OR (p.dateposted = %s AND p.postid < %s))", sql)
+        self.assertEqual(params, ['user1', 'user1', 20000,
+                                  '2024-05-10 12:30:00', '2024-05-10 12:30:00', 20005, 6])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_get_user_posts_page_limit_capped(self, mock_datatier):
+        """Profile pages are capped at MAX_PAGE_SIZE."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_user_post_row]
+        mock_datatier.retrieve_one_row.return_value = ('user3', 1, 0)
+
+        event = {"body": json.dumps({"userid": "user1", "profileUsername": "User Three", "limit": 10000})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertNotIn('liked', body['posts'][0])
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_args[0][2][-1], MAX_PAGE_SIZE + 1)
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_profile_page_by_userid_with_post_count(self, mock_datatier):
+        """The username is resolved once; the page scans that userid's root posts."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_one_row.return_value = ('user3', 1234, 0)
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_user_post_row]
+
+        event = {"body": json.dumps({"userid": "user1", "profileUsername": "User Three", "limit": 10})}
+        body = json.loads(lambda_handler(event, None)["body"])
+
+        self.assertEqual(body['post_count'], 1234)
+        self.assertEqual(len(body['posts']), 1)
+        self.assertEqual(mock_datatier.retrieve_one_row.call_args[0][2], ['User Three'])
+
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("WHERE p.userid = %s AND p.reply_to_postid IS NULL", sql)
+        self.assertNotIn("u.username =", sql)
+        self.assertEqual(params, ['user3', 11])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_profile_of_blocked_or_unknown_user(self, mock_datatier):
+        """An author in the viewer's block set, or an unknown one, shows no posts and no count."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = []
+        self.mock_block_set.blocked_users.return_value = frozenset(['user3'])
+
+        for author, post_count in ((('user3', 7), 0), ((), 0)):
+            mock_datatier.retrieve_one_row.side_effect = [(0, 0), author]
+            event = {"body": json.dumps({"userid": "user1", "profileUsername": "User Three", "limit": 10})}
+            body = json.loads(lambda_handler(event, None)["body"])
+            self.assertEqual(body['posts'], [])
+            self.assertEqual(body['post_count'], post_count)
+            self.assertEqual(mock_datatier.retrieve_all_rows.call_args[0][2], [None, 11])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_bad_cursor_or_limit(self, mock_datatier):
+        """Malformed cursors and limits are rejected before touching the database."""
+        for extra in ({"cursor": "not-a-cursor"}, {"limit": 0}, {"limit": "10"}):
+            event = {"body": json.dumps(dict({"userid": "user1"}, **extra))}
+            response = lambda_handler(event, None)
+            self.assertEqual(response["statusCode"], 400)
+        mock_datatier.checkout_dbConn_from_secret.assert_not_called()
+
+    def post_by(self, postid, userid):
+        return (postid, userid) + self.mock_post_row[2:]
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_block_set_filters_and_refills_page(self, mock_datatier):
+        """Posts by users in the viewer's block set are dropped in memory and the page is refilled."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_one_row.return_value = (0, 3)
+        self.mock_block_set.blocked_users.return_value = frozenset(['blocked', 'blocker'])
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [self.post_by(20005, 'blocked'), self.post_by(20004, 'user2'), self.post_by(20003, 'blocker')],
+            [self.post_by(20002, 'user2'), self.post_by(20001, 'user4')],
+        ]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 2})}
+        body = json.loads(lambda_handler(event, None)["body"])
+
+        self.assertEqual([p['post_id'] for p in body['posts']], [20004, 20002])
+        self.assertEqual(decode_cursor(body['next_cursor'])[1], 20002)
+        self.assertEqual(self.mock_block_set.blocked_users.call_args[0][1:], ('user1', 3))
+
+        # no join against Blocked; the refill seeks past the last row read
+        first, second = mock_datatier.retrieve_all_rows.call_args_list
+        self.assertNotIn("Blocked", first[0][1])
+        self.assertEqual(second[0][2][-4:], ['2024-05-10 12:30:00', '2024-05-10 12:30:00', 20003, 3])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_block_set_filters_streamed_replies(self, mock_datatier):
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        self.mock_block_set.blocked_users.return_value = frozenset(['blocked'])
+        mock_datatier.iter_rows.return_value = iter([[self.post_by(20003, 'blocked'), self.post_by(20002, 'user2')]])
+
+        event = {"body": json.dumps({"userid": "user1", "postid": 20000})}
+        posts = json.loads(lambda_handler(event, None)["body"])
+
+        self.assertEqual([p['post_id'] for p in posts], [20002])
+        self.assertNotIn("Blocked", mock_datatier.iter_rows.call_args[0][1])
+
+    @patch('lambda_functions.get_recent_tweets.TIMELINE_ENGINE', 'merge')
+    @patch('lambda_functions.get_recent_tweets.timeline_merge')
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_merge_engine_leaves_out_block_set(self, mock_datatier, mock_merge):
+        """The merge only reads authors outside the viewer's two-way block set."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        self.mock_block_set.blocked_users.return_value = frozenset(['blocker'])
+        mock_merge.timeline_page.return_value = [self.mock_post_row]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 10})}
+        body = json.loads(lambda_handler(event, None)["body"])
+
+        self.assertEqual([p['post_id'] for p in body['posts']], [20001])
+        self.assertEqual(mock_merge.timeline_page.call_args[1]['blocked'], frozenset(['blocker']))
+
+    @patch('lambda_functions.get_recent_tweets.TIMELINE_ENGINE', 'merge')
+    @patch('lambda_functions.get_recent_tweets.timeline_merge')
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_merge_engine_page(self, mock_datatier, mock_merge):
+        """The merge engine answers pages from its caches without a timeline query."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_merge.timeline_page.return_value = [self.mock_post_row]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 10})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual([p['post_id'] for p in body['posts']], [20001])
+        self.assertIsNone(body['next_cursor'])
+        self.assertEqual(mock_merge.timeline_page.call_args[0][1:], ('user1', 11, None))
+        mock_datatier.retrieve_all_rows.assert_not_called()
+
+    @patch('lambda_functions.get_recent_tweets.TIMELINE_ENGINE', 'merge')
+    @patch('lambda_functions.get_recent_tweets.timeline_merge')
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_merge_engine_falls_back_to_sql(self, mock_datatier, mock_merge):
+        """When the caches cannot answer, the page comes from one query over PostInfo."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_merge.timeline_page.return_value = None
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 10})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        sql = mock_datatier.retrieve_all_rows.call_args[0][1]
+        self.assertIn("SELECT followee FROM Followers", sql)
+        self.assertNotIn("HomeTimeline", sql)
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_page_with_counts(self, mock_datatier):
+        """include_counts adds counts to each post from one PostCounters lookup of the page's ids."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        second_row = (20000,) + self.mock_post_row[1:]
+        extra_row = (19999,) + self.mock_post_row[1:]
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [self.mock_post_row, second_row, extra_row],    # page of 2 + 1 extra
+            [(20001, 4, 1, 2)],                              # counts
+        ]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 2, "include_counts": True})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        posts = json.loads(response["body"])["posts"]
+        self.assertEqual((posts[0]['like_count'], posts[0]['retweet_count'], posts[0]['comment_count']), (4, 1, 2))
+        self.assertEqual((posts[1]['like_count'], posts[1]['retweet_count'], posts[1]['comment_count']), (0, 0, 0))
+
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 2)
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("FROM PostCounters", sql)
+        self.assertIn("SUM(like_count)", sql)
+        self.assertEqual(params, [20001, 20000])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_list_with_counts(self, mock_datatier):
+        """Counts also work without pagination; without include_counts none are added."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.side_effect = [[self.mock_user_post_row], [(20002, 0, 3, 0)]]
+        mock_datatier.retrieve_one_row.return_value = ('user3', 1, 0)
+
+        event = {"body": json.dumps({"userid": "user1", "profileUsername": "User Three", "include_counts": True})}
+        body = json.loads(lambda_handler(event, None)["body"])
+        self.assertEqual(body[0]['retweet_count'], 3)
+        mock_datatier.iter_rows.assert_not_called()
+
+        self.assertNotIn('like_count', serialize_rows([self.mock_post_row])[0])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_since_returns_newer_posts(self, mock_datatier):
+        """since returns only newer posts and the cursor for the next poll."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row]
+        since = encode_cursor((20000, 'user2', datetime(2024, 5, 10, 12, 0, 0)))
+
+        event = {"body": json.dumps({"userid": "user1", "since": since})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual([p['post_id'] for p in body['posts']], [20001])
+        self.assertFalse(body['gap_too_large'])
+        self.assertEqual(decode_cursor(body['newest_cursor']), ('2024-05-10 12:30:00', 20001))
+
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("(t.dateposted > %s OR (t.dateposted = %s AND t.postid > %s))", sql)
+        self.assertEqual(params[-4:], ['2024-05-10 12:00:00', '2024-05-10 12:00:00', 20000, MAX_PAGE_SIZE + 1])
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_since_gap_too_large(self, mock_datatier):
+        """More new posts than limit flags the gap; no new posts keeps the cursor."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        since = encode_cursor((20000, 'user2', datetime(2024, 5, 10, 12, 0, 0)))
+
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row, self.mock_post_row]
+        event = {"body": json.dumps({"userid": "user1", "since": since, "limit": 1})}
+        body = json.loads(lambda_handler(event, None)["body"])
+        self.assertTrue(body['gap_too_large'])
+        self.assertEqual(len(body['posts']), 1)
+
+        mock_datatier.retrieve_all_rows.return_value = []
+        body = json.loads(lambda_handler(event, None)["body"])
+        self.assertEqual(body['posts'], [])
+        self.assertFalse(body['gap_too_large'])
+        self.assertEqual(body['newest_cursor'], since)
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_since_postid(self, mock_datatier):
+        """since_postid is resolved to its (dateposted, postid); a deleted post asks for a reload."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_one_row.return_value = (datetime(2024, 5, 10, 12, 0, 0), 20000)
+        mock_datatier.retrieve_all_rows.return_value = []
+
+        event = {"body": json.dumps({"userid": "user1", "postid": 19000, "since_postid": 20000})}
+        body = json.loads(lambda_handler(event, None)["body"])
+        self.assertFalse(body['gap_too_large'])
+        params = mock_datatier.retrieve_all_rows.call_args[0][2]
+        self.assertEqual(params[-4:-1], ['2024-05-10 12:00:00', '2024-05-10 12:00:00', 20000])
+
+        mock_datatier.retrieve_one_row.return_value = ()
+        body = json.loads(lambda_handler(event, None)["body"])
+        self.assertTrue(body['gap_too_large'])
+        self.assertEqual(body['posts'], [])
+
+    def test_since_with_cursor_rejected(self):
+        """since and cursor are mutually exclusive."""
+        cursor = encode_cursor((20000, 'user2', datetime(2024, 5, 10, 12, 0, 0)))
+        event = {"body": json.dumps({"userid": "user1", "since": cursor, "cursor": cursor})}
+        self.assertEqual(lambda_handler(event, None)["statusCode"], 400)
+
+    @patch('lambda_functions.get_recent_tweets.datatier')
+    def test_compact_page(self, mock_datatier):
+        """format=compact returns column arrays and each author once."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        second_row = (20000,) + self.mock_post_row[1:3] + ('Another tweet.',) + self.mock_post_row[4:]
+        mock_datatier.retrieve_all_rows.return_value = [self.mock_post_row, second_row]
+
+        event = {"body": json.dumps({"userid": "user1", "limit": 10, "format": "compact"})}
+        body = json.loads(lambda_handler(event, None)["body"])
+
+        self.assertEqual(body['posts'], {
+            "post_id": [20001, 20000],
+            "userid": ['user2', 'user2'],
+            "dateposted": ['2024-05-10 12:30:00', '2024-05-10 12:30:00'],
+            "content": ['This is a tweet from another user.', 'Another tweet.'],
+            "liked": [1, 1],
+            "retweeted": [0, 0],
+        })
+        self.assertEqual(body['authors'], {'user2': {"username": 'User Two', "image": 'pic2.jpg'}})
+        self.assertIsNone(body['next_cursor'])
+
+    def test_compact_matches_row_format(self):
+        """Every post in the row format can be rebuilt from the compact one, batch-wise or not."""
+        rows = [self.mock_post_row, (20005, 'user9') + self.mock_post_row[2:8] + ('User Nine',)]
+        counts = {20001: (3, 2, 1)}
+        posts = serialize_rows(rows, counts=counts)
+        fields = posts_fields(rows, counts=counts, compact=True)
+
+        for i, post in enumerate(posts):
+            rebuilt = {name: values[i] for name, values in fields['posts'].items()}
+            rebuilt.update(fields['authors'][rebuilt['userid']])
+            self.assertEqual(rebuilt, post)
+
+        streamed = json.loads(dump_row_batches([rows[:1], rows[1:]], compact=True))
+        self.assertEqual(streamed, json.loads(json.dumps(posts_fields(rows, compact=True))))
+        self.assertEqual(json.loads(dump_row_batches([], compact=True))['posts']['post_id'], [])
+
+    def test_dump_row_batches_matches_serialize_rows(self):
+        """Batch-wise serialization produces the same JSON as serializing all rows at once."""
+        rows = [self.mock_post_row, self.mock_post_row]
+        expected = json.dumps(serialize_rows(rows, include_likes_retweets=True))
+        self.assertEqual(dump_row_batches([rows[:1], rows[1:]]), expected)
+        self.assertEqual(dump_row_batches([]), json.dumps([]))
+
     def test_missing_userid(self):
         """Tests that the lambda returns an error if userid is missing."""
         event = {"body": json.dumps({})}
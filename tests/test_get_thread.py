@@ -0,0 +1,199 @@
+import unittest
+import json
+import os
+from unittest.mock import patch, MagicMock
+from datetime import datetime
+from lambda_functions import datatier
+from lambda_functions.get_thread import lambda_handler, build_thread, load_thread, MAX_DEPTH
+
+
+def post_row(postid, reply_to, minute=0, liked=0):
+    """A row as the replies query returns it: the 9 post columns."""
+    return (postid, 'user%d' % postid, datetime(2024, 5, 10, 12, minute, 0),
+            'post %d' % postid, 'pic.jpg', reply_to, liked, 0, 'name%d' % postid)
+
+
+def thread_row(depth, postid, reply_to, minute=0, liked=0):
+    """A row as the ancestors query and load_thread return it: depth, then the post columns."""
+    return (depth,) + post_row(postid, reply_to, minute, liked)
+
+
+class TestGetThread(unittest.TestCase):
+
+    @patch('lambda_functions.get_thread.datatier')
+    def test_get_thread_success(self, mock_datatier):
+        """Ancestors come back oldest first and replies nest under their parents."""
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [thread_row(-2, 1, None), thread_row(-1, 2, 1), thread_row(0, 3, 2)],
+            [post_row(4, 3, minute=4), post_row(5, 3, minute=5, liked=1)],
+            [post_row(6, 4)],
+            [],
+        ]
+
+        event = {"body": json.dumps({"userid": "viewer", "postid": 3})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        body = json.loads(response["body"])
+        self.assertEqual([p['post_id'] for p in body['ancestors']], [1, 2])
+        self.assertEqual(body['post']['post_id'], 3)
+        self.assertEqual([p['post_id'] for p in body['post']['replies']], [5, 4])
+        self.assertEqual(body['post']['replies'][0]['liked'], 1)
+        self.assertEqual([p['post_id'] for p in body['post']['replies'][1]['replies']], [6])
+        self.assertFalse(body['post']['more_replies'])
+
+        # the ancestors, then one statement per level (depth 3)
+        calls = mock_datatier.retrieve_all_rows.call_args_list
+        self.assertEqual(len(calls), 4)
+        sql, params = calls[0][0][1:]
+        self.assertIn("WITH RECURSIVE", sql)
+        self.assertEqual(params, [3, 50] + ['viewer'] * 4)
+
+        # each post's replies are cut to breadth + 1 by their own LIMIT,
+        # with blocks counted both ways
+        sql, params = calls[2][0][1:]
+        self.assertEqual(sql.count("LIMIT %s"), 2)
+        self.assertEqual(params[:6], ['viewer', 'viewer', 5, 'viewer', 'viewer', 11])
+        self.assertEqual(params[6:], ['viewer', 'viewer', 4, 'viewer', 'viewer', 11])
+        self.assertIn("b.blocker = p.userid AND b.blockee = %s", sql)
+        self.assertNotIn("LATERAL", sql)
+
+    @patch('lambda_functions.get_thread.datatier')
+    def test_extra_reply_not_walked(self, mock_datatier):
+        """Only the newest breadth replies are walked further; the extra one only flags more."""
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [thread_row(0, 3, None)],
+            [post_row(5, 3, minute=5), post_row(4, 3, minute=4)],
+            [],
+        ]
+
+        rows = load_thread(MagicMock(), 'viewer', 3, depth=2, breadth=1)
+
+        self.assertEqual([row[1] for row in rows], [3, 5, 4])
+        params = mock_datatier.retrieve_all_rows.call_args[0][2]
+        self.assertEqual(params, ['viewer', 'viewer', 5, 'viewer', 'viewer', 2])
+
+    def test_breadth_budget(self):
+        """Replies beyond the breadth budget are dropped, with their subtrees, and flagged."""
+        rows = [
+            thread_row(0, 3, None),
+            thread_row(1, 5, 3, minute=5),
+            thread_row(1, 4, 3, minute=4),     # the breadth + 1 extra
+            thread_row(2, 7, 4),               # reply under the dropped post
+        ]
+        thread = build_thread(rows, 3, breadth=1)
+        self.assertEqual([p['post_id'] for p in thread['post']['replies']], [5])
+        self.assertTrue(thread['post']['more_replies'])
+
+    @patch('lambda_functions.get_thread.datatier')
+    def test_blocked_or_missing_post(self, mock_datatier):
+        """A post that does not exist, or whose author blocks or is blocked by the viewer, is a 404."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.return_value = [thread_row(-1, 2, None)]
+
+        event = {"body": json.dumps({"userid": "viewer", "postid": 3})}
+        response = lambda_handler(event, None)
+        self.assertEqual(response["statusCode"], 404)
+        # no replies are read for a post that is not shown
+        mock_datatier.retrieve_all_rows.assert_called_once()
+
+    @patch('lambda_functions.get_thread.datatier')
+    def test_budgets_validated_and_capped(self, mock_datatier):
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        mock_datatier.retrieve_all_rows.side_effect = lambda conn, sql, params: (
+            [thread_row(0, 3, None)] if "WITH RECURSIVE" in sql else [post_row(4, params[2])])
+
+        event = {"body": json.dumps({"userid": "viewer", "postid": "3", "depth": 1000})}
+        response = lambda_handler(event, None)
+        self.assertEqual(response["statusCode"], 200)
+        # the ancestors, then one statement per level down to MAX_DEPTH
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_count, 1 + MAX_DEPTH)
+
+        for bad in ({"depth": -1}, {"breadth": 0}, {"postid": "abc"}):
+            body = dict({"userid": "viewer", "postid": 3}, **bad)
+            response = lambda_handler({"body": json.dumps(body)}, None)
+            self.assertEqual(response["statusCode"], 400, bad)
+
+    def test_missing_postid(self):
+        event = {"body": json.dumps({"userid": "viewer"})}
+        response = lambda_handler(event, None)
+        self.assertEqual(response["statusCode"], 400)
+        self.assertEqual(json.loads(response["body"])["message"], "postid missing.")
+
+
+VIEWER = 'thread_viewer@test'
+ALICE = 'thread_alice@test'
+BOB = 'thread_bob@test'
+BLOCKED = 'thread_blocked@test'     # the viewer blocked them
+BLOCKER = 'thread_blocker@test'     # they blocked the viewer
+USERS = [VIEWER, ALICE, BOB, BLOCKED, BLOCKER]
+
+
+@unittest.skipUnless(os.environ.get("DB_HOST"), "needs the MySQL server from init.sql (DB_HOST)")
+class TestThreadOnMySQL(unittest.TestCase):
+    """
+    Runs the thread queries against a real server, as CI's mysql:8
+    service; they need MySQL 8.0+ (WITH RECURSIVE).
+    """
+
+    def setUp(self):
+        self.conn = datatier.get_dbConn(
+            os.environ["DB_HOST"], int(os.environ.get("DB_PORT", "3306")),
+            os.environ["DB_USER"], os.environ["DB_PASSWORD"], os.environ["DB_NAME"])
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.delete_users)
+        self.delete_users()
+
+        post = "INSERT INTO PostInfo (postid, userid, dateposted, textcontent, reply_to_postid) VALUES (%s, %s, %s, %s, %s);"
+        statements = [("INSERT INTO UserInfo (userid, username) VALUES (%s, %s);", [u, u.split('@')[0]])
+                      for u in USERS]
+        statements += [
+            ("INSERT INTO Blocked (blocker, blockee) VALUES (%s, %s);", [VIEWER, BLOCKED]),
+            ("INSERT INTO Blocked (blocker, blockee) VALUES (%s, %s);", [BLOCKER, VIEWER]),
+        ]
+        for postid, author, minute, reply_to in [
+            (990001, ALICE, 0, None),
+            (990002, BOB, 1, 990001),       # the post viewed
+            (990003, ALICE, 2, 990002),
+            (990004, BOB, 3, 990002),
+            (990005, BLOCKED, 4, 990002),
+            (990006, BLOCKER, 5, 990002),
+            (990007, ALICE, 6, 990004),
+            (990008, BOB, 7, 990003),       # under the reply cut by breadth
+        ]:
+            statements.append((post, [postid, author, datetime(2024, 5, 10, 12, minute, 0),
+                                      'post %d' % postid, reply_to]))
+        statements.append(("INSERT INTO Likes (liker, originalpost) VALUES (%s, %s);", [VIEWER, 990004]))
+        datatier.execute_batch(self.conn, statements)
+
+    def delete_users(self):
+        datatier.perform_action(self.conn, "DELETE FROM UserInfo WHERE userid IN (%s, %s, %s, %s, %s);", USERS)
+
+    def test_server_version(self):
+        version = datatier.retrieve_one_row(self.conn, "SELECT VERSION();")[0]
+        major, minor = (int(part) for part in version.split('.')[:2])
+        self.assertGreaterEqual((major, minor), (8, 0))
+
+    def test_thread(self):
+        rows = load_thread(self.conn, VIEWER, 990002, depth=3, breadth=1)
+        thread = build_thread(rows, 990002, breadth=1)
+
+        self.assertEqual([p['post_id'] for p in thread['ancestors']], [990001])
+        post = thread['post']
+        self.assertEqual(post['post_id'], 990002)
+        # newest visible reply only; both blocked users' replies are skipped
+        self.assertEqual([p['post_id'] for p in post['replies']], [990004])
+        self.assertTrue(post['more_replies'])
+        self.assertEqual(post['replies'][0]['liked'], 1)
+        self.assertEqual([p['post_id'] for p in post['replies'][0]['replies']], [990007])
+        self.assertNotIn(990008, [row[1] for row in rows])
+
+    def test_blocked_post(self):
+        self.assertEqual(load_thread(self.conn, VIEWER, 990005, depth=3, breadth=1), [])
+        self.assertEqual(load_thread(self.conn, VIEWER, 990000, depth=3, breadth=1), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
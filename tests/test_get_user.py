@@ -1,28 +1,18 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock
 from lambda_functions.get_user import lambda_handler
 
 class TestGetUser(unittest.TestCase):
 
-    @patch('lambda_functions.get_user.boto3')
-    @patch('lambda_functions.get_user.datatier')
-    def test_get_user_is_following(self, mock_datatier, mock_boto3):
+    @patch('lambda_functions.get_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
+    def test_get_user_is_following(self, mock_retrieve_one_row):
         """Tests getting a user profile that the current user is following."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-        mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-
-        # Mock the sequence of DB calls
-        mock_datatier.retrieve_one_row.side_effect = [
+        # Mock the three (concurrent) DB calls, in the order they are issued
+        mock_retrieve_one_row.side_effect = [
             ('target_id', 'target_bio', 'target_pic.jpg'), # 1. Get profile
             (1,),  # 2. Is following? Yes.
-            None   # 3. Is blocked? No.
+            ()     # 3. Is blocked? No.
         ]
         
         event = {"body": json.dumps({"current_userid": "user1", "username": "target_user"})}
@@ -33,22 +23,13 @@ class TestGetUser(unittest.TestCase):
         self.assertEqual(body['bio'], 'target_bio')
         self.assertTrue(body['is_following'])
         self.assertFalse(body['is_blocked'])
+        self.assertEqual(mock_retrieve_one_row.await_count, 3)
 
-    @patch('lambda_functions.get_user.boto3')
-    @patch('lambda_functions.get_user.datatier')
-    def test_user_not_found(self, mock_datatier, mock_boto3):
+    @patch('lambda_functions.get_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
+    def test_user_not_found(self, mock_retrieve_one_row):
         """Tests the case where the requested user profile does not exist."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-        mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-
-        # Mock the first DB call to return nothing
-        mock_datatier.retrieve_one_row.return_value = None
+        # Mock the profile lookup to return nothing
+        mock_retrieve_one_row.return_value = ()
 
         event = {"body": json.dumps({"current_userid": "user1", "username": "nonexistent_user"})}
         response = lambda_handler(event, None)
@@ -56,5 +37,15 @@ class TestGetUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 404)
         self.assertIn("User not found", json.loads(response['body'])['message'])
 
+    @patch('lambda_functions.get_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
+    def test_database_error(self, mock_retrieve_one_row):
+        """A failing query returns a 500."""
+        mock_retrieve_one_row.side_effect = Exception("connection lost")
+
+        event = {"body": json.dumps({"current_userid": "user1", "username": "target_user"})}
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 500)
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -5,25 +5,20 @@ from lambda_functions.get_users import lambda_handler
 
 class TestGetUsers(unittest.TestCase):
 
-    @patch('lambda_functions.get_users.boto3')
+    @patch('lambda_functions.get_users.block_set')
     @patch('lambda_functions.get_users.datatier')
-    def test_get_users_success(self, mock_datatier, mock_boto3):
+    def test_get_users_success(self, mock_datatier, mock_block_set):
         """Tests successfully retrieving a list of other users."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+        mock_block_set.blocked_users.return_value = frozenset()
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock the database response
         mock_user_list = [
             ('user2', 'UserTwo', 'pic2.jpg'),
             ('user3', 'UserThree', 'pic3.jpg')
         ]
-        mock_datatier.retrieve_all_rows.return_value = mock_user_list
+        mock_datatier.iter_rows.return_value = iter([mock_user_list[:1], mock_user_list[1:]])
         
         event = {"body": json.dumps({"userid": "user1"})}
         response = lambda_handler(event, None)
@@ -31,14 +26,33 @@ class TestGetUsers(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         body = json.loads(response['body'])
         self.assertEqual(len(body), 2)
+        self.assertEqual(response['body'], json.dumps(mock_user_list))
         
         # Verify the correct SQL was executed
-        mock_datatier.retrieve_all_rows.assert_called_once_with(
+        mock_datatier.iter_rows.assert_called_once_with(
             mock_conn,
             "SELECT userid, username, picture FROM UserInfo WHERE userid != %s;",
             ['user1']
         )
 
+    @patch('lambda_functions.get_users.block_set')
+    @patch('lambda_functions.get_users.datatier')
+    def test_blocked_users_left_out(self, mock_datatier, mock_block_set):
+        """Users in the block set (either direction) are filtered out in memory."""
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_block_set.blocked_users.return_value = frozenset(['user2', 'user4'])
+        mock_datatier.iter_rows.return_value = iter([[
+            ('user2', 'UserTwo', 'pic2.jpg'),
+            ('user3', 'UserThree', 'pic3.jpg'),
+            ('user4', 'UserFour', 'pic4.jpg'),
+        ]])
+
+        response = lambda_handler({"body": json.dumps({"userid": "user1"})}, None)
+
+        self.assertEqual(json.loads(response['body']), [['user3', 'UserThree', 'pic3.jpg']])
+        mock_block_set.blocked_users.assert_called_once_with(mock_conn, 'user1')
+
     def test_missing_userid(self):
         """Tests that the function fails if userid is missing."""
         event = {"body": json.dumps({})}
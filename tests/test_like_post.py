@@ -5,23 +5,15 @@ from lambda_functions.like_post import lambda_handler
 
 class TestLikePost(unittest.TestCase):
 
-    @patch('lambda_functions.like_post.boto3')
     @patch('lambda_functions.like_post.datatier')
-    def test_successful_like(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_successful_like(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls: No existing like found
         mock_datatier.retrieve_one_row.return_value = None
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1]
 
         event = {'body': json.dumps({'userid': 'user1', 'postid': 20001})}
         response = lambda_handler(event, None)
@@ -29,19 +21,42 @@ class TestLikePost(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(response['body'], "Successfully added like to the Likes table.")
 
-    @patch('lambda_functions.like_post.boto3')
+        # the like, its counter and the liker's timeline_version
+        # bump share one batch
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(statements[0][1], ['user1', 20001])
+        self.assertIn("INSERT INTO PostCounters", statements[1][0])
+        self.assertIn("like_count = like_count + 1", statements[1][0])
+        self.assertEqual(statements[1][1], [20001, 0])      # a cold post: shard 0
+        self.assertIn("timeline_version", statements[2][0])
+        self.assertEqual(statements[2][1], ['user1'])
+
+    @patch('lambda_functions.like_post.counter_buffer')
     @patch('lambda_functions.like_post.datatier')
-    def test_already_liked(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+    def test_write_behind_counter(self, mock_datatier, mock_counter_buffer):
+        """With COUNTER_WRITE_BEHIND the like's counter delta is queued in the batch, not applied."""
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.retrieve_one_row.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1, 1]
+        mock_counter_buffer.COUNTER_WRITE_BEHIND = True
+        mock_counter_buffer.delta_statement.return_value = ("INSERT INTO CounterDeltas", [20001, 1])
+
+        event = {'body': json.dumps({'userid': 'user1', 'postid': 20001})}
+        response = lambda_handler(event, None)
 
+        self.assertEqual(response['statusCode'], 200)
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(statements[1], ("INSERT INTO CounterDeltas", [20001, 1]))
+        self.assertFalse(any("PostCounters" in sql for sql, _ in statements))
+        mock_counter_buffer.delta_statement.assert_called_once_with(20001, "like_count", 1)
+        mock_counter_buffer.flush_if_due.assert_called_once_with(mock_conn)
+
+    @patch('lambda_functions.like_post.datatier')
+    def test_already_liked(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls: An existing like is found
         mock_datatier.retrieve_one_row.return_value = ('user1', 20001)
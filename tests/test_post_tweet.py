@@ -5,20 +5,13 @@ from lambda_functions.post_tweet import lambda_handler
 
 class TestPostTweet(unittest.TestCase):
 
-    @patch('lambda_functions.post_tweet.boto3')
     @patch('lambda_functions.post_tweet.datatier')
-    def test_successful_tweet_posting(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+    def test_successful_tweet_posting(self, mock_datatier):
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock the database action
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1]
 
         # Create a valid event
         event = {
@@ -35,24 +28,61 @@ class TestPostTweet(unittest.TestCase):
         self.assertEqual(json.loads(response["body"])["message"], "Post posted successfully.")
         
         # Verify the database action was called correctly
-        mock_datatier.perform_action.assert_called_once_with(
-            mock_conn,
+        mock_datatier.execute_batch.assert_called_once()
+        conn, statements = mock_datatier.execute_batch.call_args[0]
+        self.assertIs(conn, mock_conn)
+        self.assertEqual(statements[0], (
             "\n                INSERT INTO PostInfo (userid, dateposted, textcontent, image_file_key, reply_to_postid)\n                VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s);\n            ",
             ['123', 'This is a valid tweet.', None, None]
-        )
+        ))
+        # The post is fanned out to home timelines in the same batch
+        self.assertIn("INSERT INTO HomeTimeline", statements[1][0])
+        self.assertIn("LAST_INSERT_ID()", statements[1][0])
+        # invalidates the cached timeline pages of the author's followers
+        self.assertIn("JOIN Followers f ON f.follower = u.userid", statements[2][0])
+        self.assertNotIn("HomeTimeline", statements[2][0])
+        self.assertEqual(statements[2][1], ['123'])
+        # and of the author, counting the post in their post_count
+        self.assertIn("post_count = post_count + 1", statements[3][0])
+        self.assertIn("timeline_version = timeline_version + 1", statements[3][0])
+        self.assertEqual(statements[3][1], ['123'])
 
-    @patch('lambda_functions.post_tweet.boto3')
+    @patch('lambda_functions.post_tweet.TIMELINE_ENGINE', 'merge')
     @patch('lambda_functions.post_tweet.datatier')
-    def test_successful_tweet_with_image(self, mock_datatier, mock_boto3):
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
+    def test_no_fanout_under_merge_engine(self, mock_datatier):
+        """The merge engine builds timelines at read time, so nothing is fanned out."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        event = {"body": json.dumps({"userid": "123", "textcontent": "A post."})}
+
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(len(statements), 3)
+        self.assertFalse(any("HomeTimeline" in sql for sql, _ in statements))
+        self.assertIn("JOIN Followers", statements[1][0])
+        self.assertIn("post_count = post_count + 1", statements[2][0])
+
+    @patch('lambda_functions.post_tweet.datatier')
+    def test_reply_not_counted(self, mock_datatier):
+        """A reply is not in post_count; it is counted in its parent's comment_count."""
+        mock_datatier.checkout_dbConn_from_secret.return_value = MagicMock()
+        event = {"body": json.dumps({"userid": "123", "textcontent": "A reply.", "root_post_id": 20001})}
+
+        response = lambda_handler(event, None)
+
+        self.assertEqual(response["statusCode"], 200)
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(len(statements), 2)
+        self.assertIn("INSERT INTO PostCounters", statements[1][0])
+        self.assertIn("comment_count = comment_count + 1", statements[1][0])
+        self.assertEqual(statements[1][1], [20001])
+
+    @patch('lambda_functions.post_tweet.datatier')
+    def test_successful_tweet_with_image(self, mock_datatier):
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_datatier.execute_batch.return_value = [1, 1]
 
         # Create event with an image key
         event = {
@@ -69,11 +99,11 @@ class TestPostTweet(unittest.TestCase):
         self.assertEqual(response["statusCode"], 200)
         
         # Verify the image key was passed to the database action
-        mock_datatier.perform_action.assert_called_once_with(
-            mock_conn,
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(statements[0], (
             "\n                INSERT INTO PostInfo (userid, dateposted, textcontent, image_file_key, reply_to_postid)\n                VALUES (%s, CURRENT_TIMESTAMP, %s, %s, %s);\n            ",
             ['123', 'This is a valid tweet with an image.', 'uploads/123/image1.jpg', None]
-        )
+        ))
 
     def test_tweet_exceeding_character_limit(self):
         # This test doesn't need mocks as it fails validation first
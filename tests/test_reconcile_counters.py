@@ -0,0 +1,63 @@
+import unittest
+import json
+from unittest.mock import patch, MagicMock
+from lambda_functions.reconcile_counters import lambda_handler, RECONCILE_HOURS
+
+
+class TestReconcileCounters(unittest.TestCase):
+
+    @patch('lambda_functions.reconcile_counters.counter_buffer')
+    @patch('lambda_functions.reconcile_counters.datatier')
+    def test_scheduled_run(self, mock_datatier, mock_counter_buffer):
+        """A scheduled event (no body) recomputes the recent posts."""
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_counter_buffer.flush_all.return_value = 40
+        mock_counter_buffer.reconcile.return_value = 12
+
+        response = lambda_handler({}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        self.assertEqual(body['deltas_applied'], 40)
+        self.assertEqual(body['rows_affected'], 12)
+        mock_counter_buffer.flush_all.assert_called_once_with(mock_conn)
+        mock_counter_buffer.reconcile.assert_called_once_with(mock_conn, hours=RECONCILE_HOURS)
+        mock_datatier.return_dbConn.assert_called_once_with(mock_conn)
+
+    @patch('lambda_functions.reconcile_counters.counter_buffer')
+    @patch('lambda_functions.reconcile_counters.datatier')
+    def test_given_postids(self, mock_datatier, mock_counter_buffer):
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_counter_buffer.flush_all.return_value = 0
+        mock_counter_buffer.reconcile.return_value = 2
+
+        response = lambda_handler({"body": json.dumps({"postids": [20001, 20002]})}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        mock_counter_buffer.reconcile.assert_called_once_with(mock_conn, postids=[20001, 20002])
+
+    @patch('lambda_functions.reconcile_counters.counter_buffer')
+    @patch('lambda_functions.reconcile_counters.datatier')
+    def test_flush_only(self, mock_datatier, mock_counter_buffer):
+        """The every-minute schedule's input only applies the queued deltas."""
+        mock_conn = MagicMock()
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
+        mock_counter_buffer.flush_all.return_value = 7
+
+        response = lambda_handler({"flush_only": True}, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['deltas_applied'], 7)
+        mock_counter_buffer.flush_all.assert_called_once_with(mock_conn)
+        mock_counter_buffer.reconcile.assert_not_called()
+
+    def test_bad_input(self):
+        for body in ({"postids": 20001}, {"hours": 0}, {"hours": "6"}):
+            response = lambda_handler({"body": json.dumps(body)}, None)
+            self.assertEqual(response['statusCode'], 400, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from lambda_functions.timeline_cache import TimelineCache
+
+
+class TestTimelineCache(unittest.TestCase):
+
+    def test_hit_only_at_the_stored_version(self):
+        cache = TimelineCache(size=10, ttl=60)
+        cache.put('u1', (None, 20), 3, 'body')
+
+        self.assertEqual(cache.get('u1', (None, 20), 3), 'body')
+        self.assertIsNone(cache.get('u1', ('cursor', 20), 3))
+        self.assertIsNone(cache.get('u2', (None, 20), 3))
+
+        # a newer version drops the stale entry
+        self.assertIsNone(cache.get('u1', (None, 20), 4))
+        self.assertEqual(len(cache), 0)
+
+    def test_expires_after_ttl(self):
+        cache = TimelineCache(size=10, ttl=15)
+        with patch('lambda_functions.timeline_cache.time.monotonic', return_value=100.0):
+            cache.put('u1', None, 1, 'body')
+        with patch('lambda_functions.timeline_cache.time.monotonic', return_value=110.0):
+            self.assertEqual(cache.get('u1', None, 1), 'body')
+        with patch('lambda_functions.timeline_cache.time.monotonic', return_value=116.0):
+            self.assertIsNone(cache.get('u1', None, 1))
+
+    def test_evicts_least_recently_used(self):
+        cache = TimelineCache(size=2, ttl=60)
+        cache.put('u1', None, 1, 'one')
+        cache.put('u2', None, 1, 'two')
+        cache.get('u1', None, 1)            # u1 is now the most recent
+        cache.put('u3', None, 1, 'three')
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('u2', None, 1))
+        self.assertEqual(cache.get('u1', None, 1), 'one')
+
+    def test_size_zero_disables(self):
+        cache = TimelineCache(size=0, ttl=60)
+        cache.put('u1', None, 1, 'body')
+        self.assertIsNone(cache.get('u1', None, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
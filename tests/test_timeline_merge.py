@@ -0,0 +1,177 @@
+import unittest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from lambda_functions import timeline_merge
+from lambda_functions.timeline_merge import AuthorPostCache, merge_keys, timeline_page
+
+
+def key(minute, postid):
+    return (datetime(2024, 5, 10, 12, minute, 0), postid)
+
+
+def row(postid, userid):
+    return (postid, userid, datetime(2024, 5, 10, 12, 0, 0), 'text', 'pic.jpg', None, 0, 0, userid + '_name')
+
+
+class TestMergeKeys(unittest.TestCase):
+
+    def test_merges_newest_first_and_stops_when_full(self):
+        lists = {
+            'a': ([key(50, 5), key(30, 3), key(10, 1)], True),
+            'b': ([key(40, 4), key(20, 2)], True),
+        }
+        keys, authors = merge_keys(lists, 3)
+        self.assertEqual([k[1] for k in keys], [5, 4, 3])
+        self.assertEqual(authors, ['a', 'b', 'a'])
+
+    def test_skips_keys_at_or_after_cursor(self):
+        lists = {
+            'a': ([key(50, 5), key(30, 3), key(10, 1)], True),
+            'b': ([key(40, 4), key(20, 2)], True),
+        }
+        keys, _ = merge_keys(lists, 10, after=key(40, 4))
+        self.assertEqual([k[1] for k in keys], [3, 2, 1])
+
+    def test_ties_on_dateposted_ordered_by_postid(self):
+        lists = {'a': ([key(30, 7)], True), 'b': ([key(30, 9)], True)}
+        keys, _ = merge_keys(lists, 2)
+        self.assertEqual([k[1] for k in keys], [9, 7])
+
+    def test_truncated_list_running_out_cannot_answer(self):
+        # 'b' has older posts than the cache holds, so anything older
+        # than its oldest cached key may be missing
+        lists = {
+            'a': ([key(50, 5), key(10, 1)], True),
+            'b': ([key(40, 4), key(30, 3)], False),
+        }
+        self.assertEqual([k[1] for k in merge_keys(lists, 3)[0]], [5, 4, 3])
+        self.assertIsNone(merge_keys(lists, 4))
+
+    def test_end_of_timeline(self):
+        lists = {'a': ([key(50, 5)], True), 'b': ([], True)}
+        keys, authors = merge_keys(lists, 10)
+        self.assertEqual([k[1] for k in keys], [5])
+        self.assertEqual(merge_keys({}, 10), ([], []))
+
+
+class TestAuthorPostCache(unittest.TestCase):
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_loads_only_missing_authors(self, mock_datatier):
+        mock_datatier.retrieve_all_rows.return_value = [
+            ('a', key(10, 1)[0], 1), ('a', key(30, 3)[0], 3), ('b', key(20, 2)[0], 2),
+        ]
+        cache = AuthorPostCache(size=2, ttl=60)
+
+        lists = cache.get_many(MagicMock(), {'a': 2, 'b': 1, 'c': 0})
+        self.assertEqual(lists['a'], ([key(30, 3), key(10, 1)], False))   # hit the size: truncated
+        self.assertEqual(lists['b'], ([key(20, 2)], True))
+        self.assertEqual(lists['c'], ([], True))
+
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertEqual(sql.count("UNION ALL"), 2)
+        self.assertEqual(params, ['a', 2, 'b', 2, 'c', 2])
+
+        mock_datatier.retrieve_all_rows.reset_mock()
+        cache.get_many(MagicMock(), {'a': 2, 'b': 1})
+        mock_datatier.retrieve_all_rows.assert_not_called()
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_changed_post_count_reloads(self, mock_datatier):
+        """An author who posted (or deleted a post) since their list was cached is re-read."""
+        mock_datatier.retrieve_all_rows.return_value = []
+        cache = AuthorPostCache(size=2, ttl=60)
+        cache.get_many(MagicMock(), {'a': 2, 'b': 1})
+
+        mock_datatier.retrieve_all_rows.reset_mock()
+        cache.get_many(MagicMock(), {'a': 3, 'b': 1, 'c': None})
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_args[0][2], ['a', 2, 'c', 2])
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_expired_and_evicted_entries_reload(self, mock_datatier):
+        mock_datatier.retrieve_all_rows.return_value = []
+        cache = AuthorPostCache(size=2, ttl=60, max_authors=2)
+
+        cache.get_many(MagicMock(), {'a': 0, 'b': 0, 'c': 0})
+        self.assertEqual(len(cache), 2)                # 'a' evicted
+
+        mock_datatier.retrieve_all_rows.reset_mock()
+        cache.get_many(MagicMock(), {'a': 0})
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_args[0][2], ['a', 2])
+
+        cache.ttl = 0
+        mock_datatier.retrieve_all_rows.reset_mock()
+        with patch('lambda_functions.timeline_merge.time.monotonic', return_value=1e12):
+            cache.get_many(MagicMock(), {'a': 0})
+        mock_datatier.retrieve_all_rows.assert_called_once()
+
+
+class TestTimelinePage(unittest.TestCase):
+
+    def make_cache(self):
+        cache = AuthorPostCache(size=10, ttl=60)
+        cache._put('me', (1e18, 2, [key(50, 5), key(10, 1)], True))
+        cache._put('friend', (1e18, 2, [key(40, 4), key(20, 2)], True))
+        return cache
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_page_hydrated_in_merge_order(self, mock_datatier):
+        cache = self.make_cache()
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [('me', 2), ('friend', 2)],                           # followees
+            [row(4, 'friend'), row(5, 'me'), row(2, 'friend')],  # hydrate, any order
+        ]
+
+        rows = timeline_page(MagicMock(), 'me', 3, cache=cache)
+
+        self.assertEqual([r[0] for r in rows], [5, 4, 2])
+        sql, params = mock_datatier.retrieve_all_rows.call_args[0][1:]
+        self.assertIn("p.postid IN (%s, %s, %s)", sql)
+        self.assertEqual(params, ['me', 'me', 5, 4, 2])
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_cursor_is_applied(self, mock_datatier):
+        cache = self.make_cache()
+        mock_datatier.retrieve_all_rows.side_effect = [[('me', 2), ('friend', 2)], [row(2, 'friend'), row(1, 'me')]]
+
+        rows = timeline_page(MagicMock(), 'me', 3, after=('2024-05-10 12:40:00', 4), cache=cache)
+        self.assertEqual([r[0] for r in rows], [2, 1])
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_block_set_authors_left_out(self, mock_datatier):
+        """Followees in the block set -- blocked by, or blocking, the reader -- are not merged."""
+        cache = self.make_cache()
+        mock_datatier.retrieve_all_rows.side_effect = [[('me', 2), ('friend', 2)], [row(5, 'me'), row(1, 'me')]]
+
+        rows = timeline_page(MagicMock(), 'me', 3, cache=cache, blocked=frozenset(['friend']))
+
+        self.assertEqual([r[0] for r in rows], [5, 1])
+        self.assertNotIn("Blocked", mock_datatier.retrieve_all_rows.call_args_list[0][0][1])
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_own_new_post_shows_at_once(self, mock_datatier):
+        """The reader's post_count moved on, so their cached list is re-read before merging."""
+        cache = self.make_cache()
+        mock_datatier.retrieve_all_rows.side_effect = [
+            [('me', 3), ('friend', 2)],                           # followees
+            [('me', key(55, 6)[0], 6), ('me', key(50, 5)[0], 5), ('me', key(10, 1)[0], 1)],
+            [row(6, 'me'), row(5, 'me'), row(4, 'friend')],       # hydrate
+        ]
+
+        rows = timeline_page(MagicMock(), 'me', 3, cache=cache)
+
+        self.assertEqual([r[0] for r in rows], [6, 5, 4])
+        self.assertEqual(mock_datatier.retrieve_all_rows.call_args_list[1][0][2], ['me', 10])
+
+    @patch('lambda_functions.timeline_merge.datatier')
+    def test_deleted_post_invalidates_author_and_falls_back(self, mock_datatier):
+        cache = self.make_cache()
+        mock_datatier.retrieve_all_rows.side_effect = [[('me', 2), ('friend', 2)], [row(5, 'me'), row(2, 'friend')]]
+
+        self.assertIsNone(timeline_page(MagicMock(), 'me', 3, cache=cache))
+        self.assertEqual(len(cache), 1)       # 'friend' forgotten, 'me' kept
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,30 +1,23 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from lambda_functions.unblock_user import lambda_handler
 
 class TestUnblockUser(unittest.TestCase):
 
-    @patch('lambda_functions.unblock_user.boto3')
+    @patch('lambda_functions.unblock_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.unblock_user.datatier')
-    def test_unblock_user_success(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_unblock_user_success(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('blockee_id',)],              # 1. Blockee user exists (lookup by username)
-            [('blocker_id', 'blockee_id')]  # 2. Block relationship exists
+        mock_retrieve_one_row.side_effect = [
+            ('blockee_id',),  # 1. Blockee user exists (lookup by username)
+            (1,)              # 2. Block relationship exists
         ]
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1]
 
         # Prepare the test event
         event = {
@@ -40,26 +33,24 @@ class TestUnblockUser(unittest.TestCase):
         # Assert the response
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(json.loads(response['body'])['message'], 'Successfully unblocked user.')
-        mock_datatier.perform_action.assert_called_once()
-
-    @patch('lambda_functions.unblock_user.boto3')
+        mock_datatier.execute_batch.assert_called_once()
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertEqual(statements[0][1], ['blocker_id', 'blockee_id'])
+        self.assertIn("timeline_version", statements[1][0])
+        self.assertIn("block_version", statements[1][0])
+        self.assertEqual(statements[1][1], ['blocker_id', 'blockee_id'])
+
+    @patch('lambda_functions.unblock_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.unblock_user.datatier')
-    def test_unblock_nonexistent_relationship(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-
+    def test_unblock_nonexistent_relationship(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls to show no existing block
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('blockee_id',)],  # Blockee user exists
-            []                  # Block relationship does NOT exist
+        mock_retrieve_one_row.side_effect = [
+            ('blockee_id',),  # Blockee user exists
+            None              # Block relationship does NOT exist
         ]
 
         event = {
@@ -72,7 +63,7 @@ class TestUnblockUser(unittest.TestCase):
         response = lambda_handler(event, None)
         self.assertEqual(response['statusCode'], 404)
         self.assertEqual(json.loads(response['body'])['message'], 'Block relationship does not exist.')
-        mock_datatier.perform_action.assert_not_called()
+        mock_datatier.execute_batch.assert_not_called()
 
     def test_missing_parameters(self):
         event_no_blocker = {'body': json.dumps({'blockee_username': 'user2'})}
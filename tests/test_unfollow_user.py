@@ -1,35 +1,23 @@
 import unittest
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from lambda_functions.unfollow_user import lambda_handler
 
 class TestUnfollowUser(unittest.TestCase):
 
-    @patch('lambda_functions.unfollow_user.boto3')
+    @patch('lambda_functions.unfollow_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.unfollow_user.datatier')
-    def test_unfollow_user_success(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({
-                'host': 'test_host',
-                'port': 3306,
-                'username': 'test_user',
-                'password': 'test_password'
-            })
-        }
-
+    def test_unfollow_user_success(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('followee_id',)], # Followee exists
-            [('follower_id', 'followee_id')] # Relationship exists
+        mock_retrieve_one_row.side_effect = [
+            ('followee_id',),  # Followee exists
+            (1,)               # Relationship exists
         ]
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 3, 1]
 
         event = {
             'body': json.dumps({
@@ -42,29 +30,24 @@ class TestUnfollowUser(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         self.assertEqual(json.loads(response['body'])['message'], 'Successfully unfollowed user.')
 
-    @patch('lambda_functions.unfollow_user.boto3')
+        # The followee's posts leave the follower's home timeline
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertIn("DELETE FROM HomeTimeline", statements[1][0])
+        self.assertEqual(statements[1][1], ['follower_id', 'followee_id'])
+        self.assertIn("timeline_version", statements[2][0])
+        self.assertEqual(statements[2][1], ['follower_id'])
+
+    @patch('lambda_functions.unfollow_user.datatier_async.retrieve_one_row', new_callable=AsyncMock)
     @patch('lambda_functions.unfollow_user.datatier')
-    def test_unfollow_nonexistent_relationship(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({
-                'host': 'test_host',
-                'port': 3306,
-                'username': 'test_user',
-                'password': 'test_password'
-            })
-        }
-        
+    def test_unfollow_nonexistent_relationship(self, mock_datatier, mock_retrieve_one_row):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
 
         # Mock database calls
-        mock_datatier.retrieve_all_rows.side_effect = [
-            [('followee_id',)], # Followee exists
-            [] # Relationship does not exist
+        mock_retrieve_one_row.side_effect = [
+            ('followee_id',),  # Followee exists
+            None               # Relationship does not exist
         ]
 
         event = {
@@ -5,23 +5,15 @@ from lambda_functions.unretweet import lambda_handler
 
 class TestUnretweet(unittest.TestCase):
 
-    @patch('lambda_functions.unretweet.boto3')
     @patch('lambda_functions.unretweet.datatier')
-    def test_unretweet_success(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-        
+    def test_unretweet_success(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         
         # Mock database calls
         mock_datatier.retrieve_all_rows.return_value = [("user1", 20001)] # Retweet exists
-        mock_datatier.perform_action.return_value = None
+        mock_datatier.execute_batch.return_value = [1, 1, 1]
         
         event = {'body': json.dumps({'userid': 'user1', 'postid': 20001})}
         response = lambda_handler(event, None)
@@ -29,19 +21,16 @@ class TestUnretweet(unittest.TestCase):
         self.assertEqual(response["statusCode"], 200)
         self.assertEqual(json.loads(response["body"])["message"], "Successfully removed retweet.")
 
-    @patch('lambda_functions.unretweet.boto3')
+        statements = mock_datatier.execute_batch.call_args[0][1]
+        self.assertIn("WHERE ROW_COUNT() > 0", statements[1][0])
+        self.assertIn("retweet_count = retweet_count - 1", statements[1][0])
+        self.assertEqual(statements[1][1], [20001, 0])
+
     @patch('lambda_functions.unretweet.datatier')
-    def test_unretweet_nonexistent(self, mock_datatier, mock_boto3):
-        # Mock Secrets Manager
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
-        
+    def test_unretweet_nonexistent(self, mock_datatier):
         # Setup mock database connection
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         
         # Mock database calls
         mock_datatier.retrieve_all_rows.return_value = [] # Retweet does not exist
@@ -5,18 +5,11 @@ from lambda_functions.update_profile import lambda_handler
 
 class TestUpdateProfile(unittest.TestCase):
 
-    @patch('lambda_functions.update_profile.boto3')
     @patch('lambda_functions.update_profile.datatier')
-    def test_successful_full_update(self, mock_datatier, mock_boto3):
+    def test_successful_full_update(self, mock_datatier):
         """Tests updating all possible profile fields at once."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         mock_datatier.perform_action.return_value = None
 
         # Prepare event with all updateable fields
@@ -46,18 +39,11 @@ class TestUpdateProfile(unittest.TestCase):
         self.assertIn("WHERE userid = %s", args[1])
         self.assertIn("123", args[2]) # Check that the userid is the last parameter
 
-    @patch('lambda_functions.update_profile.boto3')
     @patch('lambda_functions.update_profile.datatier')
-    def test_successful_partial_update(self, mock_datatier, mock_boto3):
+    def test_successful_partial_update(self, mock_datatier):
         """Tests updating only a single profile field."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         mock_datatier.perform_action.return_value = None
 
         # Event with only 'bio' being updated
@@ -84,18 +70,11 @@ class TestUpdateProfile(unittest.TestCase):
         self.assertEqual(response["statusCode"], 400)
         self.assertIn("userid missing", json.loads(response["body"])["message"])
 
-    @patch('lambda_functions.update_profile.boto3')
     @patch('lambda_functions.update_profile.datatier')
-    def test_ignores_empty_string_values(self, mock_datatier, mock_boto3):
+    def test_ignores_empty_string_values(self, mock_datatier):
         """Tests that empty strings are ignored and not included in the update."""
-        # Mock dependencies
-        mock_secrets_manager = MagicMock()
-        mock_boto3.client.return_value = mock_secrets_manager
-        mock_secrets_manager.get_secret_value.return_value = {
-            'SecretString': json.dumps({'host': 'h', 'port': 1, 'username': 'u', 'password': 'p'})
-        }
         mock_conn = MagicMock()
-        mock_datatier.get_dbConn.return_value = mock_conn
+        mock_datatier.checkout_dbConn_from_secret.return_value = mock_conn
         
         # Event with a valid bio but an empty username
         event = {"body": json.dumps({"userid": "123", "bio": "A valid bio", "username": ""})}
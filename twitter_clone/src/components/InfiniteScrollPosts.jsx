@@ -17,9 +17,13 @@ import CircularProgress from '@mui/material/CircularProgress';
 import axios from 'axios';
 import { useUser } from '../context/UserContext';
 
-const getRecentTweets = async ({ userid, postid, profileUsername }) => {
+const PAGE_SIZE = 10;
+
+// Fetches one page of posts; pass the nextCursor of the previous page
+// to get the following one (nextCursor is null on the last page).
+const getRecentTweets = async ({ userid, postid, profileUsername, cursor }) => {
   if (!userid) {
-    return [];
+    return { tweets: [], nextCursor: null };
   }
 
   const baseurl = import.meta.env.VITE_API_BASE_URL;
@@ -29,66 +33,60 @@ const getRecentTweets = async ({ userid, postid, profileUsername }) => {
   try {
     const response = await axios.post(
       url,
-      { userid: userid, postid: postid, profileUsername: profileUsername },
+      {
+        userid: userid,
+        postid: postid,
+        profileUsername: profileUsername,
+        limit: PAGE_SIZE,
+        cursor: cursor,
+        include_counts: true
+      },
       { headers: { 'Content-Type': 'application/json' } }
     );
-    const tweets = response.data;
-
-    const allPostIds = tweets.map(post => post.post_id);
-    const countsUrl = baseurl + 'tweets/counts';
-    const countsResponse = await axios.post(countsUrl, { postids: allPostIds }, {
-      headers: { 'Content-Type': 'application/json' }
-    });
-
-    const { likes, retweets, comment_counts } = countsResponse.data;
-
-    const enrichedTweets = tweets.map(tweet => {
-      const postId = tweet.post_id;
-
-      const likeEntry = likes.find(entry => entry.originalpost === postId);
-      const likeCount = likeEntry ? likeEntry.like_count : 0;
-
-      const retweetEntry = retweets.find(entry => entry.originalpost === postId);
-      const retweetCount = retweetEntry ? retweetEntry.retweet_count : 0;
-
-      const commentEntry = comment_counts.find(entry => entry.reply_to_postid === postId);
-      const commentCount = commentEntry ? commentEntry.comment_count : 0;
-
-
-
-      return {
-        postid: postId,
-        poster: tweet.userid,
-        text: tweet.content || tweet.text,
-        image: tweet.image || null,
-        likes: likeCount,
-        retweets: retweetCount,
-        replies: commentCount,
-        liked: Boolean(Number(tweet.liked)),
-        retweeted: Boolean(Number(tweet.retweeted)),
-        username: tweet.username
-      };
-
-      // [ {} ]
-    });
-
-    // console.log(enrichedTweets)
+    const tweets = response.data.posts;
+    const nextCursor = response.data.next_cursor;
+
+    const enrichedTweets = tweets.map(tweet => ({
+      postid: tweet.post_id,
+      poster: tweet.userid,
+      text: tweet.content || tweet.text,
+      image: tweet.image || null,
+      likes: tweet.like_count,
+      retweets: tweet.retweet_count,
+      replies: tweet.comment_count,
+      liked: Boolean(Number(tweet.liked)),
+      retweeted: Boolean(Number(tweet.retweeted)),
+      username: tweet.username
+    }));
 
-    return enrichedTweets;
+    return { tweets: enrichedTweets, nextCursor: nextCursor };
   } catch (error) {
     console.error('API Error:', error);
-    return [];
+    return { tweets: [], nextCursor: null };
   }
 };
 
+const initialPostStates = (tweets) => {
+  const states = {};
+  tweets.forEach(tweet => {
+    states[tweet.postid] = {
+      liked: tweet.liked,
+      retweeted: tweet.retweeted,
+      likes: tweet.likes,
+      retweets: tweet.retweets,
+      replies: tweet.replies
+    };
+  });
+  return states;
+};
+
 function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profileUsername }) {
   const { user, updateUser } = useUser();
-  const [allPosts, setAllPosts] = useState([]);
-  const [originalPosts, setOriginalPosts] = useState([]);
   const [visiblePosts, setVisiblePosts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [isFetching, setIsFetching] = useState(false);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const containerRef = useRef(null);
-  const CHUNK_SIZE = 10;
     
   // Add state for tracking post interactions
   const [postStates, setPostStates] = useState({});
@@ -99,27 +97,15 @@ function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profile
     const fetchData = async () => {
       setIsFetching(true);
 
-      const tweets = await getRecentTweets({ 
+      const { tweets, nextCursor } = await getRecentTweets({ 
         userid: user?.email, 
         postid: rootPost ? rootPost.postid : undefined,
         profileUsername: rootPost ? undefined : profileUsername // either is a username or undefined
       });
 
-      setAllPosts(tweets);
-      setVisiblePosts(tweets ? tweets.slice(0, CHUNK_SIZE) : null);
-      
-      // Initialize post states
-      const initialStates = {};
-      tweets.forEach(tweet => {
-        initialStates[tweet.postid] = {
-          liked: tweet.liked,
-          retweeted: tweet.retweeted,
-          likes: tweet.likes,
-          retweets: tweet.retweets,
-          replies: tweet.replies
-        };
-      });
-      setPostStates(initialStates);
+      setVisiblePosts(tweets);
+      setNextCursor(nextCursor);
+      setPostStates(initialPostStates(tweets));
       
       setIsFetching(false);
     };
@@ -136,13 +122,22 @@ function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profile
       container.addEventListener('scroll', handleScroll);
       return () => container.removeEventListener('scroll', handleScroll);
     }
-  }, [visiblePosts]);
+  }, [visiblePosts, nextCursor, isLoadingMore]);
+
+  const loadMorePosts = async () => {
+    setIsLoadingMore(true);
 
-  const loadMorePosts = () => {
-    setVisiblePosts((prev) => {
-      const nextChunk = allPosts.slice(prev.length, prev.length + CHUNK_SIZE);
-      return [...prev, ...nextChunk];
+    const page = await getRecentTweets({
+      userid: user?.email,
+      postid: rootPost ? rootPost.postid : undefined,
+      profileUsername: rootPost ? undefined : profileUsername,
+      cursor: nextCursor
     });
+
+    setVisiblePosts((prev) => [...prev, ...page.tweets]);
+    setPostStates((prev) => ({ ...initialPostStates(page.tweets), ...prev }));
+    setNextCursor(page.nextCursor);
+    setIsLoadingMore(false);
   };
 
   const handleScroll = () => {
@@ -151,7 +146,7 @@ function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profile
 
     const { scrollTop, scrollHeight, clientHeight } = container;
     if (scrollHeight - scrollTop - clientHeight < 100) {
-      if (visiblePosts.length < allPosts.length) {
+      if (nextCursor && !isLoadingMore) {
         loadMorePosts();
       }
     }
@@ -255,16 +250,15 @@ function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profile
         headers: { 'Content-Type': 'application/json' }
       });
 
-      const updatedTweets = await getRecentTweets({ 
+      const { tweets: updatedTweets, nextCursor } = await getRecentTweets({ 
         userid: user?.email, 
         postid: undefined,
         profileUsername: profileUsername
       });
       setReload(true);
       setIsFetching(true);
-      setOriginalPosts(updatedTweets);
-      setAllPosts(updatedTweets);
-      setVisiblePosts(updatedTweets.slice(0, CHUNK_SIZE));
+      setVisiblePosts(updatedTweets);
+      setNextCursor(nextCursor);
 
     } catch (error) {
       console.error('Failed to delete post:', error);
@@ -394,7 +388,11 @@ function InfiniteScrollPosts({ rootPost, setRootPost, reload, setReload, profile
         );
       })}
 
-      {visiblePosts.length === allPosts.length && visiblePosts.length > 0 && (
+      {isLoadingMore && (
+        <CircularProgress sx={{ color: '#4CAF50' }} />
+      )}
+
+      {!nextCursor && visiblePosts.length > 0 && (
         <Typography textAlign="center" sx={{ mt: 2, color: 'gray' }}>
           🎉 You've reached the end!
         </Typography>